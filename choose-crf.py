@@ -2,16 +2,9 @@
 
 import logging
 import sys
-import json
-import subprocess
 from pathlib import Path
 from argparse import ArgumentParser
-from scenecut_extractor.__main__ import get_scenecuts
-from utils.FFmpegWrapper import FFProbeWrapper, FFmpegWrapper
-from utils.easyVmaf.FFmpeg import FFprobe
-from dotenv import find_dotenv, dotenv_values
-
-config = dotenv_values(find_dotenv())
+from utils.executor import get_executor
 
 ## Config values
 SCRIPT_DIR = Path(sys.path[0])
@@ -22,22 +15,22 @@ MODEL_PATH = EXTERNAL_DIR / "vmaf_v0.6.1.json"
 
 OUTPUT_DIR = SCRIPT_DIR / "output"
 
-TMP_DIR = SCRIPT_DIR / "tmp"
-EXTRACTS_DIR = TMP_DIR / "extracts"
-EXTRACTS_DIR.mkdir(parents=True, exist_ok=True)
-VMAF_DIR = TMP_DIR / "vmaf"
-VMAF_DIR.mkdir(parents=True, exist_ok=True)
-
 MIN_CRF = 23
 MAX_CRF = 30
 MIN_VMAF_SCORE = 85
 EXTRACT_DURATION = 45
+WINDOW_DURATION = 3
+VMAF_TOLERANCE = 0.5
 
 logger = logging.getLogger(__name__)
-handler = logging.StreamHandler()
-handler.setFormatter(logging.Formatter('%(asctime)s %(name)-12s %(levelname)-8s %(message)s'))
-logger.addHandler(handler)
-logger.setLevel(logging.DEBUG)
+
+
+def setup_logging():
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter('%(asctime)s %(name)-12s %(levelname)-8s %(message)s'))
+    for name in [__name__, 'utils']:
+        logging.getLogger(name).addHandler(handler)
+        logging.getLogger(name).setLevel(logging.DEBUG)
 
 # def video_duration(filepath):
 #     cmd = f"{config['ffprobe']} -v error -show_entries format=duration -of default=noprint_wrappers=1:nokey=1"
@@ -70,12 +63,137 @@ def parse_args():
     parser.add_argument('input', help="path of the input file")
     parser.add_argument('output', nargs='?', help="path of the output file")
     parser.add_argument('--extract-duration', type=int, default=EXTRACT_DURATION, help="the duration (in seconds) of the extract used to compute vmaf score")
+    parser.add_argument('--sampler', choices=['windows', 'extracts'], default='windows', help="sample the video with short windows stratified by scene score (default) or with 3 long extracts")
+    parser.add_argument('--window-duration', type=float, default=WINDOW_DURATION, help="the duration (in seconds) of the windows of the `windows` sampler")
+    parser.add_argument('--vmaf-tolerance', type=float, default=VMAF_TOLERANCE, help="windows are added until the standard error of their vmaf score is below this value")
+    parser.add_argument('--per-scene', action='store_true', help="choose a crf for each scene and encode the video with them")
+    parser.add_argument('--per-scene-mode', choices=['zones', 'segments'], default='zones', help="encode the per-scene crfs in one pass with x264 zones (default) or segment by segment in parallel")
 
     args = parser.parse_args()
     
     return args
 
 
+def sample_windows(input, scenescores, duration, tolerance, probe_crf, model, ffmpeg_path, output):
+    """Stage : composite clip of stratified windows of `input` (see utils/sampling.py), measured with
+    encodes at `probe_crf` (the middle of the crf range). `ffmpeg_path` is the binary of the settings,
+    given so that its identity is part of the key of the stage.
+    """
+    from utils.FFmpegWrapper import FFProbeWrapper, FFmpegWrapper
+    from utils.sampling import sample
+    from utils.vmaf_features import extract_features, score
+
+    ffmpeg = FFmpegWrapper()
+    ffprobe = FFProbeWrapper(str(input))
+
+    def measure(path):
+        encoded_path = path.parent / f"{path.stem}.crf{probe_crf}.mp4"
+        ffmpeg.encode(path, encoded_path, crf=probe_crf, mode='simple', audio=False)
+        features = extract_features(path, encoded_path, path.with_suffix('.npz'), models=[str(model)])
+        encoded_path.unlink()
+        path.with_suffix('.npz').unlink()
+        return score(features, model)[0]
+
+    windows, scores = sample(ffmpeg_path, input, output, scenescores, ffprobe.getVideoDuration(), ffprobe.getFrameRate(),
+                             measure, tolerance=tolerance, duration=duration)
+    logger.info(f"{len(windows)} windows ({len(windows) * duration:.0f}s) at {', '.join(f'{w:.1f}' for w in windows)}")
+    return {'windows': windows, 'scores': scores}
+
+
+def encode_extract(input, crf, mode, output):
+    """Stage : trial encode of an extract, without audio ; returns its size"""
+    from utils.FFmpegWrapper import FFmpegWrapper
+
+    FFmpegWrapper().encode(input, output, crf=crf, mode=mode, audio=False)
+    return Path(output).stat().st_size
+
+
+def vmaf_extract(reference, encoded):
+    """Stage : vmaf scores of a trial encode for several synchronisation offsets"""
+    from utils.FFmpegWrapper import FFmpegWrapper
+
+    return FFmpegWrapper().getVmaf(reference, encoded)
+
+
+def extract_start(middle_time, duration, full_duration):
+    """Start of the extract of `duration` seconds centered on `middle_time`, within the video"""
+    if duration > full_duration:
+        sys.exit(f"Error: the video is shorter ({full_duration} s) than the duration of the extract needed for quality check ({duration} s).")
+    return min(max(0, middle_time - duration / 2), full_duration - duration)
+
+
+def encode_per_scene(ffmpeg, ffprobe, input, output, scenescores, workspace, single_crf, mode='zones'):
+    """Choose a crf for each scene on a short sample, encode the video with them and report the
+    vmaf score of each segment of the result
+    """
+    from utils import scene_crf
+    from utils.audio import audio_options
+    from utils.command import ffmpeg as ffmpeg_command
+    from utils.muxing import muxing_options, TEMPORARY
+    from utils.vmaf_features import extract_features, score
+    from utils.thread_planner import get_jobs, get_threads
+
+    duration = ffprobe.getVideoDuration()
+    frame_rate = ffprobe.getFrameRate()
+    segments = scene_crf.scene_segments(scenescores, duration)
+    logger.info(f"{len(segments)} segments")
+
+    samples = []
+    for i, segment in enumerate(segments):
+        samples.append(workspace / f"{input.stem}.segment{i:04d}{input.suffix}")
+        ffmpeg.getExtractAtTime(input, scene_crf.sample_start(segment), scene_crf.SAMPLE_DURATION, samples[-1])
+
+    def encode_sample(i, crf):
+        # the samples are cut from the source and encoded as is : a single libvmaf pass, without
+        # the synchronisation search of getVmaf, scores them
+        encoded_path = workspace / f"{samples[i].stem}.crf{crf}.mp4"
+        features_path = encoded_path.with_suffix('.npz')
+        ffmpeg.encode(samples[i], encoded_path, crf=crf, mode='simple', audio=False)
+        features = extract_features(samples[i], encoded_path, features_path, models=[str(MODEL_PATH)])
+        _, pooled = score(features, MODEL_PATH)
+        size = encoded_path.stat().st_size
+        for path in [encoded_path, features_path]:
+            path.unlink()
+        return size, pooled['harmonic_mean']
+
+    crfs = scene_crf.choose_crfs(segments, encode_sample, MIN_CRF, MAX_CRF, MIN_VMAF_SCORE)
+
+    if mode == 'zones':
+        base_crf = sorted(crfs)[len(crfs) // 2]
+        zones = scene_crf.x264_zones(segments, crfs, base_crf, frame_rate)
+        # zones are an x264 option : the encoder is set explicitly rather than left to ffmpeg's default
+        options = {'-c:v': 'libx264', **({'-x264-params': f"zones={zones}"} if zones else {})}
+        ffmpeg.encode(input, output, crf=base_crf, mode='simple', options=options)
+    else:
+        video_path = workspace / f"{input.stem}.segments.mp4"
+        # the concatenated segments are only an intermediate file : their muxing is left to the final output
+        scene_crf.encode_segments(ffmpeg.bin, input, video_path, segments, crfs, workspace.path,
+                                  threads=get_threads('encode', scene_crf.SEGMENT_THREADS), jobs=get_jobs('encode', None), muxing=TEMPORARY)
+        # the audio of the source is added back to the concatenated segments
+        audio_stream = ffprobe.getAudioStream()
+        command = ffmpeg_command(ffmpeg.bin).with_input(video_path).with_input(input) \
+            .with_options({'-map': ['0:v:0', '1:a:0'] if audio_stream else '0:v:0', '-c:v': 'copy', **audio_options(audio_stream),
+                          **muxing_options(duration=duration, frame_rate=frame_rate, audio=audio_stream is not None)})
+        get_executor().run(command.with_output(output).argv(), check=True)
+
+    features = extract_features(input, output, workspace / f"{input.stem}.features.npz", models=[str(MODEL_PATH)])
+    frame_scores, _ = score(features, MODEL_PATH)
+    stats = scene_crf.segment_scores(frame_scores, segments, frame_rate)
+    for stat, crf in zip(stats, crfs):
+        stat['crf'] = crf
+
+    with open(OUTPUT_DIR / f"{input.stem}.segments.csv", 'w') as fd:
+        fd.write(';'.join(['start', 'end', 'crf', 'vmaf mean', 'vmaf harmonic mean', 'vmaf min']) + '\n')
+        for stat in stats:
+            fd.write(';'.join(str(stat[k]) for k in ['start', 'end', 'crf', 'mean', 'harmonic_mean', 'min']) + '\n')
+
+    summary = scene_crf.distribution(stats)
+    print(f"per-scene crf ({mode}) : {len(segments)} segments, crf {min(crfs)}-{max(crfs)} (single crf : {single_crf})")
+    print(f"segment vmaf harmonic means : worst {summary['worst']:.2f}, p10 {summary['p10']:.2f}, median {summary['median']:.2f}, best {summary['best']:.2f}")
+    print(f"size : {output.stat().st_size} bytes ({output.stat().st_size / input.stat().st_size * 100:.1f} % of the source)")
+    return crfs, stats
+
+
 # def compute_scenescores(input, output):
 #     input = Path(input)
 #     output = Path(output)
@@ -107,31 +225,55 @@ if __name__ == '__main__':
     
     args = parse_args()
 
+    from utils.FFmpegWrapper import FFProbeWrapper, FFmpegWrapper
+    from utils.rd import sweep, target_crf
+    from utils.workspace import Workspace
+    from utils.pipeline import Pipeline, binary
+    from utils.thread_planner import get_jobs, get_threads
+    from utils.jobpool import job_threads
+    from utils import stages
+
+    setup_logging()
+    OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+
     # initialize variables
     input = Path(args.input)
     video_name = input.stem
-    video_ext = input.suffix
     extract_d = args.extract_duration
     ffmpeg = FFmpegWrapper()
     ffprobe = FFProbeWrapper(args.input)
     csv_path = OUTPUT_DIR / f"{video_name}.csv"
 
-    # compute scenescores
-    scenescores = ffmpeg.getScenescores(args.input)
-
-    # select ? scenescore
-    selected_scores = [scenescores[1], scenescores[int(len(scenescores) / 2)], scenescores[-1]]
-
-    # extract the videos
-    for i in range(len(selected_scores)):
-        scene = selected_scores[i]
-        scene['extract_path'] = EXTRACTS_DIR / f"{video_name}.extract.t{scene['pts_time']:.2f}-{extract_d}s{video_ext}"
-        ffmpeg.getExtractAroundTime(input, scene['pts_time'], extract_d, scene['extract_path'])
-
-    # start encoding extract from worst to best crf and compute vmaf score until min vmaf score is attained
+    # the scene scores, extracts, trial encodes and vmaf scores are memoized stages (utils/pipeline.py) :
+    # running the script again with another target or crf range only encodes what is missing,
+    # and the encodes of the extracts at one crf run concurrently
+    pipeline = Pipeline(jobs=get_jobs('encode', None))
+    duration = pipeline.stage('duration', stages.duration, input=input)
+    scenescores = pipeline.stage('scenescores', stages.scenescores, input=input)
+    keyframes = pipeline.stage('keyframes', stages.keyframes, input=input)
+
+    if args.sampler == 'windows':
+        # one composite clip of short windows stratified by scene score, long enough for the
+        # vmaf score of a probe encode to be known within the tolerance
+        windows = pipeline.stage('windows', sample_windows, suffix='.mp4', input=input, scenescores=scenescores,
+                                 duration=args.window_duration, tolerance=args.vmaf_tolerance, probe_crf=(MIN_CRF + MAX_CRF) // 2,
+                                 model=MODEL_PATH, ffmpeg_path=binary(ffmpeg.bin))
+        pipeline.run([windows])
+        selected_scores = [{'pts_time': f"{len(pipeline.value(windows)['windows'])} windows", 'extract': windows}]
+    else:
+        pipeline.run([duration, scenescores])
+        scores = pipeline.value(scenescores)
+        # select ? scenescore
+        selected_scores = [scores[1], scores[int(len(scores) / 2)], scores[-1]]
+
+        # extract the videos
+        for scene in selected_scores:
+            start = extract_start(scene['pts_time'], extract_d, pipeline.value(duration))
+            scene['extract'] = pipeline.stage('extract', stages.extract, suffix=input.suffix, input=input, keyframes=keyframes, start=start, duration=extract_d)
+
+    # sweep the crf values of each mode and compute the vmaf score of the extracts, the crf points
+    # being placed where the crf giving the min vmaf score is still uncertain (see utils/rd.py)
     # (opt : compute filesize gain)
-    crf = 30
-    vmaf_score = 0
     csv_headers = [
         'crf',
         'time',
@@ -144,34 +286,40 @@ if __name__ == '__main__':
     with open(csv_path, 'w') as fd:
         fd.write(';'.join(csv_headers) + '\n')
 
-    while vmaf_score < 85 and crf >= 23:
-        
-        for i in range(len(selected_scores)):
-            scene = selected_scores[i]
-            scene['encoded_path'] = scene['extract_path'].parent / f"{scene['extract_path'].stem}.crf{crf}.mp4"
-            
-            infos = [crf, scene['pts_time']]
-
-            ffmpeg.encode(scene['extract_path'], scene['encoded_path'], crf=crf, mode='simple')
-            logger.debug('encode executed, will get vmaf')
-            scores = ffmpeg.getVmaf(scene['extract_path'], scene['encoded_path'])
+    def encode_extracts(crf, mode):
+        """Encode every extract, return their total size and their mean vmaf score"""
+        # the encodes run with the threads of the plan of this host, easyVmaf lets ffmpeg use every core
+        encodes = [pipeline.stage('encode', encode_extract, suffix='.mp4', cores=job_threads(get_threads('encode')), input=scene['extract'], crf=crf, mode=mode)
+                   for scene in selected_scores]
+        vmafs = [pipeline.stage('vmaf', vmaf_extract, cores=job_threads(0), reference=scene['extract'], encoded=encoded)
+                 for scene, encoded in zip(selected_scores, encodes)]
+        sizes_and_scores = pipeline.run([*encodes, *vmafs])
+
+        vmaf_scores = []
+        for scene, scores in zip(selected_scores, sizes_and_scores[len(encodes):]):
             with open(csv_path, 'a') as fd:
                 for score in scores:
-                    data = map(lambda elt: str(elt), [*infos, 'simple', *score])
+                    data = map(lambda elt: str(elt), [crf, scene['pts_time'], mode, *score.values()])
                     fd.write(';'.join(data) + '\n')
 
-            ffmpeg.encode(scene['extract_path'], scene['encoded_path'], crf=crf)
-            scores = ffmpeg.getVmaf(scene['extract_path'], scene['encoded_path'])
-            with open(csv_path, 'a') as fd:
-                for score in scores:
-                    data = map(lambda elt: str(elt), [*infos, 'complex', *score])
-                    fd.write(';'.join(data) + '\n')
+            # the score of the best synchronised offset
+            vmaf_scores.append(max(score['harmonic mean'] for score in scores))
+        return sum(sizes_and_scores[:len(encodes)]), sum(vmaf_scores) / len(vmaf_scores)
+
+    chosen_crf = {}
+    for mode in ['simple', 'complex']:
+        curve = sweep(lambda crf: encode_extracts(crf, mode), MIN_CRF, MAX_CRF, target=MIN_VMAF_SCORE)
+        chosen_crf[mode] = target_crf(curve, MIN_VMAF_SCORE, MIN_CRF, MAX_CRF)
+        logger.info(f"{mode} : crf {chosen_crf[mode]} for a vmaf score of {MIN_VMAF_SCORE} ({len(curve)} encodes)")
 
     # encode video
+    if args.per_scene:
+        output = Path(args.output) if args.output else OUTPUT_DIR / f"{video_name}.per-scene.mp4"
+        with Workspace(f"choose-crf.{input.stem}", size_hint=input.stat().st_size) as workspace:
+            encode_per_scene(ffmpeg, ffprobe, input, output, pipeline.run([scenescores])[0], workspace, chosen_crf['simple'], args.per_scene_mode)
 
-    # clean tmp dir
     # (opt : erase original file)
 
     # display results (choice of crf, vmaf scores, filesizes comparison, command line)
 
-    print("end of script")
\ No newline at end of file
+    print("end of script")
@@ -1,10 +1,28 @@
 #!/usr/local/anaconda3/envs/vmaf/bin/python
 
 import sys
-import subprocess
+import json
+import shutil
+import argparse
+import atexit
+import logging
 from time import time
+from functools import partial
 from pathlib import Path
-from datetime import datetime
+from datetime import datetime, timedelta
+from utils.transfer import open_transfer
+from utils.ffmpeg_scenescores import get_sorted_scenescores
+from utils.size_prediction import select_sample_times, predict_ratio, should_skip, log_prediction, SAMPLE_COUNT, SAMPLE_DURATION
+from utils.catalogue import Catalogue, fingerprint, profile_hash
+from utils.command import FFmpegCommand
+from utils.audio import probe_audio, audio_options, run_encode
+from utils.muxing import muxing_options
+from utils.workspace import Workspace, atomic_output
+from utils.settings import get_settings
+from utils.metrics import Registry, track, serve, DEFAULT_PORT
+from utils import triage, planner
+from utils.dedup import SignatureIndex, signature as video_signature, DETAIL_FRAME_COUNT
+from utils.executor import get_executor
 
 
 SCRIPT_DIR = Path(sys.path[0])
@@ -14,25 +32,211 @@ ENCODED_VIDEO_DIR = SCRIPT_DIR / "tmp" / "encoded"
 ORIGINAL_VIDEO_DIR.mkdir(parents=True, exist_ok=True)
 ENCODED_VIDEO_DIR.mkdir(parents=True, exist_ok=True)
 FFMPEG_BIN = SCRIPT_DIR / "external" / "ffmpeg"
+FFPROBE_BIN = SCRIPT_DIR / "external" / "ffprobe"
+VIDEOS_REMOTE = "murrutia@axone.utc.fr:/var/www/resources/videos"
+# ffprobe of the server, for the triage of the sources before their download
+REMOTE_FFPROBE = "ffprobe"
 
 log_path = SCRIPT_DIR / "output" / "encoding.log"
+catalogue_path = SCRIPT_DIR / "output" / "catalogue.sqlite"
+size_gate_log_path = SCRIPT_DIR / "output" / "size-gate.csv"
+metrics_path = SCRIPT_DIR / "output" / "metrics.prom"
+
+CRF = 27
+MAX_RATIO = 0.9
+# compute the VMAF score of the size prediction samples (with the `vmaf_HD` model of the .env file) ;
+# off by default, it adds a VMAF run to every sample of every video
+SAMPLES_VMAF = False
+# sources whose H.264 equivalent bits per pixel per frame is below MIN_BPP are already efficient :
+# they are deferred to the end of the queue ('defer') or not processed at all ('skip')
+MIN_BPP = triage.MIN_BPP
+TRIAGE_ACTION = 'defer'
+# order of the queue : biggest expected savings first ('savings'), or longest jobs first ('makespan'),
+# which finishes the backlog sooner when several machines share it
+QUEUE_ORDER = 'savings'
+# muxing of the final encodes (see utils/muxing.py) : 'reserve' writes the moov atom in space reserved
+# at the start of the file instead of rewriting the whole file after the encode like 'faststart'
+MUXING = 'reserve'
+
+logger = logging.getLogger(__name__)
+
+metrics = Registry()
+QUEUE_DEPTH = metrics.gauge('encode_queue_depth', "Videos of the queue still to process")
+IN_FLIGHT = metrics.gauge('encode_jobs_in_flight', "Jobs running, by stage", ['stage'])
+STAGE_STARTED = metrics.gauge('encode_stage_started_timestamp_seconds', "Start time of the last job of each stage", ['stage'])
+STAGE_SECONDS = metrics.histogram('encode_stage_seconds', "Duration of the jobs of each stage", [1, 10, 30, 60, 300, 900, 1800, 3600, 7200], ['stage'])
+FAILURES = metrics.counter('encode_failures_total', "Failed jobs, by stage", ['stage'])
+VIDEOS = metrics.counter('encode_videos_total', "Processed videos, by outcome", ['status'])
+DUPLICATES = metrics.counter('encode_duplicates_total', "Copies of videos already processed, by kind of match", ['match'])
+ENCODE_FPS = metrics.gauge('encode_fps', "Frames per second of the last encode")
+ENCODE_FPS_HISTOGRAM = metrics.histogram('encode_fps_distribution', "Frames per second of the encodes", [5, 10, 25, 50, 100, 200, 400])
+BYTES_SAVED = metrics.counter('encode_bytes_saved_total', "Bytes saved on the server by the uploaded encodes")
+SIZE_RATIO = metrics.histogram('encode_size_ratio', "Encoded size / original size", [0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0, 1.2])
+PREDICTION_ERROR = metrics.histogram('encode_size_prediction_error', "Actual - predicted size ratio", [-0.2, -0.1, -0.05, 0, 0.05, 0.1, 0.2])
+VMAF = metrics.histogram('encode_sample_vmaf', "VMAF harmonic mean of the size prediction samples", [60, 70, 80, 85, 90, 93, 95, 97, 99])
+TRANSFER_BYTES = metrics.counter('transfer_bytes_total', "Bytes transferred to and from the server")
+TRANSFER_SECONDS = metrics.counter('transfer_seconds_total', "Time spent transferring")
+TRANSFER_THROUGHPUT = metrics.gauge('transfer_throughput_bytes_per_second', "Average throughput of the transfers of the last run")
+
+
+def read_queue(input):
+    with open(input, 'r') as fd:
+        return [line.strip() for line in fd if line.strip()]
+
+
+def next_pending_video(input, transfer, catalogue):
+    """First video of the queue that is new, changed since its last encoding, or encoded with another profile"""
+    names = read_queue(input)
+    listing = transfer.list(names)
+    pending = catalogue.pending(names, listing, profile_hash(encoding_params()))
+    print(f"{len(pending)} videos to process out of {len(names)}")
+    pending = triage_queue(pending, listing, transfer, catalogue)
+    QUEUE_DEPTH.set(len(pending))
+    return pending[0] if pending else None
+
+
+def probe_sources(pending, listing, transfer, catalogue):
+    """Size and triage info of each pending video, from a probe of each one (cached in the catalogue)"""
+    sources = {}
+    for name in pending:
+        size, mtime = listing[name]['size'], listing[name]['mtime']
+        info = catalogue.get_probe(name, size, mtime)
+        if info is None:
+            probe = transfer.probe(name, REMOTE_FFPROBE)
+            info = triage.video_info(probe) if probe else None
+            if info:
+                catalogue.record_probe(name, size, mtime, info)
+        sources[name] = (size, info)
+    return sources
+
+
+def target_bpp(catalogue):
+    """Bits per pixel of the profile, learnt from the videos already encoded"""
+    return triage.calibrate([(results.get('equivalent_bpp'), ratio) for ratio, results in catalogue.encoded()])
+
+
+def cost_models(catalogue):
+    """Encode and VMAF cost models learnt from the timings of the videos already encoded"""
+    encodes, vmafs = [], []
+    for _, results in catalogue.encoded():
+        info = results.get('info')
+        if info and results.get('encode_seconds'):
+            encodes.append((info, results.get('crf', CRF), 'medium', results['encode_seconds']))
+        if info and results.get('vmaf_seconds'):
+            vmafs.append(({**info, 'duration': results['sample_seconds']}, results.get('crf', CRF), 'medium', results['vmaf_seconds']))
+    return planner.CostModel('encode').fit(encodes), planner.CostModel('vmaf').fit(vmafs)
+
+
+def job_cost(encode_model, vmaf_model):
+    """Seconds of the processing of a video from its triage info : the size prediction samples
+    (encodes and VMAF) and the full encode
+    """
+    def cost(info):
+        if not planner.pixels(info):
+            return None
+        samples = {**info, 'duration': min(info['duration'], SAMPLE_COUNT * SAMPLE_DURATION)}
+        seconds = encode_model.predict(info, CRF) + encode_model.predict(samples, CRF)
+        return seconds + (vmaf_model.predict(samples, CRF) if SAMPLES_VMAF else 0)
+    return cost
+
+
+def triage_queue(pending, listing, transfer, catalogue):
+    """Sort the pending videos by expected savings (or longest first, see QUEUE_ORDER).
+    The already efficient videos are deferred to the end of the queue, or skipped.
+    """
+    sources = probe_sources(pending, listing, transfer, catalogue)
+    queue, below = triage.triage(sources, MIN_BPP, target_bpp(catalogue))
+    if QUEUE_ORDER == 'makespan':
+        cost = job_cost(*cost_models(catalogue))
+        costs = {name: cost(sources[name][1]) for name in queue}
+        queue = planner.lpt({name: c for name, c in costs.items() if c is not None})[0] + [name for name, c in costs.items() if c is None]
+    if TRIAGE_ACTION != 'skip':
+        return queue + below
+
+    for name in below:
+        size, info = sources[name]
+        print(f"{name} : {triage.equivalent_bpp(info):.3f} bpp, already efficient, skipped")
+        catalogue.record(name, {'size': size, 'mtime': listing[name]['mtime'], 'partial_hash': None}, encoding_params(),
+                         ffmpeg_version(), 'triaged', size, results={'triage': info})
+        VIDEOS.inc(status='triaged')
+    return queue
+
+
+def plan_backlog(input, transfer, catalogue, workers=1):
+    """Print the ETA and the expected savings of the backlog on `workers` machines, without processing anything"""
+    names = read_queue(input)
+    listing = transfer.list(names)
+    pending = catalogue.pending(names, listing, profile_hash(encoding_params()))
+    sources = probe_sources(pending, listing, transfer, catalogue)
+    target = target_bpp(catalogue)
+    queue, below = triage.triage(sources, MIN_BPP, target)
+    jobs = {name: (sources[name][0], triage.expected_ratio(sources[name][1], target)) for name in queue + (below if TRIAGE_ACTION != 'skip' else [])}
+
+    encode_model, vmaf_model = cost_models(catalogue)
+    cost = job_cost(encode_model, vmaf_model)
+    # the workers take the jobs in the order of the queue
+    order = None if QUEUE_ORDER == 'makespan' else list(jobs)
+    report = planner.plan(jobs, lambda name: cost(sources[name][1]), workers, order=order)
+
+    print(f"{report['jobs']} videos to process out of {len(names)} ({len(below)} already efficient, {report['jobs'] - report['costed']} without a cost estimate)")
+    print(f"cost model : {encode_model.samples} encodes and {vmaf_model.samples} VMAF computations recorded")
+    print(f"processing time : {timedelta(seconds=round(report['cpu_seconds']))}")
+    print(f"on {workers} worker(s), {'longest first' if order is None else 'biggest savings first'} : {timedelta(seconds=round(report['makespan']))}, ETA {report['eta'].strftime('%Y-%m-%d %H:%M')}")
+    print(f"expected savings : {convert_bytes(report['savings'])}")
+    return report
+
+
+def find_duplicate(video_name, original_fingerprint, duration, signature, detail, catalogue, index):
+    """Video already processed with the current profile that this one is a copy of, as `(entry, match)` :
+    - `exact` : the same file
+    - `encoded` : one of our encodes (a re-upload of a video already processed)
+    - `near` : the same frames, at another resolution or bitrate (a re-export), confirmed on the
+      detailed signatures
+    or `(None, None)`
+    """
+    profile = profile_hash(encoding_params())
+    entry = catalogue.find_content(original_fingerprint['partial_hash'], original_fingerprint['size'], profile)
+    if entry and entry['name'] != video_name:
+        return entry, 'encoded' if entry['status'] == 'uploaded' else 'exact'
+    candidates = [(name, 'exact') for name in index.exact(original_fingerprint, exclude=video_name)]
+    nearest = index.nearest(signature, duration, exclude=video_name)
+    if nearest and index.confirm(nearest[0], detail):
+        candidates.append((nearest[0], 'near'))
+    elif nearest:
+        logger.info(f"{video_name} : near match {nearest[0]} (distance {nearest[1]:.3f}) not confirmed")
+    for name, match in candidates:
+        entry = catalogue.get(name)
+        if entry and entry['profile'] == profile:
+            return entry, match
+    return None, None
+
+
+def reuse_encode(transfer, entry, original_path, tmp_dir):
+    """Encode of an exact copy, downloaded from the server where it replaced its source.
+    None if the file on the server isn't that encode any more.
+    """
+    path = transfer.download([entry['name']], tmp_dir)[0]
+    if path.stat().st_size != entry['encoded_size']:
+        path.unlink()
+        return None
+    encoded_path = ENCODED_VIDEO_DIR / original_path.name
+    with atomic_output(encoded_path) as part:
+        shutil.move(path, part)
+    return encoded_path
 
 
-def remove_first_line(input):
-    subprocess.run(['sed', '-i', '-e', '1d', input])
-
-
-def get_first_line(input):
-    line = subprocess.check_output(['head', '-n', '1', input], text=True)
-    return line.strip()
+def encoding_params():
+    """Parameters that define the encoding profile : changing one of them makes every video pending again"""
+    return {
+        'command': [str(c) for c in encode_command('{input}', '{output}')[1:]],
+        # the muxer options depend on the video (moov size) : the profile holds their mode
+        'muxing': MUXING,
+        'max_ratio': MAX_RATIO,
+    }
 
 
-def unshift_first_line(input):
-    line = get_first_line(input)
-    if line:
-        remove_first_line(input)
-        return line
-    return None
+def ffmpeg_version():
+    return get_executor().check_output([FFMPEG_BIN, '-version'], text=True).splitlines()[0]
 
 
 def convert_bytes(size):
@@ -44,77 +248,271 @@ def convert_bytes(size):
     return size
 
 
-def download_video(video_name):
+def download_video(transfer, video_name):
     video_local_path = ORIGINAL_VIDEO_DIR / video_name
-    subprocess.run(['touch', video_local_path])
-    subprocess.run(['rsync', '-avrz', f"murrutia@axone.utc.fr:/var/www/resources/videos/{video_name}", video_local_path])
+    get_executor().run(['touch', video_local_path])
+    transfer.download([video_name], ORIGINAL_VIDEO_DIR)
     return video_local_path
 
 
-def upload_video(video_path):
-    video_name = video_path.name
-    subprocess.run(['rsync', '-avrz', video_path, f"murrutia@axone.utc.fr:/var/www/resources/videos/{video_name}"])
+def upload_video(transfer, video_path):
+    transfer.upload([video_path])
+
+
+def get_video_duration(filepath):
+    cmd = f"{FFPROBE_BIN} -v error -show_entries format=duration -of default=noprint_wrappers=1:nokey=1".split(" ")
+    cmd.append(str(filepath))
+    return float(get_executor().check_output(cmd))
 
 
-def encode_video(original_path):
+def encode_builder(original_path, audio={}, muxing={}):
+    """Encode command without its output ; `audio` are the audio options chosen for the source,
+    `muxing` the muxer options of the output (see utils/muxing.py)
+    """
+    return FFmpegCommand(binary=str(FFMPEG_BIN), global_options=()) \
+        .with_input(original_path) \
+        .with_options({'-crf': CRF, **audio, **muxing})
+
+
+def encode_command(original_path, encoded_path, audio={}, muxing={}):
+    return encode_builder(original_path, audio, muxing).with_output(encoded_path).argv()
+
+
+def encode_video(original_path, audio, info, tmp_dir):
+    """Encode the video ; an audio that isn't copied is transcoded in parallel and muxed at the end.
+    The output is muxed with `MUXING`, the moov size being estimated from the triage `info`, and
+    only appears in `ENCODED_VIDEO_DIR` once complete (`run_encode()` writes it with `atomic_output()`).
+    """
     encoded_path = ENCODED_VIDEO_DIR / original_path.name
-    subprocess.run([
-        FFMPEG_BIN,
-        '-i', original_path,
-        '-crf', '27',
-        '-movflags', '+faststart',
-        '-y', encoded_path])
+    muxing = muxing_options(MUXING, info['duration'] if info else None, info['frame_rate'] if info else None, audio.get('-an') is None)
+    run_encode(encode_builder(original_path, audio, muxing), encoded_path, tmp_dir)
     return encoded_path
 
 
+def sample_vmaf(extract_path, encoded_path):
+    """Record the VMAF score of a size prediction sample"""
+    from utils.vmaf_features import extract_features, score
+
+    model = get_settings().vmaf_models.get('HD')
+    if not model:
+        return
+    features = extract_features(extract_path, encoded_path, encoded_path.with_suffix('.npz'), models=[model])
+    encoded_path.with_suffix('.npz').unlink()
+    VMAF.observe(score(features, model)[1]['harmonic_mean'])
+
+
+def predict_video_ratio(original_path, audio, tmp_dir):
+    """Encode a few extracts chosen with the scene scores to predict the size ratio of the full encode.
+    Returns the prediction, the number of samples and the time spent on their VMAF scores.
+    """
+    scenescores = get_sorted_scenescores(str(original_path), log_level='warning')
+    sample_times = select_sample_times(scenescores)
+    duration = get_video_duration(original_path)
+    vmaf_seconds = []
+
+    def on_sample(extract_path, encoded_path):
+        # an instrumentation only : a failed score never fails the video
+        start = time()
+        try:
+            sample_vmaf(extract_path, encoded_path)
+        except Exception as e:
+            logger.warning(f"VMAF of the sample {encoded_path.name} failed : {e}")
+        vmaf_seconds.append(time() - start)
+
+    prediction = predict_ratio(original_path, partial(encode_command, audio=audio), sample_times, duration, tmp_dir, FFMPEG_BIN,
+                               on_sample=on_sample if SAMPLES_VMAF else None)
+    return prediction, len(sample_times), sum(vmaf_seconds)
+
+
+def get_frame_count(filepath):
+    """Number of frames estimated from the duration and the frame rate. The average frame rate is '0/0'
+    for some streams : the nominal frame rate is used instead, then the frame count of the stream.
+    Returns None when none of them is known.
+    """
+    cmd = [FFPROBE_BIN, '-v', 'error', '-select_streams', 'v:0', '-show_entries', 'stream=avg_frame_rate,r_frame_rate,nb_frames', '-of', 'json', str(filepath)]
+    streams = json.loads(get_executor().check_output(cmd, text=True)).get('streams') or [{}]
+    for key in ['avg_frame_rate', 'r_frame_rate']:
+        num, _, den = str(streams[0].get(key, '0/0')).partition('/')
+        if num.isdigit() and den.isdigit() and int(num) and int(den):
+            return get_video_duration(filepath) * int(num) / int(den)
+    nb_frames = str(streams[0].get('nb_frames', ''))
+    return int(nb_frames) if nb_frames.isdigit() else None
+
+
+def stage(name):
+    """Track a stage of the processing of a video in the metrics"""
+    STAGE_STARTED.set(time(), stage=name)
+    return track(IN_FLIGHT, FAILURES, STAGE_SECONDS, stage=name)
+
+
+def setup_metrics():
+    """Keep counting from the metrics of the previous runs, serve them while the script runs and dump them when it ends"""
+    metrics.load(metrics_path)
+    atexit.register(metrics.dump, metrics_path)
+    port = int(get_settings().config.get('metrics_port') or DEFAULT_PORT)
+    try:
+        serve(metrics, port)
+    except OSError as e:
+        logger.warning(f"The metrics can't be served on the port {port} : {e}")
+
+
+def record_transfers(transfer):
+    TRANSFER_BYTES.inc(transfer.stats.bytes)
+    TRANSFER_SECONDS.inc(transfer.stats.seconds)
+    TRANSFER_THROUGHPUT.set(transfer.stats.throughput())
+
+
 if __name__ == '__main__':
 
-    # check if there is a file in the orignal video folder
-    if any(ORIGINAL_VIDEO_DIR.iterdir()):
-        first_file = [f for f in ORIGINAL_VIDEO_DIR.iterdir()][0]
-        file_stats = first_file.stat()
-        download_failed = file_stats.st_size == 0 and file_stats.st_mtime < time() - 3600
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--plan', action='store_true', help="print the ETA and the expected savings of the backlog, without processing anything")
+    parser.add_argument('--workers', type=int, default=1, help="number of machines sharing the backlog, for --plan")
+    args = parser.parse_args()
 
-        encoding = any(ENCODED_VIDEO_DIR.iterdir())
-        encoded_file = [f for f in ENCODED_VIDEO_DIR.iterdir()][0]
-        encoding_failed = encoding and encoded_file.stat().st_mtime < time() - 300
-        
-        if encoding_failed or download_failed: 
-            video_name = first_file.name
-        else:
-            print(f"The directory {ORIGINAL_VIDEO_DIR} is not empty and the file is too recent to be discarded as an error. End of script.")
-            sys.exit()
-    else:
-        # if there is not get first line
-        print("No file, beginning of the script")
-        video_name = unshift_first_line(input_files)
-
-        # if line download video
-        if not video_name:
-            print("There is no file to encode")
+    # une seule connexion ssh pour la liste des vidéos, le téléchargement et le renvoi,
+    # fermée aussi quand le script s'arrête sur une erreur
+    with open_transfer(VIDEOS_REMOTE) as transfer:
+        catalogue = Catalogue(catalogue_path)
+
+        if args.plan:
+            plan_backlog(input_files, transfer, catalogue, args.workers)
+            catalogue.close()
             sys.exit()
-    
-    print()
 
-    dl_time = datetime.now()
-    original_path = download_video(video_name)
+        setup_metrics()
 
-    # after download begin encoding
-    enc_time = datetime.now()
-    encoded_path = encode_video(original_path)
+        # check if there is a file in the orignal video folder
+        if any(ORIGINAL_VIDEO_DIR.iterdir()):
+            first_file = [f for f in ORIGINAL_VIDEO_DIR.iterdir()][0]
+            file_stats = first_file.stat()
+            download_failed = file_stats.st_size == 0 and file_stats.st_mtime < time() - 3600
 
-    # after encoding if video is downsized below 90%, reupload video
-    size_original = original_path.stat().st_size
-    size_encoded = encoded_path.stat().st_size
+            encoding = any(ENCODED_VIDEO_DIR.iterdir())
+            encoded_file = [f for f in ENCODED_VIDEO_DIR.iterdir()][0]
+            encoding_failed = encoding and encoded_file.stat().st_mtime < time() - 300
+        
+            if encoding_failed or download_failed: 
+                video_name = first_file.name
+            else:
+                print(f"The directory {ORIGINAL_VIDEO_DIR} is not empty and the file is too recent to be discarded as an error. End of script.")
+                sys.exit()
+        else:
+            # if there is not get the first video of the list that still has to be processed
+            print("No file, beginning of the script")
+            video_name = next_pending_video(input_files, transfer, catalogue)
+
+            # if line download video
+            if not video_name:
+                print("There is no file to encode")
+                sys.exit()
+    
+        print()
+
+        dl_time = datetime.now()
+        with stage('download'):
+            original_path = download_video(transfer, video_name)
+        original_fingerprint = fingerprint(original_path)
+        info = triage.video_info(triage.probe(original_path, FFPROBE_BIN))
+        params = encoding_params()
+        duration = info['duration'] if info and info['duration'] else get_video_duration(original_path)
+
+        # a copy of a video already processed takes its decision, and its encode when it is the same file
+        index = SignatureIndex(catalogue_path)
+        signature = video_signature(FFMPEG_BIN, original_path, duration)
+        detail = video_signature(FFMPEG_BIN, original_path, duration, DETAIL_FRAME_COUNT)
+        duplicate, match = find_duplicate(video_name, original_fingerprint, duration, signature, detail, catalogue, index)
+        if duplicate:
+            print(f"{video_name} is a copy ({match}) of {duplicate['name']} ({duplicate['status']})")
+            DUPLICATES.inc(match=match)
+        # samples and audio parts of this video, in a workspace removed at the end (or at the next start after a crash)
+        workspace = Workspace(f"encode.{original_path.stem}", size_hint=original_path.stat().st_size)
+        # an AAC audio at the right rate is copied instead of being transcoded again
+        audio = audio_options(probe_audio(original_path, FFPROBE_BIN))
+
+        # a near copy is only trusted to be worth an encode : a source is never skipped without a
+        # prediction of its own or the same file
+        reused = duplicate is not None and (match != 'near' or duplicate['status'] == 'uploaded')
+        if reused:
+            # the copy was encoded and uploaded : this one is worth it too, else it was kept as is
+            prediction = tuple(json.loads(duplicate['results'] or '{}').get('predicted_ratio') or (None, None, None))
+            samples, vmaf_seconds = 0, 0
+            skipped = duplicate['status'] != 'uploaded' or match == 'encoded'
+        else:
+            # before encoding the whole video, predict its size ratio on a few extracts
+            with stage('predict'):
+                prediction, samples, vmaf_seconds = predict_video_ratio(original_path, audio, workspace.path)
+            skipped = should_skip(prediction[1], MAX_RATIO)
+        predicted_ratio, ratio_low, ratio_high = prediction
+
+        size_original = original_path.stat().st_size
+
+        if skipped:
+            enc_time = None
+            encode_seconds = None
+            size_encoded = None
+            ratio = None
+            if not reused:
+                log_prediction(size_gate_log_path, original_path.name, CRF, samples, prediction, MAX_RATIO, skipped)
+        else:
+            # begin encoding
+            enc_time = datetime.now()
+            encoded_path = reuse_encode(transfer, duplicate, original_path, workspace.path) if match == 'exact' else None
+            encode_seconds = None
+            if not encoded_path:
+                with stage('encode'):
+                    encoded_path = encode_video(original_path, audio, info, workspace.path)
+                encode_seconds = (datetime.now() - enc_time).total_seconds()
+                frame_count = get_frame_count(original_path)
+                if frame_count:
+                    fps = frame_count / encode_seconds
+                    ENCODE_FPS.set(fps)
+                    ENCODE_FPS_HISTOGRAM.observe(fps)
+
+            # after encoding if video is downsized below 90%, reupload video
+            size_encoded = encoded_path.stat().st_size
+
+            ratio = size_encoded / size_original
+            SIZE_RATIO.observe(ratio)
+            if not reused and predicted_ratio is not None:
+                PREDICTION_ERROR.observe(ratio - predicted_ratio)
+                log_prediction(size_gate_log_path, original_path.name, CRF, samples, prediction, MAX_RATIO, skipped, ratio)
+
+            if ratio < MAX_RATIO:
+                with stage('upload'):
+                    upload_video(transfer, encoded_path)
+                BYTES_SAVED.inc(size_original - size_encoded)
+
+        # the source is recorded with the fingerprint of the file now on the server, so that
+        # an uploaded encode isn't seen as a changed source by the next run
+        results = {
+            'original_fingerprint': original_fingerprint,
+            'predicted_ratio': prediction,
+            'equivalent_bpp': triage.equivalent_bpp(info),
+            # timings of the cost model of the planner (utils/planner.py)
+            'info': info,
+            'crf': CRF,
+            'encode_seconds': encode_seconds,
+            'vmaf_seconds': vmaf_seconds,
+            'sample_seconds': samples * SAMPLE_DURATION,
+            'duplicate_of': {'name': duplicate['name'], 'match': match} if duplicate else None,
+        }
+        if ratio and ratio < MAX_RATIO:
+            catalogue.record(video_name, fingerprint(encoded_path), params, ffmpeg_version(), 'uploaded', size_original, size_encoded, ratio, results)
+        else:
+            catalogue.record(video_name, original_fingerprint, params, ffmpeg_version(), 'skipped' if skipped else 'kept', size_original, size_encoded, ratio, results)
+        index.add(video_name, original_fingerprint, duration, signature, detail)
+        index.close()
+        catalogue.close()
+        VIDEOS.inc(status='uploaded' if ratio and ratio < MAX_RATIO else 'skipped' if skipped else 'kept')
 
-    ratio = size_encoded / size_original
+        if not skipped:
+            encoded_path.unlink()
+        workspace.close()
 
-    if ratio < 0.9:
-        upload_video(encoded_path)
+        record_transfers(transfer)
 
-    # erase original and encoded
+    # erase original
     original_path.unlink()
-    encoded_path.unlink()
 
     ''' write infos in log file:
         - video name
@@ -128,11 +526,13 @@ if __name__ == '__main__':
         fd.write(f'''
 Video : {original_path.name}
     download : {dl_time.strftime("%Y-%m-%d %H-%M-%S")}
-    encoding : {enc_time.strftime("%Y-%m-%d %H-%M-%S")}
+    encoding : {enc_time.strftime("%Y-%m-%d %H-%M-%S") if enc_time else 'skipped'}
     end of script : {datetime.now().strftime("%Y-%m-%d %H-%M-%S")}
     original size : {size_original} ({convert_bytes(size_original)})
-    encoded size : {size_encoded} ({convert_bytes(size_encoded)})
-    ratio : {ratio}
-    re-uploaded : {'yes' if ratio < 0.9 else 'no'}
+    encoded size : {f"{size_encoded} ({convert_bytes(size_encoded)})" if size_encoded else '-'}
+    predicted ratio : {predicted_ratio} (95% CI {ratio_low} - {ratio_high})
+    ratio : {ratio if ratio else '-'}
+    re-uploaded : {'yes' if ratio and ratio < MAX_RATIO else 'no'}
+    transfers : {transfer.stats.files} files, {convert_bytes(transfer.stats.bytes)} in {transfer.stats.seconds:.1f} s ({convert_bytes(transfer.stats.throughput())}/s)
 
 ''')
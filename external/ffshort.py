@@ -5,14 +5,25 @@ import re
 import sys
 import json
 import argparse
-import subprocess
-from subprocess import run, PIPE, Popen
+from subprocess import PIPE
 from collections import deque
 from pprint import PrettyPrinter
 from os.path import splitext, isdir, join as path_join, basename, abspath
 from pathlib import Path
 import shutil
 
+# run as a script from anywhere (`python external/ffshort.py`), the helpers are imported from the
+# root of the project ; `python -m utils ffshort` is the supported entry point
+ROOT_DIR = str(Path(__file__).resolve().parent.parent)
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+from utils.command import ffmpeg
+from utils.audio import NO_AUDIO, audio_options, run_encode
+from utils.workspace import atomic_output
+from utils.executor import get_executor
+from utils.muxing import MODES as MUXING_MODES, DEFAULT_MODE as DEFAULT_MUXING, muxing_options
+
 
 SCRIPT_DIR = Path(os.path.dirname(__file__))
 BIN_FFMPEG = SCRIPT_DIR / "ffmpeg"
@@ -33,7 +44,7 @@ def pp(dict):
 
 
 def run_shell(*args, **kwargs):
-    r = run(*args, stdout=PIPE, stderr=PIPE, **kwargs)
+    r = get_executor().run(*args, stdout=PIPE, stderr=PIPE, **kwargs)
     return r.stdout.strip()
 
 
@@ -95,7 +106,7 @@ def get_ffprobe_sar(file_input):
         str(BIN_FFPROBE),
         str(file_input)
     ]
-    proc = Popen(command, stdout=PIPE, stderr=PIPE)
+    proc = get_executor().popen(command, stdout=PIPE, stderr=PIPE)
     stdout, stderr = proc.communicate()
     err_str = str(stderr)
 
@@ -155,17 +166,38 @@ def guess_frame_rate(file_input):
     return frame_rate
 
 
+def guess_duration(file_input):
+    command = [str(BIN_FFPROBE), '-v', 'error', '-show_entries', 'format=duration', '-of', 'default=noprint_wrappers=1:nokey=1', str(file_input)]
+    duration = run_shell(command)
+    return float(duration) if duration else None
+
+
 def guess_sample_rate(file_input):
     audio = get_stream_data(file_input, 'audio')
     return audio['sample_rate'] if 'sample_rate' in audio else None
 
 
+def guess_audio_stream(file_input):
+    streams = [stream for stream in get_streams_data(file_input) if stream['codec_type'] == 'audio']
+    if len(streams) > 1:
+        eprint(f"Ce fichier contient plusieurs pistes audio, il ne sera donc pas traité.")
+        sys.exit(3)
+    return streams[0] if streams else None
+
+
 def guess_channels(file_input):
     audio = get_stream_data(file_input, 'audio')
     return audio['channels'] if 'channels' in audio else None
 
 
-def ffshort(file_input, file_output=None, crf=27, size=None, temp_folder=None, dry_run=False, force_encode=False, sample_rate=None, channels=None, frame_rate=None, ffmpeg_path=None, threads=0, options={}):
+def ffshort(file_input, file_output=None, crf=27, size=None, temp_folder=None, dry_run=False, force_encode=False, sample_rate=None, channels=None, frame_rate=None, ffmpeg_path=None, threads=0, options={}, audio=True, muxing=DEFAULT_MUXING, duration=None):
+    """Encode `file_input` in H.264.
+    The audio is copied when it is already in AAC at the target sample rate and channel count,
+    otherwise it is transcoded in parallel with the video and muxed at the end.
+    `audio=False` drops it (trial encodes compared with VMAF).
+    `muxing` is the muxing mode of the output (see utils/muxing.py) ; `reserve` needs the
+    `duration` of the input, probed if not given.
+    """
 
     # Make the path absolute, resolving any symlinks
     file_input = Path(file_input).resolve()
@@ -175,8 +207,10 @@ def ffshort(file_input, file_output=None, crf=27, size=None, temp_folder=None, d
     ffmpeg_path = ffmpeg_path if ffmpeg_path else BIN_FFMPEG
     size = size if size else guess_resolution(file_input)
     frame_rate = frame_rate if frame_rate else guess_frame_rate(file_input)
-    sample_rate = sample_rate if sample_rate else guess_sample_rate(file_input)
-    channels = channels if channels else guess_channels(file_input)
+    audio_stream = guess_audio_stream(file_input) if audio else None
+    if audio_stream:
+        sample_rate = sample_rate if sample_rate else audio_stream.get('sample_rate')
+        channels = channels if channels else audio_stream.get('channels')
 
     frame_rate_str = frame_rate
     if type(frame_rate) == str and frame_rate.find('/') != -1:
@@ -202,25 +236,18 @@ def ffshort(file_input, file_output=None, crf=27, size=None, temp_folder=None, d
     encode_output = file_output if not temp_folder else file_tmp
 
     if force_encode or not encode_output.exists():
-        command = [
-            str(ffmpeg_path), '-hide_banner',
-            '-loglevel', 'quiet', '-stats',
-            '-i', file_input
-        ]
+        command = ffmpeg(ffmpeg_path, loglevel='quiet').with_input(file_input)
 
         # audio parameters
-        command.extend([ '-c:a', 'aac' ])
-        if sample_rate: command.extend([ '-ar', sample_rate ])
-        if channels: command.extend(['-ac', str(channels)])
+        command = command.with_options(audio_options(audio_stream, sample_rate, channels) if audio else NO_AUDIO)
 
         # video parameters
         # Explanations : https://sites.google.com/site/linuxencoding/x264-ffmpeg-mapping
-        command.extend([
+        command = command.with_tokens([
             '-c:v', 'libx264',
             '-sws_flags', 'bicubic',
             '-pix_fmt', 'yuv420p',
             '-threads', str(threads),
-            '-movflags', '+faststart',
             # '-b-pyramid', 'none',
             # '-b_strategy', '2',
             '-r', str(frame_rate),
@@ -237,31 +264,24 @@ def ffshort(file_input, file_output=None, crf=27, size=None, temp_folder=None, d
             '-trellis', '2',
             *scale_params(size)
         ])
-        for option, value in options.items():
-            if option in command:
-                i = command.index(option)
-                if value is None:
-                    del command[i]
-                    del command[i]
-                else :
-                    command[i+1] = value
-            elif value is not None:
-                command.extend([option, value])
-        
-        command.extend([ '-y', encode_output ])
+        if muxing == 'reserve':
+            duration = duration if duration else guess_duration(file_input)
+        command = command.with_options(muxing_options(muxing, duration, frame_rate, audio_stream is not None))
+        command = command.with_options(options)
 
-        cmd_str = ' '.join([str(c) for c in command])
-        print(cmd_str, file=sys.stderr)
+        print(command.with_output(encode_output), file=sys.stderr)
         
         if dry_run:
-            return command
+            return command.with_output(encode_output).argv()
     
-        run(command)
+        run_encode(command, encode_output, encode_output.parent)
 
     if temp_folder:
         print(f"mv '{file_tmp}' '{file_output}'")
         if not dry_run:
-            shutil.move(str(file_tmp), str(file_output))
+            # a move to another volume is a copy : the output only appears once complete
+            with atomic_output(file_output) as part:
+                shutil.move(str(file_tmp), str(part))
 
     print()
 
@@ -280,6 +300,8 @@ def main():
     parser.add_argument('--crf', '-q', type=int, default=30, help="qualité d'encodage de la vidéo entre 0 et 51 avec 0 signifiant aucune perte (30 par défaut)")
     parser.add_argument('--ffmpeg-path', '-p', type=str, default="/usr/local/bin/ffmpeg", help="Chemin de l'exécutable de ffmpeg")
     parser.add_argument('--threads', type=int, default=0, help="Nombre de coeurs utilisés pour l'encodage")
+    parser.add_argument('--no-audio', dest='audio', action='store_false', help="encode la vidéo sans sa piste audio")
+    parser.add_argument('--muxing', choices=MUXING_MODES, default=DEFAULT_MUXING, help="muxing du fichier de sortie : +faststart (par défaut), espace réservé pour l'index (reserve) ou MP4 fragmenté (fragmented)")
 
     args = parser.parse_args()
 
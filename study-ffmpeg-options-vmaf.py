@@ -1,35 +1,30 @@
 #!/usr/local/Caskroom/miniconda/base/envs/vmaf/bin/python3
 
 import os
-import re
-import sys
 import json
+import shlex
 import logging
 import argparse
-import subprocess
 from time import time
-from glob import glob
 from pathlib import Path
 from datetime import timedelta
-from dotenv import find_dotenv, dotenv_values
 from statistics import mean , harmonic_mean
-from scenecut_extractor.__main__ import get_scenecuts
-from utils.ffmpeg_scenescores import get_sorted_scenescores
-from external.ffshort import ffshort, guess_frame_rate
-from utils.easyVmaf.Vmaf import vmaf
+from external import ffshort as ffshort_module
+from external.ffshort import ffshort, guess_resolution, guess_frame_rate
+from utils.jobpool import job_threads
+from utils.thread_planner import get_threads, get_jobs
+from utils.settings import get_settings
+from utils.command import ffmpeg
+from utils.results_store import ResultsWriter
+from utils.pipeline import Pipeline, binary
+from utils import stages
+from utils.executor import get_executor
 
 
-config = dotenv_values(find_dotenv())
-
 SCRIPT_DIR = Path(os.path.dirname(__file__))
 
 OUTPUT_DIR = SCRIPT_DIR / "output"
-EXTRACTS_DIR = SCRIPT_DIR / 'tmp' / 'extracts'
-VMAF_DIR = SCRIPT_DIR / 'tmp' / 'vmaf'
-
-OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
-EXTRACTS_DIR.mkdir(parents=True, exist_ok=True)
-VMAF_DIR.mkdir(parents=True, exist_ok=True)
+FFSHORT_SOURCE = Path(ffshort_module.__file__)
 
 # CRF_VALUES = [25, 27, 30]
 CRF_VALUES = [27]
@@ -60,15 +55,15 @@ logger = logging.getLogger(__name__)
 
 
 def get_video_duration(filepath):
-    cmd = f"{config['ffprobe']} -v error -show_entries format=duration -of default=noprint_wrappers=1:nokey=1"
-    cmd_a = cmd.split(" ")
-    cmd_a.append(str(filepath))
-    return float(subprocess.check_output(cmd_a))
+    cmd = [get_settings().ffprobe, '-v', 'error', '-show_entries', 'format=duration', '-of', 'default=noprint_wrappers=1:nokey=1', str(filepath)]
+    return float(get_executor().check_output(cmd))
+
 
+def compute_vmaf(reference, encoded, log_path, threads=0, loglevel='quiet'):
+    from utils.easyVmaf.Vmaf import vmaf
 
-def compute_vmaf(reference, encoded, log_path):
     if not log_path.exists():
-        myVmaf = vmaf(encoded, reference, output_fmt='json', log_path=log_path, loglevel='quiet')
+        myVmaf = vmaf(encoded, reference, output_fmt='json', log_path=log_path, loglevel=loglevel, threads=threads)
         offset1, psnr1 = myVmaf.syncOffset()  # TODO: étudier les arguments de cette fonction : syncWindow, start, reverse
         offset2, psnr2 = myVmaf.syncOffset(reverse=True)
         # offset, psnr = myVmaf.syncOffset()  # TODO: étudier les arguments de cette fonction : syncWindow, start, reverse
@@ -89,183 +84,217 @@ def compute_vmaf(reference, encoded, log_path):
     return [offset, psnr, vmaf_scores]
 
 
-def encode_and_vmaf(input_path, crf, mode="ffshort", remove_option=None, keep_temp_files=False):
-    extract_name = Path(input_path).name
-    extract_name = re.sub(r'\.[^.]+$', '', extract_name)
-    option_name = remove_option.replace(':', '') if remove_option else 'None'
+def probe_extract(input_path):
+    """Probe the extract once for the values `ffshort` would otherwise guess again for each variant.
+    The trial encodes have no audio, so only the video is probed.
+    """
+    return {
+        'size': guess_resolution(input_path),
+        'frame_rate': guess_frame_rate(input_path),
+    }
 
-    options = {remove_option: None} if remove_option else {}
 
-    if mode == 'ffshort':
-        output_path = EXTRACTS_DIR / f"{extract_name}.crf{crf}.mode-ffshort.option{option_name}.mp4"
-        encode_cmd = ffshort(str(input_path), str(output_path), crf=crf, dry_run=True, force_encode=True, ffmpeg_path=config['ffmpeg'], options=options)
-    else:
-        output_path = EXTRACTS_DIR / f"{extract_name}.crf{crf}.mode-simple.mp4"
-        encode_cmd = f"{config['ffmpeg']} -hide_banner -loglevel quiet -stats -i {str(input_path)} -crf {crf}".split(" ")
-        encode_cmd.extend(['-y', str(output_path)])
-                
+def encode_variants():
+    """Encoding variants of each extract : the simple encoding, the complete `ffshort` one and one
+    `ffshort` encoding for each option of `FFMPEG_OPTIONS` removed, as `(mode, remove_option)`
+    """
+    return [('simple', None), *[('ffshort', remove_option) for remove_option in [None, *FFMPEG_OPTIONS]]]
+
+
+def encode_command(input_path, output_path, crf, mode, remove_option, probe, threads=0, ffmpeg_path=None, loglevel='quiet'):
+    ffmpeg_path = ffmpeg_path if ffmpeg_path else get_settings().ffmpeg
+    if mode == 'simple':
+        return ffmpeg(ffmpeg_path, loglevel=loglevel) \
+            .with_input(input_path) \
+            .with_options({'-crf': crf, '-threads': threads, '-an': True}) \
+            .with_output(output_path) \
+            .argv()
+    options = {remove_option: None} if remove_option else {}
+    command = ffshort(str(input_path), str(output_path), crf=crf, dry_run=True, force_encode=True, ffmpeg_path=ffmpeg_path,
+                      threads=threads, options=options, audio=False, **probe)
+    # ffshort always builds its commands with `-loglevel quiet`
+    command = [str(c) for c in command]
+    if '-loglevel' in command:
+        command[command.index('-loglevel') + 1] = loglevel
+    return command
+
+
+def encode(input, probe, crf, mode, remove_option, ffmpeg_path, defaults, threads, loglevel, output):
+    """Stage : encode an extract with one of the variants.
+    `defaults` is the source of ffshort for its variants : its options are part of the key of the stage.
+    """
+    encode_cmd = [str(c) for c in encode_command(input, output, crf, mode, remove_option, probe, threads, ffmpeg_path, loglevel)]
     start_cmd = time()
-    subprocess.run(encode_cmd)
-    encoding_duration = str(timedelta(seconds=(time() - start_cmd)))
-    encoded_filesize = output_path.stat().st_size
-    size_percentage = encoded_filesize / extract_filesize * 100
+    get_executor().run(encode_cmd, check=True)
+    return {
+        'seconds': time() - start_cmd,
+        'size': Path(output).stat().st_size,
+        'command': encode_cmd,
+    }
 
-    vmaf_path = OUTPUT_DIR / f"{extract_name}.crf{crf}.mode-{mode}.option{option_name}.json"
-    
+
+def vmaf(reference, encoded, ffmpeg_path, model, threads, loglevel, output):
+    """Stage : vmaf log of an encode, synchronised with easyVmaf on `threads` threads.
+    `ffmpeg_path` and `model` are the binary and the HD model easyVmaf runs : they are part of the key of the stage.
+    """
     start_cmd = time()
-    offset, psnr, vmaf_scores = compute_vmaf(output_path, input_path, vmaf_path)
-    vmaf_duration = str(timedelta(seconds=(time() - start_cmd)))
-    
-    if not keep_temp_files:
-        os.remove(output_path)
-        os.remove(vmaf_path)
-
-
-    values = {
-        "CRF value": crf,
-        "Option removed": "' "+ str(remove_option),
-        "Encoding duration": encoding_duration,
-        "VMAF offset": offset,
-        "VMAF PSNR": psnr,
-        "VMAF arithmetic mean score": mean(vmaf_scores),
-        "VMAF harmonic mean score": harmonic_mean(vmaf_scores),
-        "VMAF computing duration": vmaf_duration,
-        "Encoded filesize": encoded_filesize,
-        "Filesize percentage": size_percentage,
-        "Encoding command":  encode_cmd
+    offset, psnr, vmaf_scores = compute_vmaf(encoded, reference, Path(output), threads, loglevel)
+    return {
+        'seconds': time() - start_cmd,
+        'offset': offset,
+        'psnr': psnr,
+        'mean': mean(vmaf_scores),
+        'harmonic_mean': harmonic_mean(vmaf_scores),
     }
-    return values
+
+
+def vmaf_model():
+    """HD model of easyVmaf, as set in the .env file (`vmaf_HD`), or its name"""
+    model = get_settings().vmaf_models.get('HD')
+    return Path(model) if model else 'HD'
 
 
 def parse_args():
     parser = argparse.ArgumentParser()
     parser.add_argument('input')
     parser.add_argument('--log-level', default='warning', help="Level of logging : debug, info, warning (default), error or critical")
-    parser.add_argument('--ffmpeg-log-level', default='quiet')
-    parser.add_argument('--keep-temp-files', '-k', action='store_true', help="Keep temporary files")
-    parser.add_argument('--output-csv', help="CSV file where the results will be stored")
+    parser.add_argument('--ffmpeg-log-level', default='quiet', help="Log level of the ffmpeg commands (default : quiet)")
+    parser.add_argument('--keep-temp-files', '-k', action='store_true', help="Keep the extracts, encodes and vmaf logs in the cache of the pipeline for the next runs")
+    parser.add_argument('--output-csv', help="CSV file where the results will be stored (default : output/<video>_ffmpeg-options-vmaf-scores.csv)")
+    parser.add_argument('--results-dir', help="Directory of the Parquet results dataset (default : output/results)")
+    parser.add_argument('--threads', type=int, help="Number of threads of each encoding (0 lets ffmpeg use every core and disables parallel encodings, default : thread plan of this host or 2)")
+    parser.add_argument('--vmaf-threads', type=int, help="Number of threads of each vmaf computation (default : thread plan of this host or 2)")
+    parser.add_argument('--jobs', '-j', type=int, help="Maximum number of stages (encodings, vmaf computations...) running at the same time, within the cores of the host (default : thread plan of this host or as many as the cores allow)")
 
     cli_args = parser.parse_args()
+    # the thread plan of this host is only read for the options left to it
+    cli_args.threads = cli_args.threads if cli_args.threads is not None else get_threads('encode', 2)
+    cli_args.vmaf_threads = cli_args.vmaf_threads if cli_args.vmaf_threads is not None else get_threads('vmaf', 2)
+    cli_args.jobs = cli_args.jobs if cli_args.jobs else get_jobs('encode', None)
     return cli_args
 
 
-def ffmpeg_extract(input, output, start, duration, log_level='quiet'):
-
-    extract_cmd = f"{config['ffmpeg']} -hide_banner -loglevel {log_level} -stats -i {input} -ss {start} -t {duration} -c copy".split(' ')
-    extract_cmd.extend(['-y', output])
-    subprocess.run(extract_cmd)
-
-
-if __name__ == '__main__':
-    
-    cli_args = parse_args()
-
-    # Initializations
-    logging.basicConfig(level = getattr(logging,  cli_args.log_level.upper(), 'WARNING'))
-    input = Path(cli_args.input)
-
-
-    # On récupère la durée et le nom de la vidéo
-    # video_name = re.search(r'_(v.*)\..*$', cli_args.input).group(1) 
-    duration = get_video_duration(input)
-    video_name = input.stem
-    video_extension = input.suffix
-
-    '''
-    Ici on va tester différentes combinaisons pour déterminer s'il y a une manière plus pertinente
-    qu'une autre pour juger de la qualité d'une vidéo encodée par rapport à l'originale.
-    1 - est-ce que la durée de l'extrait a un impact ?
-    2 - est-ce que choisir un extrait proche d'un changement de scène ou non a un impact ?
-    '''
-    ##
-    # Calcul des "scores" de changement dans les frames pour détecter les changements de scene
-    scenescores_filepath = OUTPUT_DIR / f"{video_name}-scenescore.json" if cli_args.keep_temp_files else None
-    scenescores = get_sorted_scenescores(cli_args.input, scenescores_filepath, log_level=cli_args.log_level)
+def build_pipeline(pipeline, input, threads, vmaf_threads, loglevel='quiet'):
+    """DAG of the study : scene scores and keyframes of the video, an extract of each duration around
+    the selected scenes, one probe per extract shared by its variants, and an encode and a vmaf score
+    of each variant. The encodes and vmaf computations declare their threads, so that the pipeline
+    only runs together those fitting in the cores. Returns the stages of each result line, in the
+    order of the csv.
+    """
+    ffmpeg_path = binary(get_settings().ffmpeg)
+    model = vmaf_model()
+    duration = pipeline.stage('duration', stages.duration, input=input)
+    scenescores = pipeline.stage('scenescores', stages.scenescores, input=input)
+    keyframes = pipeline.stage('keyframes', stages.keyframes, input=input)
+    pipeline.run([duration, scenescores])
+    duration = pipeline.value(duration)
+    scenescores = pipeline.value(scenescores)
 
     # Réduction des résultats au 2eme meilleur, le moyen et le 2eme pire
     sl = len(scenescores)
     scenescores_extract = [scenescores[1], scenescores[int(sl/2)], scenescores[-2]]
     # scenescores_extract = [scenescores[1]]
 
-    # Préparation du csv qui va accueillir les résultats
-    results_csv = "Scene score; Time; Duration; Start; End; CRF value; Option removed; Encoding time; VMAF offset; VMAF PSNR;VMAF arithmetic mean; VMAF harmonic mean; VMAF computation time; Filesize; Compression %; Encoding command\n"
-    results_csv_path = OUTPUT_DIR / f"{video_name}_ffmpeg-options-vmaf-scores.csv"
-
-    file_csv = open(str(results_csv_path), 'w+')
-    file_csv.write(results_csv)
-
-    # Parcours des scores retenus
+    lines = []
     for score in scenescores_extract:
-        scene_score = score['score']
-        scene_time =  score['pts_time']
-
         scene_details = {
-            "Scene score": scene_score,
-            "Scene time": scene_time,
+            "Scene score": score['score'],
+            "Scene time": score['pts_time'],
         }
-            
-        print()
 
         # Pour chacun de ces scores, récupération d'un extrait de durées variables
         for extract_duration in EXTRACT_DURATIONS:
-
-            print(f"Extract for score {scene_score} at time {scene_time} of duration {extract_duration}s...")
-            start_time = scene_time - extract_duration / 2
+            start_time = score['pts_time'] - extract_duration / 2
             if start_time < 0:
                 start_time = 0
             if start_time + extract_duration > duration:
                 start_time = duration - extract_duration
-            # start_time = scene_time - extract_duration / 2 if scene_time > extract_duration / 2 else 0
-            # end_time = start_time + extract_duration if start_time + extract_duration < duration else duration
 
-            extract_details = {
-                "Duration": extract_duration,
-                "Start time": start_time,
-                "End time": start_time + extract_duration,
-            }
-            
-            extract_name = f"{video_name}-extract.duration-{extract_duration}s.timestamp-{scene_time}s.score-{score['score']}"
-            extract_path = EXTRACTS_DIR / (extract_name + video_extension)
-            ffmpeg_extract(cli_args.input, extract_path, scene_time, extract_duration, log_level=cli_args.ffmpeg_log_level)
-
-            extract_filesize = extract_path.stat().st_size
+            extract = pipeline.stage('extract', stages.extract, suffix=input.suffix, runtime={'loglevel': loglevel}, input=input,
+                                     keyframes=keyframes, start=start_time, duration=extract_duration, ffmpeg=ffmpeg_path)
+            # Un seul probe par extrait, partagé par toutes les variantes
+            probe = pipeline.stage('probe', probe_extract, input_path=extract)
 
             # Encodage et test de qualité pour chacune des valeurs de CRF à tester
             for crf in CRF_VALUES:
-                
-                # Encodage témoin
-                encoding_details = encode_and_vmaf(extract_path, crf=crf, mode="simple", keep_temp_files=cli_args.keep_temp_files)
+                for mode, remove_option in encode_variants():
+                    encoded = pipeline.stage('encode', encode, suffix='.mp4', cores=job_threads(threads), runtime={'loglevel': loglevel},
+                                             input=extract, probe=probe, crf=crf, mode=mode, remove_option=remove_option, threads=threads,
+                                             ffmpeg_path=ffmpeg_path, defaults=FFSHORT_SOURCE if mode == 'ffshort' else None)
+                    score_stage = pipeline.stage('vmaf', vmaf, suffix='.json', cores=job_threads(vmaf_threads),
+                                                 runtime={'threads': vmaf_threads, 'loglevel': loglevel},
+                                                 reference=extract, encoded=encoded, ffmpeg_path=ffmpeg_path, model=model)
+                    lines.append({
+                        'details': {**scene_details, "Duration": extract_duration},
+                        'extract': extract,
+                        'encode': encoded,
+                        'vmaf': score_stage,
+                        'crf': crf,
+                        'mode': mode,
+                        'remove_option': remove_option,
+                    })
+    return duration, lines
 
-                all_details = {**scene_details, **extract_details, **encoding_details}
-                all_details_str = {k: str(v) for k, v in all_details.items()}
-                line_csv = ";".join(all_details_str.values()) + "\n"
-                file_csv.write(line_csv)
 
-                # Encodage témoin 2
-                encoding_details = encode_and_vmaf(extract_path, crf=crf)
+if __name__ == '__main__':
+    
+    cli_args = parse_args()
 
-                all_details = {**scene_details, **extract_details, **encoding_details}
-                all_details_str = {k: str(v) for k, v in all_details.items()}
-                line_csv = ";".join(all_details_str.values()) + "\n"
-                file_csv.write(line_csv)
+    # Initializations
+    logging.basicConfig(level = getattr(logging,  cli_args.log_level.upper(), 'WARNING'))
+    OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+    input = Path(cli_args.input)
+    video_name = input.stem
 
-                for option in FFMPEG_OPTIONS:
+    '''
+    Ici on va tester différentes combinaisons pour déterminer s'il y a une manière plus pertinente
+    qu'une autre pour juger de la qualité d'une vidéo encodée par rapport à l'originale.
+    1 - est-ce que la durée de l'extrait a un impact ?
+    2 - est-ce que choisir un extrait proche d'un changement de scène ou non a un impact ?
+    '''
+    # Les étapes (scores de changement de scène, extraits, encodages, vmaf) sont mémorisées par
+    # utils/pipeline.py : seules celles dont un paramètre a changé sont recalculées, et les étapes
+    # indépendantes tournent en parallèle
+    pipeline = Pipeline(jobs=cli_args.jobs)
+    duration, lines = build_pipeline(pipeline, input, cli_args.threads, cli_args.vmaf_threads, cli_args.ffmpeg_log_level)
+    pipeline.run([line[stage] for line in lines for stage in ['extract', 'encode', 'vmaf']])
 
-                    encoding_details = encode_and_vmaf(extract_path, crf=crf, remove_option=option)
+    # Préparation du csv qui va accueillir les résultats
+    results_csv = "Scene score; Time; Duration; Start; End; CRF value; Option removed; Encoding time; VMAF offset; VMAF PSNR;VMAF arithmetic mean; VMAF harmonic mean; VMAF computation time; Filesize; Compression %; Encoding command\n"
+    results_csv_path = Path(cli_args.output_csv) if cli_args.output_csv else OUTPUT_DIR / f"{video_name}_ffmpeg-options-vmaf-scores.csv"
 
-                    all_details = {**scene_details, **extract_details, **encoding_details}
-                    all_details_str = {k: str(v) for k, v in all_details.items()}
-                    line_csv = ";".join(all_details_str.values()) + "\n"
-                    file_csv.write(line_csv)
-            
-            if not cli_args.keep_temp_files:
-                os.remove(extract_path)
+    file_csv = open(str(results_csv_path), 'w+')
+    file_csv.write(results_csv)
 
-    
-    for file in glob(f"{OUTPUT_DIR}/*.json"):
-        os.remove(file)
+    # Les résultats sont écrits dans le csv dans l'ordre des variantes pour que le fichier reste comparable d'une exécution à l'autre
+    # Les mêmes résultats sont stockés typés dans le dataset Parquet, pour les agrégations (utils/results_query.py)
+    results_store = ResultsWriter('ffmpeg-options-vmaf', cli_args.results_dir)
+    for line in lines:
+        start_time, gop_duration = pipeline.value(line['extract'])
+        encoding, vmaf_score = pipeline.value(line['encode']), pipeline.value(line['vmaf'])
+        all_details = {
+            **line['details'],
+            "Start time": start_time,
+            "End time": start_time + gop_duration if gop_duration is not None else duration,
+            "CRF value": line['crf'],
+            "Option removed": "' "+ str(line['remove_option']),
+            "Encoding duration": timedelta(seconds=encoding['seconds']),
+            "VMAF offset": vmaf_score['offset'],
+            "VMAF PSNR": vmaf_score['psnr'],
+            "VMAF arithmetic mean score": vmaf_score['mean'],
+            "VMAF harmonic mean score": vmaf_score['harmonic_mean'],
+            "VMAF computing duration": timedelta(seconds=vmaf_score['seconds']),
+            "Encoded filesize": encoding['size'],
+            "Filesize percentage": encoding['size'] / pipeline.path(line['extract']).stat().st_size * 100,
+            "Encoding command":  shlex.join(encoding['command']),
+        }
+        all_details_str = {k: str(v) for k, v in all_details.items()}
+        line_csv = ";".join(all_details_str.values()) + "\n"
+        file_csv.write(line_csv)
+        results_store.write(video_name, all_details, command=encoding['command'], mode=line['mode'], option=line['remove_option'])
 
     file_csv.close()
-    print(f"Les résultats ont été enregistrés dans le fichier {str(results_csv_path)}.")
-
-
+    results_store.close()
+    if not cli_args.keep_temp_files:
+        pipeline.discard([line[stage] for line in lines for stage in ['extract', 'encode', 'vmaf']])
+    print(f"Les résultats ont été enregistrés dans le fichier {str(results_csv_path)} et dans {str(results_store.path)}.")
@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import json
+import logging
+import argparse
+import subprocess
+from pathlib import Path
+from itertools import product
+from fractions import Fraction
+
+from external.ffshort import ffshort, guess_resolution, guess_frame_rate
+from utils.jobpool import job_threads
+from utils.thread_planner import get_threads, get_jobs
+from utils.settings import get_settings
+from utils.pipeline import Pipeline
+from utils.rd import RDCurve, next_crf, MAX_POINTS
+from utils import stages, triage
+from utils.executor import real_executor
+
+SCRIPT_DIR = Path(sys.path[0])
+OUTPUT_DIR = SCRIPT_DIR / "output"
+
+PRESETS = ['veryfast', 'faster', 'fast', 'medium', 'slow', 'slower']
+# x264 options swept with each preset, the first value being the one of `ffshort`
+X264_OPTIONS = {
+    'trellis': ['2', '1', '0'],
+    'qcomp': ['0.6', '0.7'],
+}
+MIN_CRF = 18
+MAX_CRF = 36
+TARGET_VMAF = 85
+WINDOW_COUNT = 12
+WINDOW_DURATION = 3
+
+logger = logging.getLogger(__name__)
+
+
+def content_class(info):
+    """Default content class of a source : its resolution"""
+    for height, name in [(2160, '2160p'), (1440, '1440p'), (1080, '1080p'), (720, '720p'), (480, '480p')]:
+        if info['height'] >= height * 0.9:
+            return name
+    return 'sd'
+
+
+def configurations(presets, options):
+    """Every combination of a preset and of the values of the x264 options, by name"""
+    names = list(options)
+    configs = {}
+    for preset, values in product(presets, product(*[options[name] for name in names])):
+        config = {'-preset': preset, **{f"-{name}": value for name, value in zip(names, values)}}
+        configs[' '.join([preset, *[f"{name}={value}" for name, value in zip(names, values)]])] = config
+    return configs
+
+
+def composite(input, scenescores, video_duration, count, window_duration, output):
+    """Stage : lossless composite clip of `count` windows stratified by scene score (see utils/sampling.py)"""
+    from utils.sampling import draw_windows, build_composite
+
+    frame_rate = guess_frame_rate(input)
+    frame_count = round(window_duration * Fraction(str(frame_rate)))
+    windows = sorted(draw_windows(scenescores, video_duration, count, duration=window_duration))
+    build_composite(get_settings().ffmpeg, input, output, windows, frame_count)
+    return {'windows': windows, 'seconds': len(windows) * frame_count / float(frame_rate)}
+
+
+def probe_sample(input_path):
+    """Probe the sample once for the values `ffshort` would otherwise guess again for each encode"""
+    return {
+        'size': guess_resolution(input_path),
+        'frame_rate': guess_frame_rate(input_path),
+    }
+
+
+def run_timed(command):
+    """Run `command` and return the CPU time (user + system) of this process alone : with the
+    encodes running concurrently, the resource usage of all the children would mix them.
+    It is a benchmark of the real encode, it refuses to run under the simulated executor.
+    """
+    process = real_executor('The preset speed study').popen(command)
+    _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    if process.returncode:
+        raise subprocess.CalledProcessError(process.returncode, command)
+    return usage.ru_utime + usage.ru_stime
+
+
+def encode(input, probe, crf, config, threads, host, output):
+    """Stage : encode the sample with the `ffshort` parameters overridden by `config`.
+    `host` is only part of the fingerprint : the CPU times of another machine are not reused.
+    """
+    command = [str(c) for c in ffshort(str(input), str(output), crf=crf, dry_run=True, force_encode=True, ffmpeg_path=get_settings().ffmpeg,
+                                       threads=threads, options=config, audio=False, **probe)]
+    return {
+        'cpu_seconds': run_timed(command),
+        'size': Path(output).stat().st_size,
+        'command': command,
+    }
+
+
+def measure_stages(pipeline, sample, probe, config, crf, threads):
+    encoded = pipeline.stage('encode', encode, suffix='.mp4', cores=job_threads(threads), input=sample, probe=probe, crf=crf,
+                             config=config, threads=threads, host=os.uname().nodename)
+    # libvmaf runs with its default thread, ffmpeg decodes the two inputs with every core
+    score = pipeline.stage('vmaf', stages.vmaf_features, suffix='.npz', cores=job_threads(0), reference=sample, distorted=encoded)
+    return encoded, score
+
+
+def sweep(pipeline, sample, probe, configs, threads, target, low=MIN_CRF, high=MAX_CRF, max_points=MAX_POINTS):
+    """CRF sweeps of every configuration towards the `target` score, run in lockstep : the next CRF
+    of each sweep is chosen by `rd.next_crf()`, and the encodes of a round run concurrently.
+    Returns the points of each configuration, as `{crf: (encode, vmaf)}`.
+    """
+    points = {name: {} for name in configs}
+    crfs = {name: (low + high) // 2 for name in configs}
+    while crfs:
+        round_stages = {name: measure_stages(pipeline, sample, probe, configs[name], crf, threads) for name, crf in crfs.items()}
+        pipeline.run([stage for pair in round_stages.values() for stage in pair])
+        for name, (encoded, score) in round_stages.items():
+            points[name][crfs[name]] = (pipeline.value(encoded), pipeline.value(score))
+        next_crfs = {}
+        for name in crfs:
+            measured = sorted(points[name])
+            crf = next_crf(measured, [points[name][c][1]['harmonic_mean'] for c in measured], low, high, target)
+            if crf is not None and len(measured) < max_points:
+                next_crfs[name] = crf
+        crfs = next_crfs
+    return points
+
+
+def at_target(points, target, high=MAX_CRF):
+    """CRF, size and CPU time of a configuration at the `target` score, interpolated between the
+    measured points ; None if even the lowest CRF measured doesn't reach it.
+    """
+    import numpy as np
+
+    crfs = sorted(points)
+    sizes = [points[c][0]['size'] for c in crfs]
+    cpu = [points[c][0]['cpu_seconds'] for c in crfs]
+    curve = RDCurve(crfs, sizes, [points[c][1]['harmonic_mean'] for c in crfs])
+    if curve.scores.max() < target:
+        return None
+    if curve.scores.min() >= target or len(crfs) < 2:
+        # the target is reached at the highest CRF measured
+        return {'crf': float(crfs[-1]), 'size': float(sizes[-1]), 'cpu_seconds': float(cpu[-1])}
+    crf = curve.crf_at(target)
+    return {'crf': crf, 'size': curve.rate_at(target), 'cpu_seconds': float(np.interp(crf, crfs, cpu))}
+
+
+def parse_option(value):
+    name, _, values = value.partition('=')
+    if not values:
+        raise argparse.ArgumentTypeError(f"expected NAME=VALUE[,VALUE...], got {value}")
+    return name.lstrip('-'), values.split(',')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Find the x264 preset and options saving the most bytes per CPU-second at a VMAF target")
+    parser.add_argument('inputs', nargs='+', help="Videos representing the content class")
+    parser.add_argument('--content-class', help="Name of the content class (default : resolution of the first video)")
+    parser.add_argument('--target', type=float, default=TARGET_VMAF, help=f"VMAF score to reach (default : {TARGET_VMAF})")
+    parser.add_argument('--presets', default=','.join(PRESETS), help=f"Comma separated x264 presets (default : {','.join(PRESETS)})")
+    parser.add_argument('--option', dest='options', action='append', type=parse_option, help="x264 option and its values to sweep, as NAME=VALUE[,VALUE...] (default : " + ' '.join(f"{k}={','.join(v)}" for k, v in X264_OPTIONS.items()) + ")")
+    parser.add_argument('--windows', type=int, default=WINDOW_COUNT, help=f"Number of windows of the sample of each video (default : {WINDOW_COUNT})")
+    parser.add_argument('--log-level', default='warning', help="Level of logging : debug, info, warning (default), error or critical")
+    parser.add_argument('--threads', type=int, help="Number of threads of each encoding (default : thread plan of this host or 2)")
+    parser.add_argument('--jobs', '-j', type=int, help="Maximum number of stages running at the same time (default : thread plan of this host or as many as the cores allow)")
+    args = parser.parse_args()
+    # the thread plan of this host is only read for the options left to it
+    args.threads = args.threads if args.threads is not None else get_threads('encode', 2)
+    args.jobs = args.jobs if args.jobs else get_jobs('encode', None)
+    return args
+
+
+if __name__ == '__main__':
+
+    cli_args = parse_args()
+    logging.basicConfig(level=getattr(logging, cli_args.log_level.upper(), 'WARNING'))
+    OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+
+    configs = configurations(cli_args.presets.split(','), dict(cli_args.options) if cli_args.options else X264_OPTIONS)
+    pipeline = Pipeline(jobs=cli_args.jobs)
+
+    # Pour chaque vidéo : un échantillon de fenêtres courtes, puis un balayage des CRF de chaque configuration
+    # jusqu'au score cible. Les gains sont mesurés par rapport à la source au même débit que l'échantillon.
+    totals = {name: {'saved': 0.0, 'cpu_seconds': 0.0, 'crfs': []} for name in configs}
+    rows = []
+    class_name = cli_args.content_class
+    for input in [Path(i) for i in cli_args.inputs]:
+        info = triage.video_info(triage.probe(input, get_settings().ffprobe))
+        class_name = class_name if class_name else content_class(info)
+
+        duration = pipeline.stage('duration', stages.duration, input=input)
+        scenescores = pipeline.stage('scenescores', stages.scenescores, input=input)
+        pipeline.run([duration, scenescores])
+        sample = pipeline.stage('composite', composite, suffix='.mp4', input=input, scenescores=scenescores,
+                                video_duration=duration, count=cli_args.windows, window_duration=WINDOW_DURATION)
+        probe = pipeline.stage('probe', probe_sample, input_path=sample)
+        sample_info = pipeline.run([sample])[0]
+        bitrate = info['bitrate'] if info['bitrate'] else input.stat().st_size * 8 / pipeline.value(duration)
+        source_bytes = bitrate / 8 * sample_info['seconds']
+
+        points = sweep(pipeline, sample, probe, configs, cli_args.threads, cli_args.target)
+        for name, config_points in points.items():
+            result = at_target(config_points, cli_args.target)
+            if result is None:
+                logger.warning(f"{input.name} : {name} doesn't reach vmaf {cli_args.target} at crf {MIN_CRF}")
+                totals[name] = None
+                continue
+            saved = source_bytes - result['size']
+            rows.append([input.name, name, f"{result['crf']:.2f}", round(result['size']), f"{result['cpu_seconds']:.2f}", round(saved),
+                         f"{saved / result['cpu_seconds']:.0f}"])
+            if totals[name] is not None:
+                totals[name]['saved'] += saved
+                totals[name]['cpu_seconds'] += result['cpu_seconds']
+                totals[name]['crfs'].append(result['crf'])
+
+    ranking = sorted([(total['saved'] / total['cpu_seconds'], name) for name, total in totals.items() if total and total['cpu_seconds']], reverse=True)
+    for efficiency, name in ranking:
+        rows.append(['*', name, f"{sum(totals[name]['crfs']) / len(totals[name]['crfs']):.2f}", '', f"{totals[name]['cpu_seconds']:.2f}",
+                     round(totals[name]['saved']), f"{efficiency:.0f}"])
+
+    results_csv_path = OUTPUT_DIR / f"{class_name}_preset-speed.csv"
+    with open(results_csv_path, 'w') as fd:
+        fd.write("Video; Configuration; CRF at target; Size at target; CPU seconds; Bytes saved; Bytes saved per CPU second\n")
+        for row in rows:
+            fd.write(';'.join(str(v) for v in row) + "\n")
+
+    if not ranking:
+        sys.exit(f"Error: no configuration reaches vmaf {cli_args.target} on every video.")
+    efficiency, best = ranking[0]
+    best_path = OUTPUT_DIR / f"{class_name}_preset-speed.json"
+    with open(best_path, 'w') as fd:
+        json.dump({'content_class': class_name, 'target': cli_args.target, 'configuration': best, 'options': configs[best],
+                   'crf': sum(totals[best]['crfs']) / len(totals[best]['crfs']), 'bytes_per_cpu_second': efficiency}, fd, indent=2)
+    for efficiency, name in ranking[:5]:
+        print(f"{name:<32} {efficiency / 1e6:8.2f} MB saved per CPU second")
+    print(f"Meilleure configuration pour {class_name} : {best} ({' '.join(f'{k} {v}' for k, v in configs[best].items())})")
+    print(f"Les résultats ont été enregistrés dans les fichiers {results_csv_path} et {best_path}.")
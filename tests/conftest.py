@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# the scripts and the `utils` package are imported from the root of the project
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,63 @@
+import subprocess
+
+import pytest
+
+from utils import executor
+from utils.audio import audio_options, needs_transcode, run_encode
+from utils.command import ffmpeg
+from utils.executor import SimulatedExecutor, Clock, load_profiles, write_media, media_size
+
+
+@pytest.fixture
+def simulated(monkeypatch):
+    def make(**profiles):
+        simulated = SimulatedExecutor({**load_profiles(), **profiles}, Clock(1e4))
+        monkeypatch.setattr(executor, '_executor', simulated)
+        return simulated
+    return make
+
+
+def source(simulated, tmp_path):
+    path = tmp_path / 'source.mp4'
+    media = simulated.source_media(path.name)
+    write_media(path, media, media_size(media))
+    return path
+
+
+def encode(path):
+    return ffmpeg('ffmpeg').with_input(path).with_options({'-c:v': 'libx264', '-crf': 27, '-c:a': 'aac', '-ar': 48000, '-ac': 2})
+
+
+def test_audio_options():
+    assert audio_options({'codec_name': 'aac', 'profile': 'LC', 'sample_rate': '48000', 'channels': 2})['-c:a'] == 'copy'
+    assert needs_transcode(ffmpeg().with_options({'-c:a': 'aac'}))
+    assert not needs_transcode(ffmpeg().with_options({'-c:a': 'aac', '-an': True}))
+
+
+def test_run_encode(simulated, tmp_path):
+    simulated = simulated()
+    output = tmp_path / 'output.mp4'
+    run_encode(encode(source(simulated, tmp_path)), output, tmp_path / 'tmp')
+    assert output.exists()
+    assert list((tmp_path / 'tmp').iterdir()) == []
+
+
+def test_audio_transcode_killed_when_the_video_fails(simulated, tmp_path):
+    # the audio transcode (a copy job for the simulation) would last for days
+    profiles = load_profiles()
+    simulated = simulated(encode={**profiles['encode'], 'failure_rate': 1.0}, copy={**profiles['copy'], 'seconds': 1e9})
+    with pytest.raises(subprocess.CalledProcessError):
+        run_encode(encode(source(simulated, tmp_path)), tmp_path / 'output.mp4', tmp_path / 'tmp')
+    assert simulated.in_flight == 0
+    assert simulated.stats['copy']['jobs'] == 1
+    assert list((tmp_path / 'tmp').iterdir()) == []
+
+
+def test_failed_encode_leaves_no_output(simulated, tmp_path):
+    profiles = load_profiles()
+    simulated = simulated(encode={**profiles['encode'], 'failure_rate': 1.0})
+    command = encode(source(simulated, tmp_path)).with_options({'-c:a': 'copy', '-ar': None, '-ac': None})
+    with pytest.raises(subprocess.CalledProcessError):
+        run_encode(command, tmp_path / 'output.mp4', tmp_path / 'tmp')
+    # the partial output of the failed command is removed, nothing takes the place of the output
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['source.mp4']
@@ -0,0 +1,48 @@
+import os
+
+from utils.catalogue import Catalogue, fingerprint, partial_hash, profile_hash
+
+PARAMS = {'command': ['-crf', '27'], 'max_ratio': 0.9}
+
+
+def test_partial_hash(tmp_path):
+    path = tmp_path / 'video.mp4'
+    path.write_bytes(b'a' * 100 + b'b' * 100 + b'c' * 100)
+    # only the ends of the file are read
+    same_ends = tmp_path / 'same_ends.mp4'
+    same_ends.write_bytes(b'a' * 100 + b'x' * 100 + b'c' * 100)
+    assert partial_hash(path, chunk_size=100) == partial_hash(same_ends, chunk_size=100)
+    assert partial_hash(path, chunk_size=150) != partial_hash(same_ends, chunk_size=150)
+
+
+def test_pending(tmp_path):
+    source = tmp_path / 'a.mp4'
+    source.write_bytes(b'video')
+    os.utime(source, (1000, 1000))
+    listing = {'a.mp4': {'size': 5, 'mtime': 1000}, 'b.mp4': {'size': 7, 'mtime': 1000}}
+
+    with Catalogue(tmp_path / 'catalogue.sqlite') as catalogue:
+        assert catalogue.pending(['a.mp4', 'b.mp4', 'gone.mp4'], listing, profile_hash(PARAMS)) == ['a.mp4', 'b.mp4']
+        catalogue.record('a.mp4', fingerprint(source), PARAMS, 'ffmpeg version 6.0', 'uploaded', 5, 3, 0.6, {'vmaf': 93})
+
+    # the catalogue outlives the process that wrote it
+    with Catalogue(tmp_path / 'catalogue.sqlite') as catalogue:
+        assert catalogue.pending(['a.mp4', 'b.mp4'], listing, profile_hash(PARAMS)) == ['b.mp4']
+        assert catalogue.is_up_to_date('a.mp4', 5, 1000, profile_hash(PARAMS))
+        # a modified source or a new profile makes it pending again
+        assert catalogue.pending(['a.mp4'], {'a.mp4': {'size': 5, 'mtime': 2000}}, profile_hash(PARAMS)) == ['a.mp4']
+        assert catalogue.pending(['a.mp4'], listing, profile_hash({**PARAMS, 'max_ratio': 0.8})) == ['a.mp4']
+        assert catalogue.encoded() == [(0.6, {'vmaf': 93})]
+
+
+def test_find_content(tmp_path):
+    source = tmp_path / 'a.mp4'
+    source.write_bytes(b'video')
+    copy = tmp_path / 'copy.mp4'
+    copy.write_bytes(b'video')
+
+    with Catalogue(tmp_path / 'catalogue.sqlite') as catalogue:
+        catalogue.record('a.mp4', fingerprint(source), PARAMS, 'ffmpeg version 6.0', 'uploaded')
+        content = fingerprint(copy)
+        assert catalogue.find_content(content['partial_hash'], content['size'], profile_hash(PARAMS))['name'] == 'a.mp4'
+        assert catalogue.find_content(content['partial_hash'], content['size'], profile_hash({})) is None
@@ -0,0 +1,34 @@
+import sys
+import subprocess
+from pathlib import Path
+
+import pytest
+
+from utils import cli
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+
+
+def test_commands_are_imported_lazily():
+    # the entry point and the modules of the commands that don't run stay unloaded
+    code = "import sys, utils.cli, external.ffshort; print(' '.join(sorted(sys.modules)))"
+    modules = subprocess.check_output([sys.executable, '-c', code], cwd=ROOT_DIR, text=True).split()
+    for module in ['numpy', 'pyarrow', 'dotenv', 'utils.vmaf_features', 'utils.ffmpeg_scenescores', 'utils.simulation']:
+        assert module not in modules
+
+
+def test_usage(capsys):
+    with pytest.raises(SystemExit) as exit:
+        cli.main([])
+    assert exit.value.code == 2
+    with pytest.raises(SystemExit) as exit:
+        cli.main(['--help'])
+    assert exit.value.code == 0
+    assert 'ffshort' in capsys.readouterr().err
+
+
+def test_dispatch(monkeypatch):
+    calls = []
+    monkeypatch.setitem(cli.COMMANDS, 'probe', calls.append)
+    cli.main(['probe', 'video.mp4'])
+    assert calls == [['video.mp4']]
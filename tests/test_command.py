@@ -0,0 +1,51 @@
+from utils.command import ffmpeg, options_from_tokens
+
+
+def base():
+    return ffmpeg('ffmpeg', stats=False).with_input('in.mp4')
+
+
+def test_argv_order():
+    command = ffmpeg('ffmpeg').with_input('in.mp4', {'-ss': 10}).with_filtergraph('[0:v]null[v]') \
+        .with_options({'-map': '[v]', '-crf': 27}).with_output('out.mp4')
+    assert command.argv() == ['ffmpeg', '-hide_banner', '-loglevel', 'quiet', '-stats', '-ss', '10', '-i', 'in.mp4',
+                              '-filter_complex', '[0:v]null[v]', '-map', '[v]', '-crf', '27', '-y', 'out.mp4']
+
+
+def test_single_valued_options_override():
+    command = base().with_options({'-crf': 27, '-an': True}).with_options({'-crf': 30}).with_output('out.mp4')
+    assert command.argv()[6:] == ['-crf', '30', '-an', '-y', 'out.mp4']
+    assert base().with_options({'-crf': 27}).with_options({'-crf': None}).with_output('o').argv()[-2:] == ['-y', 'o']
+
+
+def test_repeated_maps():
+    # a repeated value is kept, in order : `-map 0:a` twice duplicates the audio track
+    command = base().with_options({'-map': '0:v'}).with_output('out.mp4').with_tokens(['-map', '0:a', '-map', '0:a'])
+    assert command.argv() == ['ffmpeg', '-hide_banner', '-loglevel', 'quiet', '-i', 'in.mp4', '-map', '0:v', '-map', '0:a', '-map', '0:a', '-y', 'out.mp4']
+    assert command.with_options({'-map': ['0:v', '0:s']}, unique=True).get_options('-map') == ['0:v', '0:a', '0:a', '0:s']
+
+
+def test_map_list_and_removal():
+    command = base().with_input('audio.m4a').with_options({'-map': ['0:v:0', '1:a:0'], '-c': 'copy'})
+    assert command.get_options('-map') == ['0:v:0', '1:a:0']
+    assert command.with_output('o').argv()[-8:] == ['-map', '0:v:0', '-map', '1:a:0', '-c', 'copy', '-y', 'o']
+    assert command.with_options({'-map': None}).get_options('-map') == []
+
+
+def test_multiple_outputs():
+    command = base().with_options({'-c:v': 'libx264'}) \
+        .with_output('a.mp4', {'-map': '0:v', '-crf': 23}) \
+        .with_output('b.mp4', {'-map': ['0:v', '0:a'], '-crf': 30})
+    assert command.argv()[6:] == ['-c:v', 'libx264', '-map', '0:v', '-crf', '23', '-y', 'a.mp4',
+                                  '-c:v', 'libx264', '-map', '0:v', '-map', '0:a', '-crf', '30', '-y', 'b.mp4']
+
+
+def test_tokens():
+    assert options_from_tokens(['-c:a', 'aac', '-an', '-itsoffset', '-1']) == (('-c:a', 'aac'), ('-an', True), ('-itsoffset', '-1'))
+    command = base().with_tokens(['-metadata', 'title=a', '-metadata', 'artist=b', '-y'])
+    assert command.get_options('-metadata') == ['title=a', 'artist=b']
+
+
+def test_key_is_stable():
+    assert base().with_output('o').key() == base().with_output('o').key()
+    assert base().with_options({'-crf': 27}).with_output('o').key() != base().with_output('o').key()
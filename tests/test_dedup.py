@@ -0,0 +1,46 @@
+import sqlite3
+
+from utils.dedup import SignatureIndex, bands, distance, uniform
+
+FINGERPRINT = {'size': 100, 'partial_hash': 'abc'}
+
+
+def frames(*hashes):
+    return ''.join(f"{h:016x}" for h in hashes)
+
+
+def test_uniform_bands_are_left_out():
+    signature = frames(0, 0x0123456789abcdef, 0xffffffffffffffff)
+    assert uniform('00000000') and uniform('ffffffff') and not uniform('0000000f')
+    assert bands(signature) == [(2, '01234567'), (3, '89abcdef')]
+
+
+def test_fades_to_black_are_not_candidates(tmp_path):
+    with SignatureIndex(tmp_path / 'index.sqlite') as index:
+        index.add('a.mp4', FINGERPRINT, 60, frames(0, 0, 0x0123456789abcdef))
+        # shares only the black frames with a.mp4
+        assert index.nearest(frames(0, 0, 0xfedcba9876543210), 60) is None
+        assert index.nearest(frames(0, 0, 0x0123456789abcdee), 60) == ('a.mp4', distance(frames(0, 0, 0x0123456789abcdef), frames(0, 0, 0x0123456789abcdee)))
+
+
+def test_confirm(tmp_path):
+    detail = frames(*range(1, 9))
+    with SignatureIndex(tmp_path / 'index.sqlite') as index:
+        index.add('a.mp4', FINGERPRINT, 60, frames(1, 2), detail)
+        index.add('legacy.mp4', FINGERPRINT, 60, frames(1, 2))
+        assert index.confirm('a.mp4', detail)
+        assert not index.confirm('a.mp4', frames(*(~h & 0xffffffffffffffff for h in range(1, 9))))
+        assert not index.confirm('legacy.mp4', detail)
+        assert not index.confirm('missing.mp4', detail)
+
+
+def test_index_without_details_is_migrated(tmp_path):
+    db = sqlite3.connect(str(tmp_path / 'index.sqlite'))
+    db.execute('CREATE TABLE signatures (name TEXT PRIMARY KEY, size INTEGER, partial_hash TEXT, duration REAL, signature TEXT)')
+    db.execute("INSERT INTO signatures VALUES ('old.mp4', 1, 'x', 60, '01')")
+    db.commit()
+    db.close()
+    with SignatureIndex(tmp_path / 'index.sqlite') as index:
+        assert not index.confirm('old.mp4', '01')
+        index.add('new.mp4', FINGERPRINT, 60, frames(1), frames(1, 2))
+        assert index.confirm('new.mp4', frames(1, 2))
@@ -0,0 +1,92 @@
+import json
+import importlib.util
+from pathlib import Path
+
+import pytest
+
+from utils import executor
+
+spec = importlib.util.spec_from_file_location('encode_mp4_videos', Path(__file__).resolve().parent.parent / 'encode-mp4-videos.py')
+encode_mp4_videos = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(encode_mp4_videos)
+
+
+class Probe():
+    """Answers the ffprobe calls with a fixed duration and video stream"""
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def check_output(self, cmd, text=False):
+        if 'format=duration' in cmd:
+            return '10.0\n'
+        return json.dumps({'streams': [self.stream] if self.stream is not None else []})
+
+
+@pytest.mark.parametrize('stream, frames', [
+    ({'avg_frame_rate': '25/1', 'r_frame_rate': '50/1', 'nb_frames': '240'}, 250),
+    ({'avg_frame_rate': '0/0', 'r_frame_rate': '30000/1001', 'nb_frames': '240'}, pytest.approx(299.7, abs=0.1)),
+    ({'avg_frame_rate': '0/0', 'r_frame_rate': '0/0', 'nb_frames': '240'}, 240),
+    ({'avg_frame_rate': '0/0', 'r_frame_rate': '0/0', 'nb_frames': 'N/A'}, None),
+    (None, None),
+])
+def test_get_frame_count(monkeypatch, stream, frames):
+    monkeypatch.setattr(executor, '_executor', Probe(stream))
+    assert encode_mp4_videos.get_frame_count('video.mp4') == frames
+
+
+def test_sample_vmaf_failure_is_logged(monkeypatch, tmp_path, caplog):
+    def sample_vmaf(extract_path, encoded_path):
+        raise RuntimeError("no model")
+
+    def predict_ratio(original_path, encode, sample_times, duration, tmp_dir, ffmpeg, on_sample=None):
+        for i in range(len(sample_times)):
+            on_sample(tmp_path / f"extract{i}.mp4", tmp_path / f"encoded{i}.mp4")
+        return 0.5, 0.4, 0.6
+
+    monkeypatch.setattr(encode_mp4_videos, 'SAMPLES_VMAF', True)
+    monkeypatch.setattr(encode_mp4_videos, 'sample_vmaf', sample_vmaf)
+    monkeypatch.setattr(encode_mp4_videos, 'predict_ratio', predict_ratio)
+    monkeypatch.setattr(encode_mp4_videos, 'get_sorted_scenescores', lambda path, log_level: [])
+    monkeypatch.setattr(encode_mp4_videos, 'select_sample_times', lambda scenescores: [1, 5])
+    monkeypatch.setattr(encode_mp4_videos, 'get_video_duration', lambda path: 10.0)
+
+    prediction, samples, _ = encode_mp4_videos.predict_video_ratio(tmp_path / 'video.mp4', None, tmp_path)
+    assert prediction == (0.5, 0.4, 0.6) and samples == 2
+    assert caplog.text.count("no model") == 2
+
+
+class Catalogue():
+    def __init__(self, entries):
+        self.entries = entries
+
+    def find_content(self, partial_hash, size, profile):
+        return None
+
+    def get(self, name):
+        return self.entries.get(name)
+
+
+def test_near_duplicates_are_confirmed(tmp_path, monkeypatch):
+    from utils.dedup import SignatureIndex
+
+    monkeypatch.setattr(encode_mp4_videos, 'encoding_params', lambda: {'command': ['-crf', '27']})
+    profile = encode_mp4_videos.profile_hash({'command': ['-crf', '27']})
+    catalogue = Catalogue({'a.mp4': {'name': 'a.mp4', 'profile': profile, 'status': 'skipped'}})
+    signature, detail = '0123456789abcdef' * 2, 'fedcba9876543210' * 8
+    with SignatureIndex(tmp_path / 'index.sqlite') as index:
+        index.add('a.mp4', {'size': 1, 'partial_hash': 'a'}, 60, signature, detail)
+        fingerprint = {'size': 2, 'partial_hash': 'b'}
+        entry, match = encode_mp4_videos.find_duplicate('b.mp4', fingerprint, 60, signature, detail, catalogue, index)
+        assert (entry['name'], match) == ('a.mp4', 'near')
+        # the same first frames, but not the rest of the video
+        assert encode_mp4_videos.find_duplicate('b.mp4', fingerprint, 60, signature, '0' * len(detail), catalogue, index) == (None, None)
+
+
+def test_profile_hashes_the_command_that_runs(monkeypatch, tmp_path):
+    commands = []
+    monkeypatch.setattr(encode_mp4_videos, 'run_encode', lambda command, output, tmp_dir: commands.append(command))
+    encode_mp4_videos.encode_video(tmp_path / 'video.mp4', {}, {'duration': 60, 'frame_rate': '25/1'}, tmp_path)
+    assert commands[0].get_option('-moov_size') and commands[0].get_option('-movflags') is None
+    params = encode_mp4_videos.encoding_params()
+    assert '+faststart' not in params['command'] and params['muxing'] == encode_mp4_videos.MUXING
@@ -0,0 +1,31 @@
+from utils.jobpool import job_threads, run_jobs, in_order, CoreBudget
+
+
+def square(x):
+    return x * x
+
+
+def test_job_threads():
+    assert job_threads(2, cores=8) == 2
+    assert job_threads(2, 2, cores=8) == 4
+    assert job_threads(0, cores=8) == 8
+    assert job_threads(16, cores=8) == 8
+
+
+def test_core_budget():
+    budget = CoreBudget(4)
+    assert budget.fits(8)
+    budget.acquire(3)
+    assert budget.fits(1) and not budget.fits(2)
+    budget.release(3)
+    assert budget.fits(4)
+
+
+def test_run_jobs_in_order():
+    results = list(in_order(run_jobs(square, [{'x': x} for x in range(6)], threads=2, cores=4)))
+    assert results == [(x, x * x) for x in range(6)]
+
+
+def test_run_jobs_wider_than_host():
+    assert dict(run_jobs(square, [{'x': 3}], threads=0, cores=2)) == {0: 9}
+
@@ -0,0 +1,52 @@
+import pytest
+
+from utils import executor
+from utils.executor import SimulatedExecutor, Clock, load_profiles, write_media, media_size, read_media
+from utils.keyframes import gop_bounds, head_options, head_command, smart_cut
+
+KEYFRAMES = [0.0, 10.0, 20.0, 30.0]
+
+
+@pytest.fixture
+def source(tmp_path, monkeypatch):
+    def make(codec='h264'):
+        profiles = load_profiles()
+        profiles['source'] = {**profiles['source'], 'duration': [60, 60], 'codec': codec}
+        simulated = SimulatedExecutor(profiles, Clock(1e6))
+        monkeypatch.setattr(executor, '_executor', simulated)
+        path = tmp_path / 'source.mp4'
+        media = simulated.source_media(path.name)
+        write_media(path, media, media_size(media))
+        return path
+    return make
+
+
+def test_gop_bounds():
+    assert gop_bounds(KEYFRAMES, 12, 5) == (10.0, 10.0)
+    assert gop_bounds(KEYFRAMES, 25, 10) == (20.0, None)
+
+
+def test_head_options():
+    options = head_options({'codec_name': 'h264', 'profile': 'Main', 'level': 31, 'pix_fmt': 'yuv420p'})
+    assert options['-profile:v'] == 'main' and options['-level:v'] == '3.1' and options['-pix_fmt'] == 'yuv420p'
+    assert head_options({'codec_name': 'hevc', 'profile': 'Main', 'level': 93, 'pix_fmt': 'yuv420p'}) is None
+    assert head_options({'codec_name': 'h264', 'profile': 'High', 'level': 40, 'pix_fmt': 'gbrp'}) is None
+    assert head_options(None) is None
+
+
+def test_head_command_copies_the_audio():
+    argv = head_command('ffmpeg', 'in.mp4', 'out.mp4', 5, 3, {'-c:v': 'libx264'}, audio=True)
+    assert argv[argv.index('-i') + 2:] == ['-map', '0:v:0', '-map', '0:a?', '-c:v', 'libx264', '-c:a', 'copy', '-y', 'out.mp4']
+    assert '-an' in head_command('ffmpeg', 'in.mp4', 'out.ts', 5, 3, {'-c:v': 'libx264'})
+
+
+def test_smart_cut(source, tmp_path):
+    output = tmp_path / 'extract.mp4'
+    assert smart_cut('ffmpeg', source(), output, 5, 20, KEYFRAMES, ffprobe='ffprobe') == (5, 20)
+    assert read_media(output)['duration'] == pytest.approx(20)
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['extract.mp4', 'source.mp4']
+
+
+def test_smart_cut_falls_back_to_gops(source, tmp_path):
+    output = tmp_path / 'extract.mp4'
+    assert smart_cut('ffmpeg', source('hevc'), output, 5, 20, KEYFRAMES, ffprobe='ffprobe') == (0.0, 30.0)
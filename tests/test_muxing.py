@@ -0,0 +1,29 @@
+import pytest
+
+from utils.muxing import muxing_options, moov_size, FRAGMENTED_FLAGS
+
+
+def test_reserve():
+    options = muxing_options('reserve', 60, '30000/1001', audio=True)
+    assert options['-movflags'] is None
+    assert options['-moov_size'] == moov_size(60, '30000/1001', audio=True)
+    assert moov_size(60, 25, audio=False) < options['-moov_size']
+
+
+@pytest.mark.parametrize('duration, frame_rate', [
+    (None, 25),
+    (60, None),
+    (0, 25),
+    (60, '0/0'),
+    (60, '0/1'),
+    (60, 'N/A'),
+])
+def test_reserve_falls_back_to_faststart(duration, frame_rate):
+    assert muxing_options('reserve', duration, frame_rate) == {'-movflags': '+faststart', '-moov_size': None}
+
+
+def test_modes():
+    assert muxing_options() == {'-movflags': '+faststart', '-moov_size': None}
+    assert muxing_options('fragmented')['-movflags'] == FRAGMENTED_FLAGS
+    with pytest.raises(ValueError):
+        muxing_options('unknown')
@@ -0,0 +1,85 @@
+import time
+import threading
+from pathlib import Path
+
+from utils.pipeline import Pipeline, binary
+
+
+def test_pipeline_core_budget(tmp_path):
+    lock = threading.Lock()
+    used, peak = [0], [0]
+
+    def busy(i, cores_used):
+        with lock:
+            used[0] += cores_used
+            peak[0] = max(peak[0], used[0])
+        time.sleep(0.02)
+        with lock:
+            used[0] -= cores_used
+        return i
+
+    pipeline = Pipeline(store=tmp_path, jobs=8, cores=4)
+    stages = [pipeline.stage('busy', busy, cores=cores, i=i, cores_used=cores) for i, cores in enumerate([3, 2, 2, 1, 4, 1])]
+    assert pipeline.run(stages) == list(range(6))
+    assert peak[0] <= 4
+
+
+def vmaf(reference, model, threads, output):
+    output.write_text(f"{reference} {model.read_text()} {threads}")
+    return threads
+
+
+def test_stage_key_of_the_inputs(tmp_path):
+    model = tmp_path / 'model.json'
+    model.write_text('v1')
+    pipeline = Pipeline(store=tmp_path / 'store', jobs=2)
+    stage = pipeline.stage('vmaf', vmaf, suffix='.json', reference='a.mp4', model=model, runtime={'threads': 4})
+    # the thread count is given to the function but is not part of the key
+    assert pipeline.stage('vmaf', vmaf, suffix='.json', reference='a.mp4', model=model, runtime={'threads': 8}) is stage
+    assert pipeline.run([stage]) == [4]
+    assert pipeline.path(stage).read_text() == 'a.mp4 v1 4'
+
+    # a new model file is a new stage, run again
+    model.write_text('v2 model')
+    rerun = Pipeline(store=tmp_path / 'store', jobs=2)
+    changed = rerun.stage('vmaf', vmaf, suffix='.json', reference='a.mp4', model=model, runtime={'threads': 2})
+    assert changed.key != stage.key
+    assert rerun.run([changed]) == [2]
+    assert rerun.path(changed).read_text() == 'a.mp4 v2 model 2'
+
+
+def test_binary(tmp_path, monkeypatch):
+    executable = tmp_path / 'ffmpeg'
+    executable.write_text('#!/bin/sh\n')
+    executable.chmod(0o755)
+    monkeypatch.setenv('PATH', str(tmp_path))
+    assert binary('ffmpeg') == executable
+    assert binary(executable) == executable
+    assert binary('missing') == Path('missing')
+
+
+def write(size, output):
+    output.write_bytes(b'\0' * size)
+    return size
+
+
+def test_pipeline_quota(tmp_path):
+    store = tmp_path / 'cache'
+    old = Pipeline(store=store, jobs=1, quota=10 ** 6)
+    stale = old.stage('write', write, suffix='.bin', size=600)
+    old.run([stale])
+
+    # the entries of the previous runs are evicted, the ones of the running pipeline are kept
+    pipeline = Pipeline(store=store, jobs=1, quota=1000)
+    stages = [pipeline.stage('write', write, suffix='.bin', size=size) for size in [300, 400]]
+    pipeline.run(stages)
+    assert not old.path(stale).exists()
+    assert all(pipeline.path(stage).exists() for stage in stages)
+
+
+def test_pipeline_discard(tmp_path):
+    pipeline = Pipeline(store=tmp_path, jobs=1)
+    stage = pipeline.stage('write', write, suffix='.bin', size=10)
+    pipeline.run([stage])
+    pipeline.discard([stage, stage])
+    assert list(tmp_path.iterdir()) == []
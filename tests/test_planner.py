@@ -0,0 +1,22 @@
+from utils import planner
+
+COSTS = {'a': 1, 'b': 5, 'c': 2, 'd': 4}
+
+
+def test_lpt():
+    order, assignment, makespan = planner.lpt(COSTS, 2)
+    assert order == ['b', 'd', 'c', 'a'] and makespan == 6
+    assert assignment == {'b': 0, 'd': 1, 'c': 1, 'a': 0}
+
+
+def test_list_schedule_keeps_the_order():
+    assignment, makespan = planner.list_schedule(['a', 'c', 'd', 'b'], COSTS, 2)
+    assert assignment == {'a': 0, 'c': 1, 'd': 0, 'b': 1} and makespan == 7
+
+
+def test_plan_of_the_queue_order():
+    jobs = {name: (100, 0.5) for name in [*COSTS, 'unknown']}
+    cost = lambda name: COSTS.get(name)
+    assert planner.plan(jobs, cost, 2)['makespan'] == 6
+    report = planner.plan(jobs, cost, 2, order=['a', 'c', 'd', 'b', 'unknown'])
+    assert report['makespan'] == 7 and report['order'] == ['a', 'c', 'd', 'b'] and report['costed'] == 4
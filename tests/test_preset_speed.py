@@ -0,0 +1,37 @@
+import importlib.util
+from pathlib import Path
+
+import pytest
+
+spec = importlib.util.spec_from_file_location('study_preset_speed', Path(__file__).resolve().parent.parent / 'study-preset-speed.py')
+study_preset_speed = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(study_preset_speed)
+
+
+def points(measures):
+    """Points of a sweep : {crf: (encode, vmaf)} from (crf, size, cpu_seconds, score) tuples"""
+    return {crf: ({'size': size, 'cpu_seconds': cpu}, {'harmonic_mean': score}) for crf, size, cpu, score in measures}
+
+
+def test_configurations():
+    configs = study_preset_speed.configurations(['fast', 'slow'], {'trellis': ['2', '0'], 'qcomp': ['0.6']})
+    assert list(configs) == ['fast trellis=2 qcomp=0.6', 'fast trellis=0 qcomp=0.6', 'slow trellis=2 qcomp=0.6', 'slow trellis=0 qcomp=0.6']
+    assert configs['slow trellis=0 qcomp=0.6'] == {'-preset': 'slow', '-trellis': '0', '-qcomp': '0.6'}
+    assert study_preset_speed.configurations(['medium'], {}) == {'medium': {'-preset': 'medium'}}
+
+
+def test_at_target():
+    sweep = points([(20, 1000, 40, 95), (26, 500, 30, 88), (32, 250, 20, 80)])
+    point = study_preset_speed.at_target(sweep, 85)
+    assert 26 < point['crf'] < 32
+    assert 250 < point['size'] < 500
+    assert point['cpu_seconds'] == pytest.approx(30 - (point['crf'] - 26) / 6 * 10)
+
+
+def test_at_target_out_of_the_sweep():
+    sweep = points([(26, 500, 30, 88), (32, 250, 20, 86)])
+    # every point reaches the target : the highest CRF measured
+    assert study_preset_speed.at_target(sweep, 85) == {'crf': 32.0, 'size': 250.0, 'cpu_seconds': 20.0}
+    # no point reaches it
+    assert study_preset_speed.at_target(sweep, 90) is None
+    assert study_preset_speed.at_target(points([(26, 500, 30, 88)]), 85) == {'crf': 26.0, 'size': 500.0, 'cpu_seconds': 30.0}
@@ -0,0 +1,52 @@
+import pytest
+
+from utils.rd import RDCurve, Pchip, bd_rate, bd_score, next_crf, sweep, target_crf
+
+CRFS = [20, 24, 28, 32]
+SCORES = [96.0, 92.0, 86.0, 78.0]
+
+
+def rates(factor=1.0):
+    # the size halves every 6 CRF
+    return [factor * 1e6 * 2 ** ((20 - crf) / 6) for crf in CRFS]
+
+
+def test_pchip_interpolates_the_points():
+    pchip = Pchip([0, 1, 2, 3], [0, 1, 4, 9])
+    assert list(pchip([0, 1, 2, 3])) == [0, 1, 4, 9]
+    assert pchip.integral(0, 3) == pytest.approx(9, rel=0.05)
+
+
+def test_crf_and_rate_at_target():
+    curve = RDCurve(CRFS, rates(), SCORES)
+    assert curve.crf_at(89.0) == pytest.approx(26, abs=0.3)
+    assert curve.crf_at(99.0) is None
+    assert curve.rate_at(92.0) == pytest.approx(rates()[1])
+
+
+def test_target_crf_rounds():
+    curve = RDCurve(CRFS, rates(), SCORES)
+    crf = curve.crf_at(80.0)
+    assert target_crf(curve, 80.0, 18, 36) == round(crf) == 31
+    assert target_crf(curve, 99.0, 18, 36) == 18
+    assert target_crf(curve, 70.0, 18, 36) == 36
+
+
+def test_bd_rate():
+    reference = RDCurve(CRFS, rates(), SCORES)
+    assert bd_rate(reference, RDCurve(CRFS, rates(0.9), SCORES)) == pytest.approx(-10)
+    assert bd_score(reference, reference) == pytest.approx(0)
+    assert bd_rate(reference, RDCurve([20], [1e6], [96.0])) is None
+
+
+def test_sweep_towards_target():
+    score = lambda crf: 120 - 1.5 * crf
+    curve = sweep(lambda crf: (2 ** (-crf / 6), score(crf)), 18, 36, target=85)
+    assert len(curve) <= 4
+    assert target_crf(curve, 85, 18, 36) == round((120 - 85) / 1.5)
+
+
+def test_next_crf_bounds():
+    assert next_crf([27], [90.0], 18, 36, target=95) == 18
+    assert next_crf([27], [90.0], 18, 36, target=80) == 36
+    assert next_crf([23, 24], [86.0, 84.0], 18, 36, target=85) is None
@@ -0,0 +1,54 @@
+from datetime import timedelta
+
+import pytest
+
+from utils.results_store import ResultsWriter
+from utils.results_query import load, summary, option_deltas
+
+
+def details(crf, score, size, command='ffmpeg -i in.mp4 out.mp4'):
+    return {
+        'Scene score': 0.4,
+        'Scene time': 12.5,
+        'Duration': 30,
+        'Start time': 10.0,
+        'End time': 40.0,
+        'CRF value': crf,
+        'Encoding duration': timedelta(seconds=3),
+        'VMAF offset': 'N/A',
+        'VMAF harmonic mean score': score,
+        'Encoded filesize': size,
+        'Filesize percentage': size / 1000,
+        'Encoding command': command,
+    }
+
+
+def test_results_renamed_on_close(tmp_path):
+    writer = ResultsWriter('study', tmp_path, batch_size=2)
+    writer.write('video', details(27, 93.0, 500), mode='ffshort')
+    writer.write('video', details(27, 92.0, 450), mode='ffshort', option='-trellis')
+    writer.write('video', details(27, 90.0, 600), mode='simple')
+    # the row group written so far is in a hidden file, left out of the dataset
+    assert not writer.path.exists()
+    assert [path.name for path in tmp_path.iterdir()] == [f".{writer.path.name}.part"]
+    assert load(tmp_path).num_rows == 0
+
+    writer.close()
+    assert list(tmp_path.iterdir()) == [writer.path]
+    table = load(tmp_path)
+    assert table.num_rows == 3
+    assert table['encoding_seconds'].to_pylist() == [3.0] * 3
+    assert table['vmaf_offset'].to_pylist() == [None] * 3
+    assert table['encoding_command'][0].as_py() == ['ffmpeg', '-i', 'in.mp4', 'out.mp4']
+
+    assert summary(table)['crf_count'].to_pylist() == [1, 1, 1]
+    deltas = option_deltas(table)
+    assert deltas['option_removed'].to_pylist() == ['-trellis']
+    assert deltas['score_delta_mean'].to_pylist() == [-1.0]
+    assert deltas['size_delta_percentage_approximate_median'][0].as_py() == pytest.approx(-10.0)
+
+
+def test_empty_results_leave_no_file(tmp_path):
+    with ResultsWriter('study', tmp_path):
+        pass
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,54 @@
+import pytest
+
+from utils import executor
+from utils.executor import SimulatedExecutor, Clock, load_profiles, write_media, media_size, read_media
+from utils.sampling import draw_windows, build_composite, sample
+
+SCENESCORES = [{'pts_time': i * 6.0, 'score': (i * 37 % 100) / 100} for i in range(100)]
+
+
+@pytest.fixture
+def simulated(tmp_path, monkeypatch):
+    profiles = load_profiles()
+    profiles['source'] = {**profiles['source'], 'duration': [600, 600], 'frame_rate': 25}
+    simulated = SimulatedExecutor(profiles, Clock(1e6))
+    monkeypatch.setattr(executor, '_executor', simulated)
+    path = tmp_path / 'source.mp4'
+    media = simulated.source_media(path.name)
+    write_media(path, media, media_size(media))
+    return simulated, path
+
+
+def test_draw_windows_spread():
+    windows = draw_windows(SCENESCORES, 600, 8)
+    assert len(windows) == 8
+    more = draw_windows(SCENESCORES, 600, 8, windows)
+    assert not any(abs(a - b) < 3 for a in more for b in windows)
+
+
+def test_build_composite_by_batches(simulated, tmp_path):
+    simulated, source = simulated
+    windows = sorted(draw_windows(SCENESCORES, 600, 20))
+    output = build_composite('ffmpeg', source, tmp_path / 'composite.mp4', windows, 75, batch=8)
+    assert simulated.stats['encode']['jobs'] == 3
+    assert read_media(output)['duration'] == pytest.approx(20 * 3)
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['composite.mp4', 'source.mp4']
+
+
+@pytest.mark.parametrize('spread, rounds', [(0, 1), (10, 3)])
+def test_sample_measures_each_window_once(simulated, tmp_path, spread, rounds):
+    simulated, source = simulated
+    measured = []
+
+    def measure(path):
+        frames = round(read_media(path)['duration'] * 25)
+        measured.append(frames)
+        # the windows alternate between two scores `spread` apart
+        return [90 + spread * (n // 75 % 2) for n in range(frames)]
+
+    output = tmp_path / 'composite.mp4'
+    windows, scores = sample('ffmpeg', source, output, SCENESCORES, 600, 25, measure, tolerance=0.5, per_round=8, max_windows=24)
+    assert len(windows) == len(scores) == 8 * rounds
+    assert measured == [8 * 75] * rounds
+    assert read_media(output)['duration'] == pytest.approx(len(windows) * 3)
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['composite.mp4', 'source.mp4']
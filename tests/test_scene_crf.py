@@ -0,0 +1,41 @@
+import pytest
+
+from utils import executor, scene_crf
+from utils.executor import SimulatedExecutor, Clock, load_profiles, write_media, media_size, read_media
+
+
+@pytest.fixture
+def source(tmp_path, monkeypatch):
+    profiles = load_profiles()
+    profiles['source'] = {**profiles['source'], 'duration': [60, 60]}
+    simulated = SimulatedExecutor(profiles, Clock(1e6))
+    monkeypatch.setattr(executor, '_executor', simulated)
+    path = tmp_path / 'source.mp4'
+    media = simulated.source_media(path.name)
+    write_media(path, media, media_size(media))
+    return path
+
+
+def test_scene_segments():
+    segments = scene_crf.scene_segments([{'pts_time': 25, 'score': 0.5}, {'pts_time': 30, 'score': 0.9}, {'pts_time': 40, 'score': 0.1}], 60)
+    assert segments == [(0, 25), (25, 60)]
+
+
+def test_encode_segments_runs_in_parallel(source, tmp_path, monkeypatch):
+    calls = []
+
+    def run_jobs(func, jobs, threads=0, max_workers=None, cores=None):
+        calls.append((threads, max_workers, [job['options']['-threads'] for job in jobs]))
+        for index, job in enumerate(jobs):
+            yield index, func(**job)
+    monkeypatch.setattr(scene_crf, 'run_jobs', run_jobs)
+
+    output = tmp_path / 'segments.mp4'
+    scene_crf.encode_segments('ffmpeg', source, output, [(0, 30), (30, 60)], [24, 28], tmp_path)
+    # without a plan, segments use a few threads each instead of every core, one at a time
+    assert calls == [(scene_crf.SEGMENT_THREADS, None, [scene_crf.SEGMENT_THREADS] * 2)]
+    assert read_media(output)['duration'] == pytest.approx(60)
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['segments.mp4', 'source.mp4']
+
+    scene_crf.encode_segments('ffmpeg', source, output, [(0, 60)], [24], tmp_path, threads=4, jobs=3)
+    assert calls[-1] == (4, 3, [4])
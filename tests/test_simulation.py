@@ -0,0 +1,79 @@
+import pytest
+
+from utils import simulation
+from utils.command import ffmpeg
+from utils import executor
+from utils.executor import SimulatedExecutor, VirtualClock, load_profiles, write_media, media_size, real_executor
+
+
+def run_queue(tmp_path, seed, workers=3):
+    simulated = SimulatedExecutor(load_profiles(), VirtualClock(), seed)
+    sources = simulation.create_sources(tmp_path / 'sources', 12, simulated)
+    return simulation.process_queue(list(sources), workers, simulated, tmp_path), simulated
+
+
+def test_virtual_clock():
+    clock = VirtualClock(10)
+    clock.sleep(5)
+    clock.sleep(-1)
+    assert clock.time() == 15
+    clock.set(3)
+    assert clock.time() == 3
+
+
+def test_killed_command_leaves_a_partial_output(tmp_path):
+    simulated = SimulatedExecutor(load_profiles(), VirtualClock(), 0)
+    source = tmp_path / 'source.mp4'
+    media = simulated.source_media(source.name)
+    write_media(source, media, media_size(media))
+    command = ffmpeg('ffmpeg').with_input(source).with_options({'-c:v': 'libx264', '-crf': 27})
+
+    simulated.run(command.with_output(tmp_path / 'complete.mp4').argv(), check=True)
+    process = simulated.popen(command.with_output(tmp_path / 'killed.mp4').argv())
+    process.kill()
+    assert process.wait() == -9
+    assert (tmp_path / 'killed.mp4').stat().st_size < (tmp_path / 'complete.mp4').stat().st_size
+
+
+def test_real_benchmarks_refuse_the_simulation(monkeypatch):
+    from utils.muxing import run_measured
+
+    monkeypatch.setattr(executor, '_executor', SimulatedExecutor(load_profiles(), VirtualClock(), 0))
+    with pytest.raises(RuntimeError):
+        real_executor('A benchmark')
+    with pytest.raises(RuntimeError):
+        run_measured(['ffmpeg', '-version'])
+
+
+def test_process_queue_is_deterministic(tmp_path):
+    done, simulated = run_queue(tmp_path / 'first', seed=1)
+    again, _ = run_queue(tmp_path / 'second', seed=1)
+    assert done == again and len(done) == 12
+    # the jobs are spread over the workers : the makespan is less than the sum of the jobs
+    assert done[-1][0] < simulated.stats['encode']['seconds']
+    serial, _ = run_queue(tmp_path / 'serial', seed=1, workers=1)
+    assert serial[-1][0] == simulated.stats['encode']['seconds']
+
+
+def test_eta_of_the_policy_order(tmp_path, monkeypatch):
+    from utils import planner
+
+    simulated = SimulatedExecutor(load_profiles(), VirtualClock(), 0)
+    sources = simulation.create_sources(tmp_path / 'sources', 12, simulated)
+    durations = {}
+    run = simulated.run
+
+    def timed_run(args, **kwargs):
+        start = simulated.clock.time()
+        result = run(args, **kwargs)
+        durations[args[args.index('-i') + 1]] = simulated.clock.time() - start
+        return result
+    monkeypatch.setattr(simulated, 'run', timed_run)
+
+    # the fifo order, not the longest first one
+    order = list(sources)
+    done = simulation.process_queue(order, 3, simulated, tmp_path)
+    # the planner given the duration of each job finds the simulated makespan of the same order
+    report = planner.plan({path: (sources[path], None) for path in order}, lambda path: durations[str(path)], 3, order=order)
+    assert report['makespan'] == pytest.approx(done[-1][0])
+    assert planner.plan({path: (sources[path], None) for path in order}, lambda path: durations[str(path)], 3)['makespan'] <= report['makespan']
@@ -0,0 +1,31 @@
+from utils.size_prediction import select_sample_times, predict_ratio, should_skip, log_prediction
+
+
+def scores(count):
+    return [{'pts_time': float(t), 'score': t / count} for t in range(count)]
+
+
+def test_select_sample_times():
+    assert select_sample_times(scores(9), 3) == [0.0, 4.0, 8.0]
+    assert select_sample_times(scores(2), 5) == [0.0, 1.0]
+
+
+def test_select_single_sample():
+    assert select_sample_times(scores(9), 1) == [4.0]
+
+
+def test_predict_without_samples(tmp_path):
+    prediction = predict_ratio(tmp_path / 'video.mp4', None, [], 60, tmp_path, 'ffmpeg')
+    assert prediction == (None, None, None)
+    assert not should_skip(prediction[1], 0.9)
+
+
+def test_should_skip():
+    assert should_skip(0.95, 0.9)
+    assert not should_skip(0.85, 0.9)
+
+
+def test_log_prediction_without_prediction(tmp_path):
+    log_prediction(tmp_path / 'log.csv', 'video.mp4', 27, 0, (None, None, None), 0.9, False, 0.5)
+    header, line = (tmp_path / 'log.csv').read_text().splitlines()
+    assert line.split(';')[-2:] == ['0.5', '']
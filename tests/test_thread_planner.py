@@ -0,0 +1,45 @@
+import json
+
+import pytest
+
+from utils import thread_planner
+from utils.jobpool import available_cores
+
+
+@pytest.fixture
+def plan_file(tmp_path, monkeypatch):
+    path = tmp_path / 'thread-plan.json'
+    monkeypatch.setattr(thread_planner, 'plan_path', lambda host=None: path)
+    thread_planner.load_plan.cache_clear()
+    yield path
+    thread_planner.load_plan.cache_clear()
+
+
+def test_candidate_threads():
+    assert thread_planner.candidate_threads(6) == [1, 2, 4, 6]
+    assert thread_planner.candidate_threads(1) == [1]
+
+
+def test_missing_plan(plan_file):
+    assert thread_planner.load_plan() is None
+    assert thread_planner.get_threads('encode', 2) == 2
+
+
+def test_broken_plan(plan_file):
+    plan_file.write_text('{"cores": ')
+    assert thread_planner.load_plan() is None
+    assert thread_planner.get_jobs('vmaf', 3) == 3
+
+
+def test_plan_read_once(plan_file):
+    plan = {'cores': available_cores(), 'encode': {'jobs': 2, 'threads': 4}, 'vmaf': {'jobs': 1, 'threads': 8}}
+    plan_file.write_text(json.dumps(plan))
+    assert thread_planner.get_threads('encode') == 4
+    plan_file.unlink()
+    assert thread_planner.get_jobs('vmaf') == 1
+
+
+def test_plan_of_other_host(plan_file):
+    plan = {'cores': available_cores() + 1, 'encode': {'jobs': 2, 'threads': 4}, 'vmaf': {'jobs': 1, 'threads': 8}}
+    plan_file.write_text(json.dumps(plan))
+    assert thread_planner.load_plan() is None
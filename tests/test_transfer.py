@@ -0,0 +1,93 @@
+from pathlib import Path
+
+import pytest
+
+from utils import executor
+from utils.executor import SimulatedExecutor, Clock
+from utils.transfer import LocalTransfer, RsyncTransfer, open_transfer
+
+
+@pytest.fixture
+def server(tmp_path):
+    directory = tmp_path / 'server'
+    directory.mkdir()
+    for name, content in [('a.mp4', b'a' * 10), ('b.mp4', b'b' * 20)]:
+        (directory / name).write_bytes(content)
+    return directory
+
+
+@pytest.fixture
+def simulated(monkeypatch):
+    simulated = SimulatedExecutor(clock=Clock(1e6))
+    monkeypatch.setattr(executor, '_executor', simulated)
+    return simulated
+
+
+def test_open_transfer(server):
+    assert isinstance(open_transfer(str(server)), LocalTransfer)
+    assert isinstance(open_transfer('user@host:/videos'), RsyncTransfer)
+    assert isinstance(open_transfer('rsync://host/videos'), RsyncTransfer)
+
+
+def test_local_download(server, tmp_path):
+    local = tmp_path / 'local'
+    local.mkdir()
+    with open_transfer(str(server)) as transfer:
+        paths = transfer.download(['a.mp4', 'b.mp4'], local)
+    assert [p.read_bytes() for p in paths] == [b'a' * 10, b'b' * 20]
+    assert transfer.stats.asdict()['bytes'] == 30
+    assert transfer.stats.files == 2 and transfer.stats.batches == 1
+
+
+def test_local_upload(server, tmp_path):
+    encoded = tmp_path / 'a.mp4'
+    encoded.write_bytes(b'e' * 5)
+    with LocalTransfer(server) as transfer:
+        transfer.upload([encoded])
+    assert (server / 'a.mp4').read_bytes() == b'e' * 5
+    assert not list(server.glob('.*.part'))
+    assert transfer.stats.bytes == 5
+
+
+def test_local_list(server):
+    entries = LocalTransfer(server).list(['a.mp4', 'missing.mp4'])
+    assert list(entries) == ['a.mp4']
+    assert entries['a.mp4']['size'] == 10
+
+
+def test_local_missing_file(server, tmp_path):
+    with pytest.raises(FileNotFoundError):
+        with LocalTransfer(server) as transfer:
+            transfer.download(['missing.mp4'], tmp_path)
+
+
+def test_rsync_session_closed_on_error(simulated):
+    with pytest.raises(RuntimeError):
+        with RsyncTransfer('user@host:/videos') as transfer:
+            control_dir = Path(transfer._control_dir)
+            assert control_dir.exists()
+            raise RuntimeError('encode failed')
+    assert not control_dir.exists()
+    commands = [stats['jobs'] for kind, stats in simulated.stats.items() if kind == 'other']
+    # the master connection was started, then stopped
+    assert commands == [2]
+
+
+def test_rsync_partial_files(simulated, tmp_path):
+    commands = []
+    run = simulated.run
+
+    def recorded_run(args, **kwargs):
+        commands.append([str(a) for a in args])
+        return run(args, **kwargs)
+    simulated.run = recorded_run
+
+    (tmp_path / 'a.mp4').write_bytes(b'a' * 10)
+    with RsyncTransfer('user@host:/videos') as transfer:
+        transfer.upload([tmp_path / 'a.mp4'])
+        transfer.download(['a.mp4'], tmp_path)
+    upload, download = [command for command in commands if command[0] == 'rsync']
+    # an interrupted upload never leaves a truncated file in place of the source on the server
+    assert '--partial' not in upload
+    assert '--partial-dir=.rsync-partial' in upload and '--delay-updates' in upload
+    assert '--partial' in download and '--delay-updates' not in download
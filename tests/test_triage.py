@@ -0,0 +1,39 @@
+import pytest
+
+from utils import executor, triage
+from utils.executor import SimulatedExecutor, Clock, write_media, media_size
+
+
+def test_video_info_on_a_single_probe(tmp_path, monkeypatch):
+    simulated = SimulatedExecutor(clock=Clock(1e6))
+    monkeypatch.setattr(executor, '_executor', simulated)
+    path = tmp_path / 'source.mp4'
+    media = simulated.source_media(path.name)
+    write_media(path, media, media_size(media))
+
+    info = triage.video_info(triage.probe(path))
+    assert simulated.stats['probe']['jobs'] == 1
+    assert info['codec'] == media['codec'] and (info['width'], info['height']) == (media['width'], media['height'])
+    assert info['bpp'] == pytest.approx(info['bitrate'] / (info['width'] * info['height'] * info['frame_rate']))
+
+
+def test_video_info_bitrate_of_the_container():
+    probe = {
+        'streams': [
+            {'codec_type': 'video', 'codec_name': 'hevc', 'width': 1920, 'height': 1080, 'avg_frame_rate': '0/0', 'r_frame_rate': '25/1'},
+            {'codec_type': 'audio', 'codec_name': 'aac', 'bit_rate': '128000'},
+        ],
+        'format': {'duration': '10', 'bit_rate': '2128000'},
+    }
+    info = triage.video_info(probe)
+    assert info['frame_rate'] == 25 and info['bitrate'] == 2000000
+    assert triage.equivalent_bpp(info) == pytest.approx(2000000 / (1920 * 1080 * 25) * 1.4)
+    assert triage.video_info({'streams': [{'codec_type': 'audio'}]}) is None
+
+
+def test_triage_order():
+    def info(bpp):
+        return {'codec': 'h264', 'bpp': bpp}
+    sources = {'small': (100, info(0.2)), 'big': (1000, info(0.1)), 'efficient': (1000, info(0.01)), 'unknown': (10, None)}
+    queue, below = triage.triage(sources, min_bpp=0.05, target_bpp=0.04)
+    assert queue == ['big', 'small', 'unknown'] and below == ['efficient']
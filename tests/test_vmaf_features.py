@@ -0,0 +1,64 @@
+import json
+import math
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from utils.vmaf_features import VmafModel, pool
+
+MODEL_PATH = Path(__file__).resolve().parent.parent / 'external' / 'vmaf_v0.6.1.json'
+
+FEATURES = {
+    'integer_adm2': [1.0, 0.9345, 0.7],
+    'integer_motion2': [0.0, 3.895, 10.0],
+    'integer_vif_scale0': [1.0, 0.3634, 0.2],
+    'integer_vif_scale1': [1.0, 0.7666, 0.4],
+    'integer_vif_scale2': [1.0, 0.8628, 0.5],
+    'integer_vif_scale3': [1.0, 0.9159, 0.6],
+}
+
+
+def libsvm_predict(model_path, frame):
+    """Score of one frame computed like libvmaf : svm_predict() on the rescaled features, one support vector at a time"""
+    with open(model_path, 'r') as fd:
+        model = json.load(fd)['model_dict']
+    slopes, intercepts = model['slopes'], model['intercepts']
+    header, _, vectors = model['model'].partition('\nSV\n')
+    params = dict(line.split(' ', 1) for line in header.splitlines() if ' ' in line)
+    keys = ['integer_adm2', 'integer_motion2', 'integer_vif_scale0', 'integer_vif_scale1', 'integer_vif_scale2', 'integer_vif_scale3']
+    x = [frame[key] * slopes[i + 1] + intercepts[i + 1] for i, key in enumerate(keys)]
+    total = 0.0
+    for line in vectors.strip().splitlines():
+        coef, *values = line.split()
+        sv = [0.0] * len(x)
+        for value in values:
+            index, v = value.split(':')
+            sv[int(index) - 1] = float(v)
+        total += float(coef) * math.exp(-float(params['gamma']) * sum((a - b) ** 2 for a, b in zip(x, sv)))
+    prediction = (total - float(params['rho']) - intercepts[0]) / slopes[0]
+    return min(max(prediction, 0.0), 100.0)
+
+
+def test_predict_matches_libsvm():
+    model = VmafModel(MODEL_PATH)
+    scores = model.predict({key: np.array(values) for key, values in FEATURES.items()})
+    expected = [libsvm_predict(MODEL_PATH, {key: values[i] for key, values in FEATURES.items()}) for i in range(3)]
+    assert scores == pytest.approx(expected, abs=1e-9)
+    # score of libvmaf for identical frames without motion
+    assert scores[0] == pytest.approx(97.428042, abs=1e-5)
+
+
+def test_predict_float_features():
+    model = VmafModel(MODEL_PATH)
+    features = {key[len('integer_'):]: np.array(values) for key, values in FEATURES.items()}
+    assert model.predict(features) == pytest.approx(model.predict({key: np.array(values) for key, values in FEATURES.items()}))
+    with pytest.raises(KeyError):
+        model.predict({'integer_adm2': np.array([1.0])})
+
+
+def test_pool():
+    pooled = pool(np.array([80.0, 90.0, 100.0]))
+    assert pooled['mean'] == pytest.approx(90.0)
+    assert pooled['min'] == 80.0 and pooled['max'] == 100.0
+    assert pooled['harmonic_mean'] < pooled['mean']
@@ -0,0 +1,56 @@
+import os
+
+import pytest
+
+from utils.workspace import enforce_quota, atomic_output, atomic_write, cache_path, identity
+
+
+def entry(root, name, size, mtime):
+    path = root / 'cache' / name
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(b'\0' * size)
+    os.utime(path, (mtime, mtime))
+    return path
+
+
+def test_quota_evicts_the_least_recently_used(tmp_path):
+    oldest = entry(tmp_path, 'oldest', 400, 1000)
+    kept = entry(tmp_path, 'kept', 400, 1500)
+    old = entry(tmp_path, 'old', 400, 2000)
+    recent = entry(tmp_path, 'recent', 400, 3000)
+    writing = entry(tmp_path, '.recent.123.part.json', 100, 500)
+    (tmp_path / 'workspaces' / 'job').mkdir(parents=True)
+    (tmp_path / 'workspaces' / 'job' / 'extract.mp4').write_bytes(b'\0' * 300)
+
+    used = enforce_quota(tmp_path, 1300, keep=[kept])
+    assert not oldest.exists() and not old.exists()
+    assert kept.exists() and recent.exists() and writing.exists()
+    assert used == 1200
+
+
+def test_cache_hit_refreshes_the_entry(tmp_path):
+    source = tmp_path / 'video.mp4'
+    source.write_bytes(b'video')
+    path = cache_path(source, 'scenescores.json', root=tmp_path)
+    assert path.name == f"video.{identity(source)}.scenescores.json"
+    path.write_text('[]')
+    os.utime(path, (1000, 1000))
+    cache_path(source, 'scenescores.json', root=tmp_path)
+    assert path.stat().st_mtime > 1000
+
+    # another content is another entry
+    source.write_bytes(b'another video')
+    assert cache_path(source, 'scenescores.json', root=tmp_path) != path
+
+
+def test_atomic_output(tmp_path):
+    output = tmp_path / 'output.mp4'
+    with pytest.raises(RuntimeError):
+        with atomic_output(output) as part:
+            part.write_bytes(b'partial')
+            raise RuntimeError()
+    assert list(tmp_path.iterdir()) == []
+
+    with atomic_write(output, 'wb') as fd:
+        fd.write(b'complete')
+    assert output.read_bytes() == b'complete' and list(tmp_path.iterdir()) == [output]
@@ -4,18 +4,18 @@ import json
 import logging
 import subprocess
 from pathlib import Path
-from utils.easyVmaf.Vmaf import vmaf
 from utils.easyVmaf.FFmpeg import FFprobe
 from statistics import mean, harmonic_mean
-from dotenv import find_dotenv, dotenv_values
-from scenecut_extractor.__main__ import get_scenecuts
+from utils.settings import get_settings
+from utils.command import ffmpeg
+from utils.thread_planner import get_threads
+from utils.audio import NO_AUDIO, audio_options, run_encode
+from utils.muxing import DEFAULT_MODE as DEFAULT_MUXING, muxing_options
+from utils.workspace import Workspace, atomic_write, cache_path
+from utils.keyframes import get_keyframes, extract_gop_aligned, smart_cut
+from utils.executor import get_executor
 
-config = dotenv_values(find_dotenv())
 logger = logging.getLogger(__name__)
-handler = logging.StreamHandler()
-handler.setFormatter(logging.Formatter('%(asctime)s %(name)-12s %(levelname)-8s %(message)s'))
-logger.addHandler(handler)
-logger.setLevel(logging.DEBUG)
 
 
 class FFProbeWrapper(FFprobe):
@@ -83,10 +83,10 @@ class FFProbeWrapper(FFprobe):
         Du coup, ce code cherche d'abord une valeur entre `[]` et se rabat sur l'autre sinon.
         """
         command = [
-            config['ffprobe'],
+            get_settings().ffprobe,
             self.videoSrc
         ]
-        proc = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        proc = get_executor().popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
         stdout, stderr = proc.communicate()
         err_str = str(stderr)
 
@@ -109,13 +109,16 @@ class FFProbeWrapper(FFprobe):
 
 
     def getVideoDuration(self):
-        cmd = f"{config['ffprobe']} -v error -show_entries format=duration -of default=noprint_wrappers=1:nokey=1"
-        cmd_a = cmd.split(" ")
-        cmd_a.append(self.videoSrc)
-        return float(subprocess.check_output(cmd_a))
+        cmd = [get_settings().ffprobe, '-v', 'error', '-show_entries', 'format=duration', '-of', 'default=noprint_wrappers=1:nokey=1', str(self.videoSrc)]
+        return float(get_executor().check_output(cmd))
 
 
 
+    def getAudioStream(self):
+        streams = self.getAudioStreamsInfo()
+        return streams[0] if streams else None
+
+
     def getSampleRate(self):
         audio = self.getAudioStreamsInfo()[0]
         return audio['sample_rate'] if 'sample_rate' in audio else None
@@ -127,69 +130,69 @@ class FFProbeWrapper(FFprobe):
 
 
 class FFmpegWrapper():
-    
-    bin = config['ffmpeg']
 
 
     def __init__(self, loglevel='quiet'):
+        self.bin = get_settings().ffmpeg
         self._loglevel = loglevel
-        self._inputs = []
-        self._params = []
-        self._outputs = []
+        self._clearCommand()
 
 
     def _commit(self):
         """Build the final command to run"""
-        self._command = f'{FFmpegWrapper.bin} -hide_banner -stats -loglevel {self._loglevel} '.split(' ')
-        self._command += self._inputs
-        self._command += self._params
-        self._command += self._outputs
+        self._command = self._builder.argv()
         return self._command
 
 
     def _addInput(self, input):
-        self._inputs.extend(['-i', input])
+        self._builder = self._builder.with_input(input)
 
 
     def _addParams(self, params):
         if not isinstance(params, list):
             params = [params]
-        self._params.extend(params)
+        self._builder = self._builder.with_tokens(params)
+
+
+    def _setOptions(self, options):
+        self._builder = self._builder.with_options(options)
 
     
     def _addOutput(self, output):
-        self._outputs.extend(['-y', output])
+        self._builder = self._builder.with_output(output)
 
 
     def execute(self):
         self._commit()
-        logger.debug(f'execute:  {self._command}')
-        process = subprocess.Popen(self._command, stdout=subprocess.PIPE, shell=True)
+        logger.debug(f'execute:  {self._builder}')
+        process = get_executor().popen(self._command, stdout=subprocess.PIPE)
         self._clearCommand()
         return process.communicate()
 
 
     def _clearCommand(self):
         self._command = []
-        self._inputs = []
-        self._params = []
-        self._outputs = []
+        self._builder = ffmpeg(self.bin, loglevel=self._loglevel)
 
 
-    def getExtractAtTime(self, input, start, duration, output=None):
-        
+    def getExtractAtTime(self, input, start, duration, output=None, mode='gop'):
+        """Extract [start, start + duration] of `input`, seeking on the input with the keyframe index.
+        - `gop` : stream copy of the whole GOPs covering the interval
+        - `smart` : exact cut, only the partial head GOP is re-encoded (H.264 sources libx264 can
+          match, the others fall back to `gop`)
+        """
+        input = Path(input)
         if not output:
-            input = Path(input)
             output = f"{input.stem}.t{start}.d{duration}{input.suffix}"
 
-        self._addInput(input)
-        self._addParams(f"-ss {start} -c copy -t {duration}".split(' '))
-        self._addOutput(output)
-
-        return self.execute()
+        key_frames = self.getKeyframes(input)
+        logger.debug(f'getExtractAtTime {input}, {start}, {duration}, {output}, {mode}')
+        if mode == 'smart':
+            return smart_cut(self.bin, input, output, start, duration, key_frames, loglevel=self._loglevel)
+        return extract_gop_aligned(self.bin, input, output, start, duration, key_frames, loglevel=self._loglevel)
 
 
-    def getExtractAroundTime(self, input, middle_time, duration, output=None):
+    def getExtractAroundTime(self, input, middle_time, duration, output=None, mode='gop'):
         ffprobe = FFProbeWrapper(input, loglevel=self._loglevel)
         full_duration = ffprobe.getVideoDuration()
         
@@ -204,30 +207,33 @@ class FFmpegWrapper():
             start = middle_time - duration / 2
 
         logger.debug(f'getExtractAroundTime {input}, {start}, {duration}, {output}')
-        return self.getExtractAtTime(input, start, duration, output)
+        return self.getExtractAtTime(input, start, duration, output, mode)
 
 
-    def encode(self, input, output, crf=27, mode='simple', size=None, dry_run=False, sample_rate=None, channels=None, frame_rate=None, threads=0, options={}):
+    def encode(self, input, output, crf=27, mode='simple', size=None, dry_run=False, sample_rate=None, channels=None, frame_rate=None, threads=None, options={}, audio=True, muxing=DEFAULT_MUXING):
+        """Encode `input` ; the audio is copied when it is already compliant, transcoded in parallel
+        with the video otherwise, or dropped with `audio=False` (trial encodes).
+        The `ffshort` mode muxes the output with `muxing` (see utils/muxing.py)"""
 
         input = Path(input).resolve()
         ffprobe_input = FFProbeWrapper(input, loglevel=self._loglevel)
         size        = size          if size         else ffprobe_input.getResolution()
         frame_rate  = frame_rate    if frame_rate   else ffprobe_input.getFrameRate()
-        sample_rate = sample_rate   if sample_rate  else ffprobe_input.getSampleRate()
-        channels    = channels      if channels     else ffprobe_input.getChannels()
+        threads     = threads       if threads is not None else get_threads('encode')
 
         self._addInput(input)
-        self._addParams([
-            '-c:a', 'aac',
-            '-ar', sample_rate,
-            '-ac', channels])
-        if mode != 'simple':
+        if audio:
+            self._setOptions(audio_options(ffprobe_input.getAudioStream(), sample_rate, channels))
+        else:
+            self._setOptions(NO_AUDIO)
+        if mode == 'simple':
+            self._addParams(['-crf', str(crf)])
+        else:
             self._addParams([
                 '-c:v', 'libx264',
                 '-sws_flags', 'bicubic',
                 '-pix_fmt', 'yuv420p',
                 '-threads', str(threads),
-                '-movflags', '+faststart',
                 # '-b-pyramid', 'none',
                 # '-b_strategy', '2',
                 '-r', str(frame_rate),
@@ -244,12 +250,20 @@ class FFmpegWrapper():
                 '-trellis', '2',
             ])
             self._addScaleParam(size)
-        self._addOutput(output)
+            duration = ffprobe_input.getVideoDuration() if muxing == 'reserve' else None
+            self._setOptions(muxing_options(muxing, duration, frame_rate, audio and ffprobe_input.getAudioStream() is not None))
+        self._setOptions(options)
 
         if dry_run:
-            return self._commit()
-        else:
-            return self.execute()
+            self._addOutput(output)
+            command = self._commit()
+            self._clearCommand()
+            return command
+
+        command = self._builder
+        self._clearCommand()
+        logger.debug(f'encode:  {command.with_output(output)}')
+        run_encode(command, output, Path(output).parent)
 
 
     def _addScaleParam(self, size):
@@ -260,19 +274,21 @@ class FFmpegWrapper():
         (w, h) = size.split('x')
         ratio = int(w) / int(h)
 
-        self._addParam(['-aspect', str(ratio), '-vf', f"scale={size},setsar=1/1"])
+        self._addParams(['-aspect', str(ratio), '-vf', f"scale={size},setsar=1/1"])
 
 
     def getScenescores(self, input, output=None):
 
         input = Path(input)
-        output = Path(output) if output else Path(f"/tmp/{input.stem}.json") 
+        output = Path(output) if output else cache_path(input, 'scenescores.json')
 
         if not output.exists():
+            from scenecut_extractor.__main__ import get_scenecuts
+
             scenescores = get_scenecuts(input, threshold=0)
             scenescores = sorted(scenescores, key=lambda ss: ss['score'])
 
-            with open(output, 'w') as fd:
+            with atomic_write(output) as fd:
                 fd.write(json.dumps(scenescores, indent=4))
         else:
             with open(output, 'r') as fd:
@@ -280,9 +296,24 @@ class FFmpegWrapper():
         
         return scenescores
 
+    def getKeyframes(self, input, output=None):
+        """Keyframe index of `input`, cached next to its scene scores"""
+        input = Path(input)
+        output = Path(output) if output else cache_path(input, 'keyframes.json')
+        return get_keyframes(input, output, ffprobe=get_settings().ffprobe)
+
     def getVmaf(self, original, encoded, log_path=None):
+        """VMAF scores of `encoded` for several synchronisation offsets.
+        Without `log_path`, the libvmaf log is written in a workspace of its own."""
+        if log_path:
+            return self._getVmaf(original, encoded, log_path)
+        with Workspace('vmaf') as workspace:
+            return self._getVmaf(original, encoded, workspace / f"{Path(encoded).stem}.json")
+
+    def _getVmaf(self, original, encoded, log_path):
+        from utils.easyVmaf.Vmaf import vmaf
+
         encoded = Path(encoded)
-        log_path = log_path if log_path else Path(f"/tmp/{encoded.stem}.json")
         my_vmaf = vmaf(encoded, original, 'json', log_path=log_path, loglevel='quiet')
         offset1, psnr1 = my_vmaf.syncOffset()  # TODO: étudier les arguments de cette fonction : syncWindow, start, reverse
         offset2, psnr2 = my_vmaf.syncOffset(reverse=True)
@@ -300,7 +331,7 @@ class FFmpegWrapper():
                 for frame in jsonData['frames']:
                     vmaf_scores.append(frame["metrics"]["vmaf"])
 
-            scores.append({'offset': offset, 'psnr': psnr, 'arithmetic mean': mean(vmaf_scores), 'harmonic mean': harmonic_mean})
+            scores.append({'offset': offset, 'psnr': psnr, 'arithmetic mean': mean(vmaf_scores), 'harmonic mean': harmonic_mean(vmaf_scores)})
         return scores
 
 
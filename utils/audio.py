@@ -0,0 +1,108 @@
+import json
+import logging
+import subprocess
+from pathlib import Path
+from utils.command import ffmpeg
+from utils.muxing import TEMPORARY, options_of
+from utils.executor import get_executor
+from utils.workspace import atomic_output
+
+logger = logging.getLogger(__name__)
+
+AUDIO_CODEC = 'aac'
+AAC_PROFILES = ['LC']
+
+# options removing the audio of an encode (trial encodes : the audio has no effect on VMAF)
+NO_AUDIO = {'-c:a': None, '-b:a': None, '-ar': None, '-ac': None, '-an': True}
+
+
+def probe_audio(input, ffprobe='ffprobe'):
+    """First audio stream of `input` as given by ffprobe, None if it has no audio"""
+    command = [str(ffprobe), '-v', 'error', '-select_streams', 'a:0', '-show_streams', '-print_format', 'json', str(input)]
+    streams = json.loads(get_executor().check_output(command))['streams']
+    return streams[0] if streams else None
+
+
+def is_compliant(stream, sample_rate=None, channels=None):
+    """Whether the audio stream can be copied as is : AAC-LC, at the target sample rate and channel count"""
+    if not stream or stream.get('codec_name') != AUDIO_CODEC or stream.get('profile') not in AAC_PROFILES:
+        return False
+    if sample_rate and int(stream.get('sample_rate', 0)) != int(sample_rate):
+        return False
+    if channels and int(stream.get('channels', 0)) != int(channels):
+        return False
+    return True
+
+
+def audio_options(stream, sample_rate=None, channels=None):
+    """Audio options of the final encode : no audio, a stream copy of a compliant source, or an AAC transcode"""
+    if not stream:
+        return NO_AUDIO
+    if is_compliant(stream, sample_rate, channels):
+        return {'-c:a': 'copy', '-ar': None, '-ac': None}
+    return {
+        '-c:a': AUDIO_CODEC,
+        '-ar': sample_rate if sample_rate else stream.get('sample_rate'),
+        '-ac': channels if channels else stream.get('channels'),
+    }
+
+
+def needs_transcode(command):
+    """Whether the audio of the command is transcoded (neither dropped nor copied)"""
+    return command.get_option('-an') is None and command.get_option('-c:a') not in (None, 'copy')
+
+
+def transcode_command(command, output):
+    """Audio only command with the audio options of the encode `command`"""
+    audio = {name: command.get_option(name) for name in ['-c:a', '-b:a', '-ar', '-ac']}
+    return ffmpeg(command.binary, loglevel='error', stats=False) \
+        .with_input(command.inputs[0].path) \
+        .with_options({'-vn': True, **audio}) \
+        .with_output(output)
+
+
+def mux_command(binary, video, audio, output, muxing={}):
+    """Stream copy of `video` and `audio` into `output`, muxed with the muxer options `muxing`"""
+    return ffmpeg(binary, loglevel='error', stats=False) \
+        .with_input(video) \
+        .with_input(audio) \
+        .with_options({'-map': ['0:v:0', '1:a:0'], '-c': 'copy', **muxing}) \
+        .with_output(output)
+
+
+def run_encode(command, output, tmp_dir):
+    """Run the encode `command` (without output) to `output`.
+    When the audio has to be transcoded, it is transcoded in its own process while the video is
+    encoded without audio, and both are muxed at the end : the audio transcode is done once and
+    doesn't wait for the video. The muxer options of `command` only apply to the final mux, the
+    intermediate video is written without them. `output` only appears once complete.
+    """
+    if not needs_transcode(command):
+        with atomic_output(output) as part:
+            get_executor().run(command.with_output(part).argv(), check=True)
+        return
+
+    tmp_dir = Path(tmp_dir)
+    tmp_dir.mkdir(parents=True, exist_ok=True)
+    stem = Path(output).stem
+    video_path = tmp_dir / f"{stem}.video.mp4"
+    audio_path = tmp_dir / f"{stem}.audio.m4a"
+
+    audio_process = None
+    try:
+        audio_process = get_executor().popen(transcode_command(command, audio_path).argv())
+        get_executor().run(command.with_options({**NO_AUDIO, **TEMPORARY}).with_output(video_path).argv(), check=True)
+        if audio_process.wait():
+            raise subprocess.CalledProcessError(audio_process.returncode, audio_process.args)
+        with atomic_output(output) as part:
+            mux = mux_command(command.binary, video_path, audio_path, part, options_of(command))
+            logger.debug(f"run_encode : {mux}")
+            get_executor().run(mux.argv(), check=True)
+    finally:
+        # the audio transcode doesn't outlive a failed video encode
+        if audio_process is not None and audio_process.poll() is None:
+            audio_process.kill()
+            audio_process.wait()
+        for path in [video_path, audio_path]:
+            if path.exists():
+                path.unlink()
@@ -0,0 +1,154 @@
+import json
+import sqlite3
+import hashlib
+from pathlib import Path
+from datetime import datetime
+
+PARTIAL_HASH_SIZE = 1024 * 1024
+
+
+def partial_hash(path, chunk_size=PARTIAL_HASH_SIZE):
+    """Hash of the size, the first and the last `chunk_size` bytes of a file : cheap even on huge videos"""
+    path = Path(path)
+    size = path.stat().st_size
+    sha = hashlib.sha1(str(size).encode())
+    with open(path, 'rb') as fd:
+        sha.update(fd.read(chunk_size))
+        if size > chunk_size:
+            fd.seek(max(chunk_size, size - chunk_size))
+            sha.update(fd.read(chunk_size))
+    return sha.hexdigest()
+
+
+def fingerprint(path):
+    """Content fingerprint of a source file : size, modification time and partial hash"""
+    stat = Path(path).stat()
+    return {'size': stat.st_size, 'mtime': int(stat.st_mtime), 'partial_hash': partial_hash(path)}
+
+
+def profile_hash(params):
+    """Short hash identifying a set of encoding parameters"""
+    return hashlib.sha1(json.dumps(params, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+
+class Catalogue():
+    """Persistent record of the encodings already done, stored in SQLite.
+
+    Each source is stored under its name with its fingerprint, the parameters and ffmpeg version
+    of its last encoding and the results. A source has to be processed again when it is new,
+    when its size or modification time changed, or when the encoding profile changed.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(self.path))
+        self._db.row_factory = sqlite3.Row
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute('''
+            CREATE TABLE IF NOT EXISTS sources (
+                name TEXT PRIMARY KEY,
+                size INTEGER,
+                mtime INTEGER,
+                partial_hash TEXT,
+                profile TEXT,
+                params TEXT,
+                ffmpeg_version TEXT,
+                status TEXT,
+                original_size INTEGER,
+                encoded_size INTEGER,
+                ratio REAL,
+                results TEXT,
+                updated_at TEXT
+            )''')
+        self._db.execute('CREATE INDEX IF NOT EXISTS sources_content ON sources (partial_hash, size)')
+        self._db.execute('''
+            CREATE TABLE IF NOT EXISTS probes (
+                name TEXT PRIMARY KEY,
+                size INTEGER,
+                mtime INTEGER,
+                info TEXT
+            )''')
+        self._db.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._db.close()
+
+    def get(self, name):
+        row = self._db.execute('SELECT * FROM sources WHERE name = ?', (name,)).fetchone()
+        return dict(row) if row else None
+
+    def find_content(self, partial_hash, size, profile):
+        """Entry of another source with the same content already processed with `profile`, if any"""
+        row = self._db.execute(
+            'SELECT * FROM sources WHERE partial_hash = ? AND size = ? AND profile = ? LIMIT 1',
+            (partial_hash, size, profile)).fetchone()
+        return dict(row) if row else None
+
+    def get_probe(self, name, size, mtime):
+        """Triage info of a source probed while it had this size and mtime, None if it has to be probed"""
+        row = self._db.execute('SELECT info FROM probes WHERE name = ? AND size = ? AND mtime = ?', (name, size, mtime)).fetchone()
+        return json.loads(row['info']) if row else None
+
+    def record_probe(self, name, size, mtime, info):
+        self._db.execute('INSERT OR REPLACE INTO probes (name, size, mtime, info) VALUES (?, ?, ?, ?)',
+                         (name, size, mtime, json.dumps(info)))
+        self._db.commit()
+
+    def encoded(self):
+        """Ratio and results of the sources that were encoded"""
+        rows = self._db.execute('SELECT ratio, results FROM sources WHERE ratio IS NOT NULL')
+        return [(row['ratio'], json.loads(row['results']) if row['results'] else {}) for row in rows]
+
+    def is_up_to_date(self, name, size, mtime, profile):
+        entry = self.get(name)
+        return bool(entry) and entry['size'] == size and entry['mtime'] == mtime and entry['profile'] == profile
+
+    def pending(self, names, listing, profile):
+        """Names that are new, changed or processed with another profile.
+        `listing` gives the current size and mtime of each name ; the names missing from it are ignored.
+        """
+        known = {}
+        for i in range(0, len(names), 500):
+            chunk = names[i:i + 500]
+            rows = self._db.execute(
+                f"SELECT name, size, mtime, profile FROM sources WHERE name IN ({','.join('?' * len(chunk))})", chunk)
+            known.update({row['name']: row for row in rows})
+
+        pending = []
+        for name in names:
+            if name not in listing:
+                continue
+            entry = known.get(name)
+            current = listing[name]
+            if not entry or entry['size'] != current['size'] or entry['mtime'] != current['mtime'] or entry['profile'] != profile:
+                pending.append(name)
+        return pending
+
+    def record(self, name, fingerprint, params, ffmpeg_version, status, original_size=None, encoded_size=None, ratio=None, results=None):
+        self._db.execute('''
+            INSERT OR REPLACE INTO sources
+            (name, size, mtime, partial_hash, profile, params, ffmpeg_version, status, original_size, encoded_size, ratio, results, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''', (
+                name,
+                fingerprint['size'],
+                fingerprint['mtime'],
+                fingerprint['partial_hash'],
+                profile_hash(params),
+                json.dumps(params, sort_keys=True, default=str),
+                ffmpeg_version,
+                status,
+                original_size,
+                encoded_size,
+                ratio,
+                json.dumps(results, default=str) if results else None,
+                datetime.now().isoformat(timespec='seconds'),
+            ))
+        self._db.commit()
@@ -0,0 +1,97 @@
+"""Command line entry point of the helpers : `python -m utils <command> [args]`
+
+Each command only imports the modules it needs when it runs, so that the short invocations
+(a probe, a dry run of ffshort) don't pay for the loading of scenecut_extractor or easyVmaf.
+"""
+
+import sys
+
+USAGE = """usage: python -m utils <command> [args]
+
+commands:
+  probe          print the streams and format of a video as json
+  ffshort        encode a video (see `python -m utils ffshort --help`)
+  scenescores    compute the scene scores of a video
+  keyframes      build the keyframe index of a video
+  plan-threads   measure this host and save its thread plan
+  vmaf-features  extract the VMAF elementary features once and score them with any model
+  results        aggregate the results stored by the studies (summary, options, crf, bd-rate)
+  mux-bench      compare the I/O and tail latency of the muxing modes of the MP4 outputs
+  simulate       benchmark the orchestration at scale on the simulated executor
+"""
+
+
+def probe(argv):
+    import json
+    import argparse
+    from utils.settings import get_settings
+    from utils.executor import get_executor
+
+    parser = argparse.ArgumentParser(prog='python -m utils probe')
+    parser.add_argument('input', help="Video file to probe")
+    args = parser.parse_args(argv)
+
+    command = [get_settings().ffprobe, '-v', 'error', '-print_format', 'json', '-show_streams', '-show_format', args.input]
+    print(json.dumps(json.loads(get_executor().check_output(command)), indent=4))
+
+
+def ffshort(argv):
+    from external.ffshort import main
+    sys.argv = ['python -m utils ffshort', *argv]
+    main()
+
+
+def scenescores(argv):
+    from utils.ffmpeg_scenescores import main
+    main(argv)
+
+
+def keyframes(argv):
+    from utils.keyframes import main
+    main(argv)
+
+
+def plan_threads(argv):
+    from utils.thread_planner import main
+    main(argv)
+
+
+def vmaf_features(argv):
+    from utils.vmaf_features import main
+    main(argv)
+
+
+def results(argv):
+    from utils.results_query import main
+    main(argv)
+
+
+def mux_bench(argv):
+    from utils.muxing import main
+    main(argv)
+
+
+def simulate(argv):
+    from utils.simulation import main
+    main(argv)
+
+
+COMMANDS = {
+    'probe': probe,
+    'ffshort': ffshort,
+    'scenescores': scenescores,
+    'keyframes': keyframes,
+    'plan-threads': plan_threads,
+    'vmaf-features': vmaf_features,
+    'results': results,
+    'mux-bench': mux_bench,
+    'simulate': simulate,
+}
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv or argv[0] not in COMMANDS:
+        print(USAGE, file=sys.stderr)
+        sys.exit(0 if argv and argv[0] in ('-h', '--help') else 2)
+    COMMANDS[argv[0]](argv[1:])
@@ -0,0 +1,160 @@
+import re
+import shlex
+import hashlib
+from dataclasses import dataclass, field, replace
+from typing import Optional, Tuple, Union
+
+Value = Union[str, int, float, bool, None]
+Options = Tuple[Tuple[str, Value], ...]
+
+_OPTION = re.compile(r'^-[a-zA-Z_:]')
+# options given once per value, in order (`-map 0:v:0 -map 1:a:0`) ; the others take one value
+MULTI_VALUED = {'-map', '-metadata', '-attach'}
+
+
+def _pairs(overrides):
+    """`(name, value)` pairs of a dict or of a sequence of pairs ; a list value of a multi-valued
+    option gives one pair per value
+    """
+    pairs = overrides.items() if isinstance(overrides, dict) else overrides
+    for name, value in pairs:
+        if name in MULTI_VALUED and isinstance(value, (list, tuple)):
+            yield from ((name, v) for v in value)
+        else:
+            yield name, value
+
+
+def _set_options(options, overrides, unique=False):
+    """Apply `overrides` to the `(name, value)` pairs of `options`, with the semantics of the
+    `options` argument of `ffshort` : an existing option takes the new value, a `None` value
+    removes the option and a new option is appended.
+    A multi-valued option (`MULTI_VALUED`) appends each value in the order given instead (a value
+    it already has is skipped with `unique`, kept otherwise : `-map 0:a` twice duplicates a track),
+    and `None` removes all its values.
+    `True` is an option without value (`-an`, `-y`).
+    """
+    options = list(options)
+    for name, value in _pairs(overrides):
+        names = [o[0] for o in options]
+        if value is None:
+            options = [o for o in options if o[0] != name]
+        elif name in MULTI_VALUED:
+            if not unique or (name, value) not in options:
+                options.append((name, value))
+        elif name in names:
+            options[names.index(name)] = (name, value)
+        else:
+            options.append((name, value))
+    return tuple(options)
+
+
+def options_from_tokens(tokens):
+    """Group a flat list of tokens (`['-c:a', 'aac', '-an']`) into `(name, value)` pairs"""
+    tokens = [str(t) for t in tokens]
+    options = []
+    i = 0
+    while i < len(tokens):
+        name = tokens[i]
+        if i + 1 < len(tokens) and not _OPTION.match(tokens[i + 1]):
+            options.append((name, tokens[i + 1]))
+            i += 2
+        else:
+            options.append((name, True))
+            i += 1
+    return tuple(options)
+
+
+def _tokens(options):
+    tokens = []
+    for name, value in options:
+        tokens.append(name)
+        if value is not True:
+            tokens.append(str(value))
+    return tokens
+
+
+@dataclass(frozen=True)
+class Input():
+    path: str
+    options: Options = ()
+
+
+@dataclass(frozen=True)
+class Output():
+    path: str
+    options: Options = ()
+
+
+@dataclass(frozen=True)
+class FFmpegCommand():
+    """Immutable description of an ffmpeg command, emitted directly as an argument vector.
+
+    Every `with_*` method returns a new command, so a base command can be shared and derived,
+    and commands can be used as dictionary keys or hashed with `key()` for caching.
+    `options` are the codec and muxer options shared by all the outputs, written before the
+    specific options of each output.
+    """
+    binary: str = 'ffmpeg'
+    global_options: Options = (('-hide_banner', True),)
+    inputs: Tuple[Input, ...] = ()
+    filtergraph: Optional[str] = None
+    options: Options = ()
+    outputs: Tuple[Output, ...] = field(default=())
+
+    def with_global_options(self, overrides):
+        return replace(self, global_options=_set_options(self.global_options, overrides))
+
+    def with_input(self, path, options=()):
+        """Add an input ; `options` (e.g. `{'-ss': 10}`) are placed before its `-i`"""
+        return replace(self, inputs=self.inputs + (Input(str(path), _set_options((), options)),))
+
+    def with_filtergraph(self, filtergraph):
+        return replace(self, filtergraph=filtergraph)
+
+    def with_options(self, overrides, unique=False):
+        """Set, replace (or remove with `None`) shared output options ; the multi-valued ones
+        (`-map`...) take a list of values, or add a value to the ones they have (only if they
+        don't have it yet with `unique`)
+        """
+        return replace(self, options=_set_options(self.options, overrides, unique))
+
+    def with_tokens(self, tokens):
+        """Set shared output options given as a flat list of tokens, in order"""
+        return self.with_options(options_from_tokens(tokens))
+
+    def with_output(self, path, options=()):
+        """Add an output, overwritten if it exists ; `options` are specific to this output"""
+        return replace(self, outputs=self.outputs + (Output(str(path), _set_options((), options)),))
+
+    def get_option(self, name, default=None):
+        """Value of a shared option (the last one of a multi-valued option)"""
+        return dict(self.options).get(name, default)
+
+    def get_options(self, name):
+        """Values of a shared multi-valued option, in order"""
+        return [value for option, value in self.options if option == name]
+
+    def argv(self):
+        argv = [str(self.binary), *_tokens(self.global_options)]
+        for input in self.inputs:
+            argv.extend([*_tokens(input.options), '-i', input.path])
+        if self.filtergraph:
+            argv.extend(['-filter_complex', self.filtergraph])
+        for output in self.outputs:
+            argv.extend([*_tokens(self.options), *_tokens(output.options), '-y', output.path])
+        return argv
+
+    def key(self):
+        """Stable hash of the command, usable as a cache key"""
+        return hashlib.sha1('\0'.join(self.argv()).encode()).hexdigest()
+
+    def __str__(self):
+        return shlex.join(self.argv())
+
+
+def ffmpeg(binary='ffmpeg', loglevel='quiet', stats=True):
+    """Base command with the usual global options of the project"""
+    options = {'-hide_banner': True, '-loglevel': loglevel}
+    if stats:
+        options['-stats'] = True
+    return FFmpegCommand(binary=str(binary), global_options=()).with_global_options(options)
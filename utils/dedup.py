@@ -0,0 +1,148 @@
+"""Detection of the copies of a source already processed : re-uploads and re-exports of the same recording.
+
+A source is identified by the hash of its file (see `catalogue.fingerprint()`) and by a perceptual
+signature : the average hash of frames taken at fixed fractions of its duration, each frame scaled
+down to 8x8 gray pixels whose bits tell whether a pixel is brighter than the mean. A re-export at
+another resolution or bitrate has the same signature, give or take a few bits.
+
+The signatures are indexed in SQLite with locality-sensitive hashing : each signature is cut in
+bands, and only the sources sharing at least one band with a signature are compared with it. The
+bands of uniform frames (black or flat frames, missing frames) are left out of the index : every
+video with a fade to black would share them.
+
+A near match is only a candidate : it is confirmed on a denser signature (DETAIL_FRAME_COUNT
+frames), stored for each source along with its signature.
+"""
+
+import sqlite3
+import logging
+from pathlib import Path
+from utils.executor import get_executor
+
+logger = logging.getLogger(__name__)
+
+FRAME_COUNT = 16
+# frames of the signature confirming a near match
+DETAIL_FRAME_COUNT = 64
+HASH_SIZE = 8
+# hexadecimal digits of a band : 8 digits = 32 bits, half the hash of a frame
+BAND_DIGITS = 8
+# proportion of different bits under which two signatures are the same video
+MAX_DISTANCE = 0.1
+DURATION_TOLERANCE = 0.01
+
+
+def frame_hash(ffmpeg, input, time):
+    """Average hash of the frame at `time`, 0 if there is no frame there"""
+    command = [
+        str(ffmpeg), '-v', 'error', '-ss', str(time), '-i', str(input), '-frames:v', '1',
+        '-vf', f"scale={HASH_SIZE}:{HASH_SIZE}:flags=area,format=gray", '-f', 'rawvideo', '-'
+    ]
+    pixels = get_executor().check_output(command)[:HASH_SIZE * HASH_SIZE]
+    if len(pixels) < HASH_SIZE * HASH_SIZE:
+        return 0
+    mean = sum(pixels) / len(pixels)
+    return sum(1 << i for i, pixel in enumerate(pixels) if pixel > mean)
+
+
+def signature(ffmpeg, input, duration, count=FRAME_COUNT):
+    """Perceptual signature of a video : the hashes of `count` frames spread over its duration, in hexadecimal"""
+    digits = HASH_SIZE * HASH_SIZE // 4
+    return ''.join(f"{frame_hash(ffmpeg, input, duration * (i + 0.5) / count):0{digits}x}" for i in range(count))
+
+
+def distance(a, b):
+    """Proportion of different bits between two signatures"""
+    if len(a) != len(b):
+        return 1.0
+    return bin(int(a, 16) ^ int(b, 16)).count('1') / (len(a) * 4)
+
+
+def uniform(value):
+    """Whether hexadecimal hash digits are those of uniform pixels (all darker or all brighter than the mean)"""
+    return set(value) <= {'0'} or set(value) <= {'f'}
+
+
+def bands(signature):
+    """`(index, value)` of the bands of a signature, without the uniform ones"""
+    values = [signature[i:i + BAND_DIGITS] for i in range(0, len(signature), BAND_DIGITS)]
+    return [(i, value) for i, value in enumerate(values) if not uniform(value)]
+
+
+class SignatureIndex():
+    """File hashes and perceptual signatures of the sources processed, stored in SQLite (the
+    database of the catalogue by default)
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(self.path))
+        self._db.row_factory = sqlite3.Row
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('''
+            CREATE TABLE IF NOT EXISTS signatures (
+                name TEXT PRIMARY KEY,
+                size INTEGER,
+                partial_hash TEXT,
+                duration REAL,
+                signature TEXT,
+                detail TEXT
+            )''')
+        # the indexes created before the confirmation of the near matches have no detailed signature
+        if 'detail' not in {row['name'] for row in self._db.execute('PRAGMA table_info(signatures)')}:
+            self._db.execute('ALTER TABLE signatures ADD COLUMN detail TEXT')
+        self._db.execute('CREATE INDEX IF NOT EXISTS signatures_content ON signatures (partial_hash, size)')
+        self._db.execute('CREATE TABLE IF NOT EXISTS signature_bands (band INTEGER, value TEXT, name TEXT)')
+        self._db.execute('CREATE INDEX IF NOT EXISTS signature_bands_value ON signature_bands (band, value)')
+        self._db.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._db.close()
+
+    def add(self, name, fingerprint, duration, signature, detail=None):
+        self._db.execute('DELETE FROM signature_bands WHERE name = ?', (name,))
+        self._db.execute('INSERT OR REPLACE INTO signatures (name, size, partial_hash, duration, signature, detail) VALUES (?, ?, ?, ?, ?, ?)',
+                         (name, fingerprint['size'], fingerprint['partial_hash'], duration, signature, detail))
+        self._db.executemany('INSERT INTO signature_bands (band, value, name) VALUES (?, ?, ?)',
+                             [(i, value, name) for i, value in bands(signature)])
+        self._db.commit()
+
+    def exact(self, fingerprint, exclude=None):
+        """Names of the sources whose file had the same size and hash"""
+        rows = self._db.execute('SELECT name FROM signatures WHERE partial_hash = ? AND size = ? AND name != ?',
+                                (fingerprint['partial_hash'], fingerprint['size'], exclude or ''))
+        return [row['name'] for row in rows]
+
+    def nearest(self, signature, duration, exclude=None, max_distance=MAX_DISTANCE):
+        """Closest source of the same duration whose signature is within `max_distance`, as `(name, distance)`, or None"""
+        candidates = {}
+        for i, value in bands(signature):
+            for row in self._db.execute('''
+                    SELECT s.name, s.duration, s.signature FROM signature_bands b JOIN signatures s ON s.name = b.name
+                    WHERE b.band = ? AND b.value = ?''', (i, value)):
+                candidates[row['name']] = row
+        matches = []
+        for name, row in candidates.items():
+            if name == exclude or abs(row['duration'] - duration) > max(1.0, duration * DURATION_TOLERANCE):
+                continue
+            d = distance(signature, row['signature'])
+            if d <= max_distance:
+                matches.append((d, name))
+        logger.debug(f"nearest : {len(candidates)} candidates, {len(matches)} matches")
+        return (min(matches)[1], min(matches)[0]) if matches else None
+
+    def confirm(self, name, detail, max_distance=MAX_DISTANCE):
+        """Whether the detailed signature of the source `name` is within `max_distance` of `detail`.
+        A source indexed without a detailed signature is never confirmed.
+        """
+        row = self._db.execute('SELECT detail FROM signatures WHERE name = ?', (name,)).fetchone()
+        if not detail or not row or not row['detail']:
+            return False
+        return distance(detail, row['detail']) <= max_distance
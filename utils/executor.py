@@ -0,0 +1,600 @@
+"""Executors of the external commands (ffmpeg, ffprobe, rsync, ssh) : the real one, and a simulated
+one to test the orchestration (scheduling, caches, concurrency limits, crash recovery) at scale.
+
+`get_executor()` gives the executor of the process : the subprocess one by default, the simulated
+one with `executor='simulated'` in the .env file (`executor_speed`, `executor_profiles`) or after
+`set_executor()`. Its `run()`, `check_output()` and `popen()` take the arguments of their
+`subprocess` counterparts. The benchmarks measuring the real processes (CPU time, block I/O,
+throughput) take `real_executor()` instead, which refuses to run them under the simulation.
+
+The simulated executor runs nothing : it recognizes the command (probe, encode, stream copy, VMAF,
+transfer...), computes its duration, its outputs and its result from job profiles, and waits for
+that duration on an accelerated clock. The profiles are parametric (`DEFAULT_PROFILES`, overridden
+by a JSON file) or recorded from the encodes of the catalogue (`recorded_profiles()`). The media
+files it writes are sparse files of the simulated size starting with their simulated metadata, so
+they can be probed, copied, moved and transferred like real ones, by other processes too.
+Failures (exit code 1, with a partial output) and crashes of the orchestrating process
+(`SimulatedCrash`) are injected at the rates of the profiles.
+
+The clock accelerates everything, the orchestration itself included : at a speed of 10000, 1 ms
+of Python counts for 10 s of simulated time. The speed is to be chosen so that the simulated
+jobs still last a few milliseconds. A single threaded simulation can run on a `VirtualClock`
+instead, which only moves with the simulated commands : its results are deterministic.
+"""
+
+import io
+import re
+import json
+import shlex
+import random
+import hashlib
+import logging
+import threading
+import subprocess
+import time as _time
+from pathlib import Path
+from fractions import Fraction
+
+logger = logging.getLogger(__name__)
+
+MEDIA_MAGIC = b'#simulated-media '
+HEADER_SIZE = 4096
+AUDIO_BITRATE = 128000
+# size of a lossless (-qp 0) encode relative to the source
+LOSSLESS_RATIO = 8
+# CRF of the `size_ratio` of the encode profile ; the size doubles every 6 CRF below
+REFERENCE_CRF = 27
+GOP_SECONDS = 10
+
+DEFAULT_PROFILES = {
+    # sources, drawn from their name : uniform duration and bits per pixel, one of the heights
+    'source': {'duration': [600, 7200], 'height': [720, 1080], 'frame_rate': 25, 'bpp': [0.05, 0.25], 'codec': 'h264', 'audio': True},
+    'encode': {'pixels_per_second': 20e6, 'cpu': 4, 'size_ratio': 0.5, 'jitter': 0.1, 'failure_rate': 0.0},
+    # VMAF of an encode : `score` at CRF 23, `score_per_crf` less for each CRF above
+    'vmaf': {'pixels_per_second': 60e6, 'cpu': 4, 'score': 96.0, 'score_per_crf': 1.2, 'frame_stdev': 2.0, 'jitter': 0.1, 'failure_rate': 0.0},
+    'copy': {'bytes_per_second': 400e6, 'seconds': 0.05, 'cpu': 1, 'failure_rate': 0.0},
+    'probe': {'seconds': 0.05, 'cpu': 1, 'failure_rate': 0.0},
+    'transfer': {'bytes_per_second': 50e6, 'seconds': 0.5, 'cpu': 0.2, 'failure_rate': 0.0},
+    'other': {'seconds': 0.01, 'cpu': 0, 'failure_rate': 0.0},
+    # probability for each command to crash the orchestrating process
+    'crash_rate': 0.0,
+}
+
+FFMPEG_FLAGS = {'-y', '-n', '-an', '-vn', '-sn', '-dn', '-hide_banner', '-stats', '-nostats', '-nostdin', '-shortest', '-copyts'}
+FFPROBE_VALUES = {'-v', '-loglevel', '-print_format', '-of', '-show_entries', '-select_streams', '-skip_frame', '-read_intervals'}
+
+
+class SimulatedCrash(BaseException):
+    """Crash of the orchestrating process injected by the simulated executor : a BaseException,
+    so that it goes through the `except Exception` of the code under test like a kill would
+    """
+
+
+class Clock():
+    """Time of the simulation : the real time since the creation of the clock, `speed` times faster"""
+
+    def __init__(self, speed=1.0):
+        self.speed = float(speed)
+        self._origin = _time.time()
+        self._start = _time.monotonic()
+
+    def time(self):
+        return self._origin + (_time.monotonic() - self._start) * self.speed
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            _time.sleep(seconds / self.speed)
+
+
+class VirtualClock():
+    """Time of a discrete-event simulation : it only moves when a command waits for its end or when
+    it is set, and nothing waits for real, so the results don't depend on the speed of the host
+    """
+
+    def __init__(self, start=0.0):
+        self._now = float(start)
+
+    def time(self):
+        return self._now
+
+    def set(self, now):
+        self._now = float(now)
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            self._now += seconds
+
+
+class SubprocessExecutor():
+    """The external commands, run for real"""
+
+    clock = Clock()
+
+    def popen(self, args, **kwargs):
+        return subprocess.Popen(args, **kwargs)
+
+    def run(self, args, **kwargs):
+        return subprocess.run(args, **kwargs)
+
+    def check_output(self, args, **kwargs):
+        return subprocess.check_output(args, **kwargs)
+
+
+def load_profiles(path=None):
+    """`DEFAULT_PROFILES` updated, kind by kind, with the JSON file `path`"""
+    profiles = {kind: dict(value) if isinstance(value, dict) else value for kind, value in DEFAULT_PROFILES.items()}
+    if path:
+        with open(path, 'r') as fd:
+            for kind, value in json.load(fd).items():
+                profiles[kind] = {**profiles.get(kind, {}), **value} if isinstance(value, dict) else value
+    return profiles
+
+
+def recorded_profiles(catalogue_path, profiles=None):
+    """Profiles learnt from the encodes recorded in the catalogue : the sources are replayed from
+    their triage info, the encode speed and the size ratio are the medians of the records
+    """
+    from statistics import median
+    from utils.catalogue import Catalogue
+    from utils.planner import pixels
+
+    profiles = profiles if profiles else load_profiles()
+    with Catalogue(catalogue_path) as catalogue:
+        records = [(ratio, results) for ratio, results in catalogue.encoded() if pixels(results.get('info'))]
+    if not records:
+        return profiles
+    profiles['source'] = {**profiles['source'], 'samples': [results['info'] for _, results in records]}
+    speeds = [pixels(results['info']) / results['encode_seconds'] for _, results in records if results.get('encode_seconds')]
+    if speeds:
+        profiles['encode'] = {**profiles['encode'], 'pixels_per_second': median(speeds)}
+    profiles['encode'] = {**profiles['encode'], 'size_ratio': median(ratio for ratio, _ in records)}
+    return profiles
+
+
+def write_media(path, media, size):
+    """Sparse file of `size` bytes starting with the simulated metadata `media`"""
+    header = MEDIA_MAGIC + json.dumps(media).encode() + b'\n'
+    with open(path, 'wb') as fd:
+        fd.write(header)
+        fd.truncate(max(int(size), len(header)))
+
+
+def read_media(path):
+    """Simulated metadata of a file written by `write_media()`, None for any other file"""
+    try:
+        with open(path, 'rb') as fd:
+            head = fd.read(HEADER_SIZE)
+    except OSError:
+        return None
+    if not head.startswith(MEDIA_MAGIC) or b'\n' not in head:
+        return None
+    return json.loads(head[len(MEDIA_MAGIC):head.index(b'\n')])
+
+
+def media_size(media):
+    video = media['bitrate'] * media['duration'] / 8 if media.get('video', True) else 0
+    return int(video + (AUDIO_BITRATE * media['duration'] / 8 if media.get('audio') else 0))
+
+
+def _draw(name, salt):
+    """Uniform value in [0, 1) drawn from `name` : the same source is the same in every process"""
+    return int(hashlib.sha1(f"{salt}:{name}".encode()).hexdigest()[:8], 16) / 2 ** 32
+
+
+def _frame_rate(media):
+    fraction = Fraction(str(media['frame_rate'])).limit_denominator(1001)
+    return f"{fraction.numerator}/{fraction.denominator}"
+
+
+def _unescape(value):
+    return re.sub(r'\\(.)', r'\1', value)
+
+
+class SimulatedProcess():
+    """A simulated command : its result is known from the start, and it ends `seconds` later on the clock"""
+
+    def __init__(self, executor, args, job, stdout=None, stderr=None, text=False):
+        self.args = args
+        self.pid = -1
+        self.returncode = None
+        self._executor = executor
+        self._job = job
+        self._text = text
+        self._end = executor.clock.time() + job['seconds']
+        self._lock = threading.Lock()
+        self._pipes = (stdout == subprocess.PIPE, stderr == subprocess.PIPE)
+        self.stdout = self._stream(job['stdout']) if self._pipes[0] else None
+        self.stderr = self._stream(job['stderr']) if self._pipes[1] else None
+
+    def _stream(self, value):
+        return io.StringIO(value) if self._text else io.BytesIO(value.encode())
+
+    def _value(self, value):
+        return value if self._text else value.encode()
+
+    def _finish(self, returncode=None):
+        with self._lock:
+            if self.returncode is not None:
+                return
+            self.returncode = self._job['returncode'] if returncode is None else returncode
+            self._executor._finish(self._job, self.returncode, completed=returncode is None)
+
+    def poll(self):
+        if self.returncode is None and self._executor.clock.time() >= self._end:
+            self._finish()
+        return self.returncode
+
+    def wait(self, timeout=None):
+        if self.returncode is not None:
+            return self.returncode
+        self._executor.clock.sleep(self._end - self._executor.clock.time())
+        self._finish()
+        return self.returncode
+
+    def communicate(self, input=None, timeout=None):
+        self.wait()
+        return (self._value(self._job['stdout']) if self._pipes[0] else None,
+                self._value(self._job['stderr']) if self._pipes[1] else None)
+
+    def kill(self):
+        self._finish(-9)
+
+    terminate = kill
+
+
+class SimulatedExecutor():
+    """Commands simulated from job `profiles` on an accelerated `clock` (see the module docstring).
+    `stats` sums, for each kind of job, the jobs, failures, simulated seconds and CPU seconds.
+    """
+
+    def __init__(self, profiles=None, clock=None, seed=0):
+        self.profiles = profiles if profiles else load_profiles()
+        self.clock = clock if clock else Clock()
+        self.stats = {}
+        self.in_flight = 0
+        self.max_in_flight = 0
+        # files uploaded to the simulated server, by name
+        self.remote = {}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    # subprocess interface
+
+    def popen(self, args, stdout=None, stderr=None, text=False, universal_newlines=False, **kwargs):
+        args = [str(a) for a in args]
+        job = self._job(args)
+        with self._lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        return SimulatedProcess(self, args, job, stdout, stderr, text or universal_newlines)
+
+    def run(self, args, check=False, stdout=None, stderr=None, text=False, universal_newlines=False, capture_output=False, **kwargs):
+        if capture_output:
+            stdout = stderr = subprocess.PIPE
+        process = self.popen(args, stdout=stdout, stderr=stderr, text=text or universal_newlines)
+        out, err = process.communicate()
+        if check and process.returncode:
+            raise subprocess.CalledProcessError(process.returncode, process.args, out, err)
+        return subprocess.CompletedProcess(process.args, process.returncode, out, err)
+
+    def check_output(self, args, **kwargs):
+        return self.run(args, check=True, stdout=subprocess.PIPE, **kwargs).stdout
+
+    def summary(self):
+        return {'max_in_flight': self.max_in_flight, **{kind: dict(stats) for kind, stats in self.stats.items()}}
+
+    # end of the jobs
+
+    def _uniform(self):
+        with self._lock:
+            return self._random.random()
+
+    def _finish(self, job, returncode, completed=True):
+        crash = completed and self._uniform() < self.profiles.get('crash_rate', 0)
+        for path, media, content in job['outputs']:
+            # a failed or killed command leaves a partial output
+            partial = self._uniform() if returncode or crash else 1
+            if media is None:
+                with open(path, 'w') as fd:
+                    fd.write(content[:int(len(content) * partial)])
+            else:
+                write_media(path, media, content * partial)
+        with self._lock:
+            self.in_flight -= 1
+            stats = self.stats.setdefault(job['kind'], {'jobs': 0, 'failures': 0, 'seconds': 0.0, 'cpu_seconds': 0.0})
+            stats['jobs'] += 1
+            stats['failures'] += 1 if job['returncode'] else 0
+            stats['seconds'] += job['seconds']
+            stats['cpu_seconds'] += job['seconds'] * job['cpu']
+        if crash:
+            raise SimulatedCrash(f"simulated crash during {' '.join(job['args'][:3])}...")
+
+    # jobs
+
+    def _job(self, args):
+        program = Path(args[0]).name
+        if program.startswith('ffprobe'):
+            job = self._probe(args)
+        elif program.startswith('ffmpeg'):
+            job = self._ffmpeg(args)
+        elif program == 'rsync':
+            job = self._rsync(args)
+        elif program == 'ssh':
+            job = self._ssh(args)
+        elif program == 'touch':
+            job = self._new_job('other', outputs=[(path, None, '') for path in args[1:]])
+        else:
+            logger.warning(f"{program} is not simulated, it ends at once")
+            job = self._new_job('other')
+        job['args'] = args
+
+        profile = self.profiles.get(job['kind'], {})
+        if job['seconds'] and profile.get('jitter'):
+            with self._lock:
+                job['seconds'] *= max(0.1, self._random.gauss(1, profile['jitter']))
+        if self._uniform() < profile.get('failure_rate', 0):
+            job.update({'returncode': 1, 'stdout': '', 'stderr': f"simulated failure of {program}\n"})
+        return job
+
+    def _new_job(self, kind, seconds=None, outputs=(), stdout='', stderr=''):
+        profile = self.profiles.get(kind, {})
+        return {
+            'kind': kind,
+            'seconds': profile.get('seconds', 0) if seconds is None else seconds,
+            'cpu': profile.get('cpu', 0),
+            'returncode': 0,
+            'stdout': stdout,
+            'stderr': stderr,
+            'outputs': list(outputs),
+        }
+
+    def source_media(self, name):
+        """Simulated metadata of the source `name`, the same in every process"""
+        profile = self.profiles['source']
+        if profile.get('samples'):
+            sample = profile['samples'][int(_draw(name, 'sample') * len(profile['samples']))]
+            media = {key: sample[key] for key in ['duration', 'width', 'height', 'frame_rate', 'codec', 'bitrate']}
+            media['bitrate'] = media['bitrate'] or 0.1 * media['width'] * media['height'] * media['frame_rate']
+        else:
+            low, high = profile['duration']
+            duration = low + (high - low) * _draw(name, 'duration')
+            height = profile['height'][int(_draw(name, 'height') * len(profile['height']))]
+            width = round(height * 16 / 9 / 2) * 2
+            low, high = profile['bpp']
+            bpp = low + (high - low) * _draw(name, 'bpp')
+            media = {'duration': duration, 'width': width, 'height': height, 'frame_rate': profile['frame_rate'],
+                     'codec': profile['codec'], 'bitrate': bpp * width * height * profile['frame_rate']}
+        return {**media, 'source_bitrate': media['bitrate'], 'audio': profile.get('audio', True), 'video': True, 'crf': None}
+
+    def _media(self, path, remote=False):
+        """Metadata and size of a file : its simulated metadata, or the metadata of the source of
+        its name (with the bitrate of the file if it exists)
+        """
+        name = Path(path).name
+        if remote and name in self.remote:
+            return self.remote[name]
+        media = None if remote else read_media(path)
+        if media:
+            return media, Path(path).stat().st_size
+        media = self.source_media(name)
+        if not remote and Path(path).is_file():
+            size = Path(path).stat().st_size
+            media['bitrate'] = media['source_bitrate'] = max(0, size * 8 / media['duration'] - (AUDIO_BITRATE if media['audio'] else 0))
+            return media, size
+        return media, media_size(media)
+
+    def _streams(self, media):
+        streams = []
+        if media.get('video', True):
+            streams.append({
+                'index': 0, 'codec_type': 'video', 'codec_name': media['codec'], 'profile': 'High', 'level': 40, 'pix_fmt': 'yuv420p',
+                'width': media['width'], 'height': media['height'], 'coded_width': media['width'], 'coded_height': media['height'],
+                'sample_aspect_ratio': '1:1', 'avg_frame_rate': _frame_rate(media), 'r_frame_rate': _frame_rate(media),
+                'bit_rate': str(int(media['bitrate'])), 'duration': str(media['duration']),
+                'nb_frames': str(int(media['duration'] * float(Fraction(str(media['frame_rate']))))),
+            })
+        if media.get('audio'):
+            streams.append({'index': len(streams), 'codec_type': 'audio', 'codec_name': 'aac', 'profile': 'LC',
+                            'sample_rate': '48000', 'channels': 2, 'bit_rate': str(AUDIO_BITRATE), 'duration': str(media['duration'])})
+        return streams
+
+    def _probe(self, args, remote=False):
+        options, paths = {}, []
+        i = 1
+        while i < len(args):
+            if args[i] in FFPROBE_VALUES and i + 1 < len(args):
+                options[args[i]] = args[i + 1]
+                i += 2
+            else:
+                if args[i].startswith('-'):
+                    options[args[i]] = True
+                else:
+                    paths.append(args[i])
+                i += 1
+        media, size = self._media(paths[-1], remote)
+        streams = self._streams(media)
+        if options.get('-select_streams'):
+            kind = 'video' if options['-select_streams'].startswith('v') else 'audio'
+            streams = [s for s in streams if s['codec_type'] == kind]
+        format = {'filename': paths[-1], 'duration': str(media['duration']), 'size': str(size), 'bit_rate': str(int(size * 8 / media['duration']))}
+
+        entries = options.get('-show_entries', '')
+        output_format = options.get('-print_format') or options.get('-of') or ''
+        if entries.startswith('packet='):
+            stdout = ''.join(f"{t:.6f},K_\n" for t in range(0, int(media['duration']), GOP_SECONDS))
+        elif output_format.startswith('json'):
+            stdout = json.dumps({'streams': streams, 'format': format})
+        elif entries:
+            values = []
+            for section in entries.split(':'):
+                kind, _, keys = section.partition('=')
+                source = format if kind == 'format' else (streams[0] if streams else {})
+                values.extend(str(source.get(key, 'N/A')) for key in keys.split(','))
+            stdout = '\n'.join(values) + '\n'
+        else:
+            stdout = ''
+        stderr = '' if entries or output_format or '-show_streams' in options else \
+            f"Stream #0:0: Video: {media['codec']}, yuv420p, {media['width']}x{media['height']} [SAR 1:1 DAR 16:9], {media['frame_rate']} fps\n"
+        return self._new_job('probe', stdout=stdout, stderr=stderr)
+
+    def _ffmpeg(self, args):
+        if '-version' in args:
+            return self._new_job('other', stdout="ffmpeg version simulated\n")
+        inputs, options = [], {}
+        current = {}
+        i = 1
+        while i < len(args) - 1:
+            name = args[i]
+            if name in FFMPEG_FLAGS:
+                options[name] = True
+                i += 1
+            elif name == '-i':
+                inputs.append((args[i + 1], current))
+                current, options = {}, {}
+                i += 2
+            else:
+                # the options before an input are the options of that input
+                current[name] = options[name] = args[i + 1]
+                i += 2
+        output = args[-1]
+        graph = options.get('-filter_complex') or options.get('-lavfi') or options.get('-vf') or ''
+
+        sources = []
+        for path, input_options in inputs:
+            if input_options.get('-f') == 'concat':
+                with open(path, 'r') as fd:
+                    parts = [self._media(_unescape(m)) for m in re.findall(r"file '((?:[^'\\]|\\.)*)'", fd.read())]
+                media = {**parts[0][0], 'duration': sum(m['duration'] for m, _ in parts)} if parts else None
+                size = sum(s for _, s in parts)
+            else:
+                media, size = self._media(path)
+            start = float(input_options.get('-ss', 0))
+            duration = max(0.0, media['duration'] - start) if media else 0.0
+            if '-t' in input_options:
+                duration = min(duration, float(input_options['-t']))
+            sources.append((media, size, duration))
+        media, size, duration = sources[0]
+        fps = float(Fraction(str(media['frame_rate'])))
+
+        if '-t' in options:
+            duration = min(duration, float(options['-t']))
+        if '-frames:v' in options:
+            duration = min(duration, int(options['-frames:v']) / fps)
+        windows = re.search(r'concat=n=(\d+)', graph)
+        trim = re.search(r'trim=end_frame=(\d+)', graph)
+        if windows and trim:
+            duration = int(windows[1]) * int(trim[1]) / fps
+        pixels = media['width'] * media['height'] * fps * duration
+
+        if 'libvmaf' in graph:
+            profile = self.profiles['vmaf']
+            crf = media.get('crf')
+            mean = 100.0 if crf is None else min(100.0, profile['score'] - profile['score_per_crf'] * (crf - 23))
+            log_path = re.search(r"log_path=((?:\\.|[^:'\[\];,])+)", graph)
+            outputs = []
+            if log_path:
+                with self._lock:
+                    scores = [min(100.0, max(0.0, self._random.gauss(mean, profile['frame_stdev']))) for _ in range(max(1, int(duration * fps)))]
+                log = {'frames': [{'frameNum': n, 'metrics': {'vmaf': s}} for n, s in enumerate(scores)],
+                       'pooled_metrics': {'vmaf': {'mean': sum(scores) / len(scores)}}}
+                outputs.append((_unescape(log_path[1]), None, json.dumps(log)))
+            return self._new_job('vmaf', pixels / profile['pixels_per_second'], outputs)
+
+        codec = options.get('-c:v') or options.get('-c') or options.get('-vcodec')
+        out = {**media, 'duration': duration, 'audio': any(m and m.get('audio') for m, _, _ in sources) and '-an' not in options}
+        if '-vn' in options:
+            out['video'] = False
+            kind, seconds = 'copy', None
+        elif codec == 'copy':
+            kind, seconds = 'copy', None
+        else:
+            kind = 'encode'
+            if str(options.get('-qp')) == '0':
+                out.update({'crf': None, 'bitrate': media['source_bitrate'] * LOSSLESS_RATIO})
+            else:
+                crf = float(options.get('-crf', 23))
+                out.update({'crf': crf, 'codec': 'h264',
+                            'bitrate': media['source_bitrate'] * self.profiles['encode']['size_ratio'] * 2 ** ((REFERENCE_CRF - crf) / 6)})
+            seconds = pixels / self.profiles['encode']['pixels_per_second']
+        out_size = media_size(out)
+        if kind == 'copy':
+            seconds = self.profiles['copy']['seconds'] + (out_size + sum(s for _, s, _ in sources[1:])) / self.profiles['copy']['bytes_per_second']
+        outputs = [] if output in ('-', 'pipe:1') or options.get('-f') == 'null' else [(output, out, out_size)]
+        return self._new_job(kind, seconds, outputs)
+
+    def _rsync(self, args):
+        files_from = next((a.split('=', 1)[1] for a in args if a.startswith('--files-from=')), None)
+        positionals = [a for i, a in enumerate(args[1:], start=1) if not a.startswith('-') and args[i - 1] != '-e']
+        # a listing has no destination
+        source, destination = (positionals[-1], None) if '--list-only' in args else (positionals[-2], positionals[-1])
+        if files_from:
+            with open(files_from, 'r') as fd:
+                names = [line.strip() for line in fd if line.strip()]
+        else:
+            names = [Path(source).name]
+            source = str(Path(source).parent)
+        is_remote = lambda location: '::' in location or location.startswith('rsync://') or bool(re.match(r'^[^/]+:', location))
+
+        if destination is None:
+            lines = []
+            for name in names:
+                _, size = self._media(name, remote=True)
+                lines.append(f"-rw-r--r-- {size:>15,} 2020/01/01 00:00:00 {name}")
+            return self._new_job('transfer', stdout='\n'.join(lines) + '\n')
+
+        outputs, transferred = [], 0
+        for name in names:
+            if is_remote(source):
+                media, size = self._media(name, remote=True)
+                outputs.append((Path(destination) / name, media, size))
+            else:
+                media, size = self._media(Path(source) / name)
+                with self._lock:
+                    self.remote[name] = (media, size)
+            transferred += size
+        profile = self.profiles['transfer']
+        return self._new_job('transfer', profile['seconds'] + transferred / profile['bytes_per_second'], outputs)
+
+    def _ssh(self, args):
+        if '-O' in args or '-N' in args:
+            return self._new_job('other')
+        command = shlex.split(args[-1])
+        if command and Path(command[0]).name.startswith('ffprobe'):
+            return self._probe(command, remote=True)
+        logger.warning(f"remote command {args[-1]} is not simulated, it ends at once")
+        return self._new_job('other')
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def set_executor(executor):
+    """Executor of the external commands of this process (inherited by the forked workers)"""
+    global _executor
+    _executor = executor
+    return executor
+
+
+def get_executor():
+    """Executor of the external commands : the one set by `set_executor()`, else the one of the settings"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            from utils.settings import get_settings
+            config = get_settings().config
+            if config.get('executor') == 'simulated':
+                _executor = SimulatedExecutor(load_profiles(config.get('executor_profiles')), Clock(float(config.get('executor_speed') or 1)))
+            else:
+                _executor = SubprocessExecutor()
+        return _executor
+
+
+def real_executor(purpose):
+    """Executor of the commands whose real process is measured (`purpose`) : the subprocess one,
+    the simulated one having no CPU time, I/O or throughput to measure
+    """
+    executor = get_executor()
+    if not isinstance(executor, SubprocessExecutor):
+        raise RuntimeError(f"{purpose} measures real processes : it cannot run with the simulated executor")
+    return executor
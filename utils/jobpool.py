@@ -0,0 +1,92 @@
+import os
+import re
+import logging
+import threading
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+logger = logging.getLogger(__name__)
+
+
+def available_cores():
+    """Number of cores this process is allowed to run on"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def job_threads(threads, vmaf_threads=0, cores=None):
+    """Cores of a job running ffmpeg with `threads` threads (0 : every core) and libvmaf with `vmaf_threads`"""
+    cores = cores if cores else available_cores()
+    if not threads or threads <= 0:
+        return cores
+    return max(1, min(cores, threads + (vmaf_threads or 0)))
+
+
+class CoreBudget():
+    """Cores shared by concurrent jobs : a job starts when its cores fit in what the running jobs
+    leave, or when nothing runs (a job wider than the host runs alone)
+    """
+
+    def __init__(self, cores=None):
+        self.cores = cores if cores else available_cores()
+        self.used = 0
+        self._lock = threading.Lock()
+
+    def fits(self, cores):
+        with self._lock:
+            return self.used == 0 or self.used + cores <= self.cores
+
+    def acquire(self, cores):
+        with self._lock:
+            self.used += cores
+
+    def release(self, cores):
+        with self._lock:
+            self.used -= cores
+
+
+def run_jobs(func, jobs, threads=0, max_workers=None, cores=None):
+    """Run `func(**job)` for each job on a bounded process pool.
+
+    `threads` is the cores each job keeps busy (see `job_threads()`), or a function giving them for
+    a job : a job only starts when its cores fit in the budget left by the running ones, so that the
+    total never goes beyond the available cores. The results are yielded as `(index, result)` tuples
+    in completion order, `index` being the position of the job in `jobs`.
+    """
+    jobs = list(jobs)
+    budget = CoreBudget(cores)
+    weights = [min(budget.cores, threads(job) if callable(threads) else job_threads(threads, cores=budget.cores)) for job in jobs]
+    workers = max(1, min(max_workers or budget.cores, len(jobs), budget.cores))
+
+    logger.info(f"Running {len(jobs)} jobs on {workers} processes at most, within {budget.cores} cores")
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = list(range(len(jobs)))
+        running = {}
+        done = 0
+        while pending or running:
+            while pending and len(running) < workers and budget.fits(weights[pending[0]]):
+                i = pending.pop(0)
+                budget.acquire(weights[i])
+                running[executor.submit(func, **jobs[i])] = i
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                i = running.pop(future)
+                budget.release(weights[i])
+                done += 1
+                logger.info(f"Job {i} finished ({done}/{len(jobs)})")
+                yield i, future.result()
+
+
+def in_order(results):
+    """Reorder `(index, result)` tuples coming in any order so that each result is
+    yielded as soon as all the ones before it are available.
+    """
+    pending = {}
+    next_index = 0
+    for index, result in results:
+        pending[index] = result
+        while next_index in pending:
+            yield next_index, pending.pop(next_index)
+            next_index += 1
@@ -0,0 +1,213 @@
+import json
+import logging
+import argparse
+from bisect import bisect_left, bisect_right
+from pathlib import Path
+from utils.settings import get_settings
+from utils.command import ffmpeg as ffmpeg_command
+from utils.workspace import atomic_write
+from utils.executor import get_executor
+
+logger = logging.getLogger(__name__)
+
+
+def probe_keyframes(input, ffprobe=None):
+    """Times of the keyframes of the first video stream, read from the packet flags (nothing is decoded)"""
+    ffprobe = ffprobe if ffprobe else get_settings().ffprobe
+    command = [
+        str(ffprobe), '-v', 'error',
+        '-select_streams', 'v:0',
+        '-skip_frame', 'nokey',
+        '-show_entries', 'packet=pts_time,flags',
+        '-of', 'csv=p=0',
+        str(input)
+    ]
+    logger.debug(f'probe_keyframes : {command}')
+    output = get_executor().check_output(command, text=True)
+
+    keyframes = []
+    for line in output.splitlines():
+        parts = line.strip().split(',')
+        if len(parts) >= 2 and 'K' in parts[1] and parts[0] not in ('', 'N/A'):
+            keyframes.append(float(parts[0]))
+    return sorted(keyframes)
+
+
+def get_keyframes(input, output=None, ffprobe=None):
+    """Keyframe index of a video, cached in `output` if given"""
+    if output and Path(output).exists():
+        with open(output, 'r') as fd:
+            return json.loads(fd.read())
+
+    keyframes = probe_keyframes(input, ffprobe)
+
+    if output:
+        with atomic_write(output) as fd:
+            fd.write(json.dumps(keyframes))
+    return keyframes
+
+
+def keyframe_before(keyframes, time):
+    """Last keyframe at or before `time` (the first keyframe if there is none)"""
+    i = bisect_right(keyframes, time + 1e-6)
+    return keyframes[i - 1] if i else keyframes[0]
+
+
+def keyframe_after(keyframes, time):
+    """First keyframe at or after `time`, None if there is none"""
+    i = bisect_left(keyframes, time - 1e-6)
+    return keyframes[i] if i < len(keyframes) else None
+
+
+def gop_bounds(keyframes, start, duration):
+    """Start and duration of the extract covering [start, start + duration] aligned on GOP boundaries.
+    The end is the next keyframe, or None (end of the file) if there is none.
+    """
+    gop_start = keyframe_before(keyframes, start)
+    gop_end = keyframe_after(keyframes, start + duration)
+    return gop_start, (gop_end - gop_start) if gop_end is not None else None
+
+
+# profiles of the H.264 sources libx264 can reproduce, as named by ffprobe
+X264_PROFILES = {
+    'Constrained Baseline': 'baseline',
+    'Baseline': 'baseline',
+    'Main': 'main',
+    'High': 'high',
+    'High 10': 'high10',
+    'High 4:2:2': 'high422',
+    'High 4:4:4 Predictive': 'high444',
+}
+X264_PIX_FMTS = ['yuv420p', 'yuvj420p', 'yuv422p', 'yuvj422p', 'yuv444p', 'yuvj444p', 'yuv420p10le', 'yuv422p10le', 'yuv444p10le']
+HEAD_CRF = 16
+
+
+def probe_video_stream(input, ffprobe=None):
+    """Codec, profile, level and pixel format of the first video stream, None if there is none"""
+    ffprobe = ffprobe if ffprobe else get_settings().ffprobe
+    command = [
+        str(ffprobe), '-v', 'error',
+        '-select_streams', 'v:0',
+        '-show_entries', 'stream=codec_name,profile,level,pix_fmt',
+        '-of', 'json',
+        str(input)
+    ]
+    streams = json.loads(get_executor().check_output(command, text=True)).get('streams', [])
+    return streams[0] if streams else None
+
+
+def head_options(stream):
+    """Options of a libx264 encode of a head GOP matching the video `stream` of the source, so that
+    it can be followed by the stream copied GOPs ; None when libx264 can't match it (another codec,
+    profile or pixel format)
+    """
+    if not stream or stream.get('codec_name') != 'h264':
+        return None
+    profile = X264_PROFILES.get(stream.get('profile'))
+    if not profile or stream.get('pix_fmt') not in X264_PIX_FMTS:
+        return None
+    options = {'-c:v': 'libx264', '-crf': HEAD_CRF, '-preset': 'veryfast', '-profile:v': profile, '-pix_fmt': stream['pix_fmt']}
+    level = int(stream.get('level') or 0)
+    if level > 0:
+        options['-level:v'] = f"{level // 10}.{level % 10}"
+    return options
+
+
+def copy_command(ffmpeg, input, output, start, duration=None, loglevel='quiet'):
+    """Stream copy of [start, start + duration], seeking on the input"""
+    return ffmpeg_command(ffmpeg, loglevel, stats=False) \
+        .with_input(input, {'-ss': start, '-t': duration}) \
+        .with_options({'-c': 'copy', '-avoid_negative_ts': 'make_zero'}) \
+        .with_output(output) \
+        .argv()
+
+
+def head_command(ffmpeg, input, output, start, duration, options, audio=False, loglevel='quiet'):
+    """Re-encoding of the video of [start, start + duration] with the x264 `options` of `head_options()`,
+    for the parts that can't be stream copied ; the audio is stream copied, or left out
+    """
+    return ffmpeg_command(ffmpeg, loglevel, stats=False) \
+        .with_input(input, {'-ss': start, '-t': duration}) \
+        .with_options({'-map': ['0:v:0', '0:a?'] if audio else '0:v:0', **options, '-c:a': 'copy' if audio else None, '-an': None if audio else True}) \
+        .with_output(output) \
+        .argv()
+
+
+def body_command(ffmpeg, input, output, start, duration=None, loglevel='quiet'):
+    """Stream copy of the video of [start, start + duration] (starting on a keyframe) as Annex B,
+    with its parameter sets in the stream, to be concatenated after a re-encoded head
+    """
+    return ffmpeg_command(ffmpeg, loglevel, stats=False) \
+        .with_input(input, {'-ss': start, '-t': duration}) \
+        .with_options({'-map': '0:v:0', '-c:v': 'copy', '-bsf:v': 'h264_mp4toannexb', '-an': True}) \
+        .with_output(output) \
+        .argv()
+
+
+def extract_gop_aligned(ffmpeg, input, output, start, duration, keyframes, loglevel='quiet'):
+    """Extract the GOPs covering [start, start + duration] without decoding anything"""
+    gop_start, gop_duration = gop_bounds(keyframes, start, duration)
+    get_executor().run(copy_command(ffmpeg, input, output, gop_start, gop_duration, loglevel), check=True)
+    return gop_start, gop_duration
+
+
+def smart_cut(ffmpeg, input, output, start, duration, keyframes, loglevel='quiet', ffprobe=None):
+    """Extract exactly [start, start + duration] : only the video of the partial head GOP is
+    re-encoded, with the profile, level and pixel format of the source, the following GOPs are
+    stream copied, and both parts are concatenated as MPEG-TS, each with its own parameter sets.
+    The audio of the whole range is stream copied from the source.
+    The sources libx264 can't match (not H.264, or an unusual profile or pixel format) fall back to
+    the GOP aligned extract. Returns the start and duration extracted, like `extract_gop_aligned()`.
+    """
+    output = Path(output)
+    options = head_options(probe_video_stream(input, ffprobe))
+    if options is None:
+        logger.warning(f"{Path(input).name} can't be cut exactly with a libx264 head, the extract is aligned on its GOPs")
+        return extract_gop_aligned(ffmpeg, input, output, start, duration, keyframes, loglevel)
+
+    head_end = keyframe_after(keyframes, start)
+    if head_end is not None and head_end - start < 1e-3:
+        # the extract starts on a keyframe : nothing to re-encode
+        get_executor().run(copy_command(ffmpeg, input, output, start, duration, loglevel), check=True)
+        return start, duration
+    if head_end is None or head_end >= start + duration:
+        # the extract fits in the head GOP : one command is enough
+        get_executor().run(head_command(ffmpeg, input, output, start, duration, options, audio=True, loglevel=loglevel), check=True)
+        return start, duration
+
+    head = output.with_name(f"{output.stem}.head.ts")
+    body = output.with_name(f"{output.stem}.body.ts")
+    concat_list = output.with_name(f"{output.stem}.concat.txt")
+    try:
+        get_executor().run(head_command(ffmpeg, input, head, start, head_end - start, options, loglevel=loglevel), check=True)
+        get_executor().run(body_command(ffmpeg, input, body, head_end, start + duration - head_end, loglevel), check=True)
+        with open(concat_list, 'w') as fd:
+            fd.write(f"file '{head}'\nfile '{body}'\n")
+        concat = ffmpeg_command(ffmpeg, loglevel, stats=False) \
+            .with_input(concat_list, {'-f': 'concat', '-safe': 0}) \
+            .with_input(input, {'-ss': start, '-t': duration}) \
+            .with_options({'-map': ['0:v:0', '1:a?'], '-c': 'copy'}) \
+            .with_output(output)
+        get_executor().run(concat.argv(), check=True)
+    finally:
+        for path in [head, body, concat_list]:
+            path.unlink(missing_ok=True)
+    return start, duration
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('input', help="Video file to index")
+    parser.add_argument('output', nargs='?', help="File where the keyframe index is written")
+    parser.add_argument('--log-level', default='info')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=getattr(logging, args.log_level.upper(), 'INFO'))
+    keyframes = get_keyframes(args.input, args.output)
+
+    if not args.output:
+        print(keyframes)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,223 @@
+"""Counters, gauges and histograms in the Prometheus text format.
+
+The metrics of a `Registry` are served over HTTP by `serve()` (`curl localhost:9464/metrics`) and
+dumped to a file by `Registry.dump()`, in the format of the node_exporter textfile collector. As the
+batch runner is a new process for each video, the counters and histograms of the previous dump can
+be reloaded with `Registry.load()` so that they keep counting across runs.
+"""
+
+import re
+import logging
+import threading
+from time import time
+from pathlib import Path
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from utils.workspace import atomic_write
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PORT = 9464
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+_SAMPLE = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(?:\{(.*)\})?\s+(\S+)$')
+_LABEL = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = [*zip(names, values), *extra]
+    return '{' + ','.join(f'{n}="{_escape(v)}"' for n, v in pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric():
+    type = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects the labels {self.labelnames}, not {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.extend(self._samples(key, value))
+        return lines
+
+    def _samples(self, key, value):
+        return [f"{self.name}{_labels(self.labelnames, key)} {_number(value)}"]
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        if amount < 0:
+            raise ValueError("a counter can only increase")
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, help, buckets, labelnames=()):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value)
+
+    def _samples(self, key, value):
+        counts, total = value
+        lines = [f"{self.name}_bucket{_labels(self.labelnames, key, [('le', _number(bound))])} {count}"
+                 for bound, count in zip(self.buckets, counts)]
+        lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_number(total)}")
+        lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {counts[-1]}")
+        return lines
+
+
+class Registry():
+
+    def __init__(self):
+        self._metrics = {}
+
+    def _register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"The metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self._register(Counter(name, help, labelnames))
+
+    def gauge(self, name, help, labelnames=()):
+        return self._register(Gauge(name, help, labelnames))
+
+    def histogram(self, name, help, buckets, labelnames=()):
+        return self._register(Histogram(name, help, buckets, labelnames))
+
+    def render(self):
+        return '\n'.join(line for metric in self._metrics.values() for line in metric.render()) + '\n'
+
+    def dump(self, path):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with atomic_write(path) as fd:
+            fd.write(self.render())
+
+    def load(self, path):
+        """Restore the counters and histograms of a previous dump (the gauges describe the past run only)"""
+        path = Path(path)
+        if not path.exists():
+            return
+        with open(path, 'r') as fd:
+            for line in fd:
+                match = _SAMPLE.match(line.strip())
+                if not match or line.startswith('#'):
+                    continue
+                name, labels, value = match.groups()
+                labels = dict(_LABEL.findall(labels or ''))
+                self._restore(name, labels, float(value))
+
+    def _restore(self, name, labels, value):
+        value = int(value) if value.is_integer() else value
+        if isinstance(self._metrics.get(name), Counter):
+            metric = self._metrics[name]
+            metric._values[metric._key(labels)] = value
+            return
+        base, _, suffix = name.rpartition('_')
+        metric = self._metrics.get(base)
+        if not isinstance(metric, Histogram) or suffix not in ('bucket', 'sum'):
+            return
+        bound = labels.pop('le', None)
+        key = metric._key(labels)
+        counts, total = metric._values.get(key, ([0] * len(metric.buckets), 0.0))
+        if suffix == 'sum':
+            total = value
+        else:
+            bounds = [_number(b) for b in metric.buckets]
+            if bound in bounds:
+                counts[bounds.index(bound)] = int(value)
+        metric._values[key] = (counts, total)
+
+
+@contextmanager
+def track(in_flight, failures, seconds=None, **labels):
+    """Count a job of a stage as in flight while the block runs, and as failed if it raises"""
+    in_flight.inc(**labels)
+    start = time()
+    try:
+        yield
+    except BaseException:
+        failures.inc(**labels)
+        raise
+    finally:
+        in_flight.dec(**labels)
+        if seconds:
+            seconds.observe(time() - start, **labels)
+
+
+def serve(registry, port=DEFAULT_PORT, host='127.0.0.1'):
+    """Serve the metrics of `registry` on http://host:port/metrics from a daemon thread"""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] not in ('/', '/metrics'):
+                self.send_error(404)
+                return
+            body = registry.render().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', CONTENT_TYPE)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logger.debug(format % args)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logger.info(f"Metrics served on http://{host}:{server.server_port}/metrics")
+    return server
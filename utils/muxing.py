@@ -0,0 +1,168 @@
+"""Muxing of the MP4 outputs, played progressively without the second pass of `+faststart`.
+
+With `-movflags +faststart`, the mov muxer writes the media data first and, once the encode is
+done, re-reads and re-writes the whole file to move the index (the moov atom) before it : twice
+the writes of the output and a serial tail proportional to its size. Two modes avoid it :
+
+- `reserve` : space is reserved for the moov atom at the start of the file (`-moov_size`), from
+  an estimate of the size of its tables given by the probe of the source (duration, frame rate,
+  audio), and the moov is written there at the end. The reserve must be large enough, or the
+  muxer fails at the end of the encode : the estimate is an upper bound, the unused bytes are
+  left in a `free` atom.
+- `fragmented` : fragmented MP4 (`frag_keyframe+empty_moov+default_base_moof`, like CMAF), an
+  empty moov at the start and one fragment per GOP, nothing to rewrite.
+
+`python -m utils mux-bench VIDEO` compares the block I/O, the wall time and the tail (time between
+the last progress report of the processing and the end of ffmpeg) of the three modes.
+"""
+
+import os
+import re
+import logging
+import argparse
+import subprocess
+from time import time
+from pathlib import Path
+from fractions import Fraction
+from utils.command import ffmpeg
+from utils.executor import real_executor
+
+logger = logging.getLogger(__name__)
+
+MODES = ['faststart', 'reserve', 'fragmented']
+DEFAULT_MODE = 'faststart'
+FRAGMENTED_FLAGS = '+frag_keyframe+empty_moov+default_base_moof'
+# muxer options of the modes, removed from the intermediate files nobody plays
+OPTIONS = ['-movflags', '-moov_size']
+TEMPORARY = {name: None for name in OPTIONS}
+
+# bytes of the moov tables per sample, about twice what the mov muxer writes : sample size (4),
+# timestamps and composition offsets of the B-frames (8 + 8), chunk offsets
+VIDEO_SAMPLE_BYTES = 24
+AUDIO_SAMPLE_BYTES = 16
+AUDIO_SAMPLE_RATE = 48000
+AAC_FRAME_SAMPLES = 1024
+MOOV_HEADER_BYTES = 64 * 1024
+
+
+def _frame_rate(value):
+    """Frame rate of a probe (`30000/1001`, `25`...), None when it is missing, unparsable or not positive (`0/0`)"""
+    try:
+        rate = float(Fraction(str(value)))
+    except (ValueError, ZeroDivisionError):
+        return None
+    return rate if rate > 0 else None
+
+
+def moov_size(duration, frame_rate, audio=True):
+    """Bytes to reserve for the moov atom of an output of `duration` seconds at `frame_rate`"""
+    video_samples = duration * _frame_rate(frame_rate)
+    audio_samples = duration * AUDIO_SAMPLE_RATE / AAC_FRAME_SAMPLES if audio else 0
+    return int(MOOV_HEADER_BYTES + video_samples * VIDEO_SAMPLE_BYTES + audio_samples * AUDIO_SAMPLE_BYTES)
+
+
+def muxing_options(mode=DEFAULT_MODE, duration=None, frame_rate=None, audio=True):
+    """Muxer options of an output muxed with `mode` ; `reserve` needs the duration and the frame rate
+    of the source, and falls back to `faststart` without them (or with a rate such as `0/0`)
+    """
+    if mode == 'reserve' and not (duration and duration > 0 and _frame_rate(frame_rate)):
+        logger.warning("no duration or frame rate to estimate the moov size, the output is muxed with +faststart")
+        mode = 'faststart'
+    if mode == 'faststart':
+        return {'-movflags': '+faststart', '-moov_size': None}
+    if mode == 'reserve':
+        return {'-movflags': None, '-moov_size': moov_size(duration, frame_rate, audio)}
+    if mode == 'fragmented':
+        return {'-movflags': FRAGMENTED_FLAGS, '-moov_size': None}
+    raise ValueError(f"unknown muxing mode {mode}, expected one of {', '.join(MODES)}")
+
+
+def options_of(command):
+    """Muxer options of an encode `command`, to be given to the command that writes its final output"""
+    return {name: command.get_option(name) for name in OPTIONS if command.get_option(name) is not None}
+
+
+def run_measured(command):
+    """Run `command` (with `-stats`) and return its wall time, its tail and its block I/O.
+    The tail starts at the last progress report before the final one : ffmpeg reports every
+    `-stats_period` while it processes, then once more after writing the trailer.
+    The blocks read from the page cache are not counted by the kernel, only the writes are exact.
+    It is a benchmark of the real commands, it refuses to run under the simulated executor.
+    """
+    process = real_executor('The muxing benchmark').popen(command, stderr=subprocess.PIPE)
+    start = time()
+    reports = []
+    buffer = b''
+    for chunk in iter(lambda: process.stderr.read1(4096), b''):
+        now = time()
+        *lines, buffer = re.split(rb'[\r\n]', buffer + chunk)
+        reports += [now for line in lines if line.startswith((b'frame=', b'size='))]
+    _, status, usage = os.wait4(process.pid, 0)
+    end = time()
+    process.returncode = os.waitstatus_to_exitcode(status)
+    if process.returncode:
+        raise subprocess.CalledProcessError(process.returncode, command)
+    return {
+        'seconds': end - start,
+        'tail_seconds': end - reports[-2] if len(reports) >= 2 else None,
+        'read_bytes': usage.ru_inblock * 512,
+        'written_bytes': usage.ru_oublock * 512,
+    }
+
+
+def benchmark_command(binary, input, output, mode, info, audio, crf=None):
+    """Stream copy (only the muxing differs) or encode at `crf` of `input`, muxed with `mode`"""
+    codec = {'-c:v': 'libx264', '-crf': crf} if crf is not None else {'-c:v': 'copy'}
+    return ffmpeg(binary, loglevel='error') \
+        .with_global_options({'-stats_period': 0.1}) \
+        .with_input(input) \
+        .with_options({'-map': ['0:v:0', '0:a:0'] if audio else '0:v:0', **codec, '-c:a': 'copy' if audio else None, '-an': None if audio else True}) \
+        .with_options(muxing_options(mode, info['duration'], info['frame_rate'], audio)) \
+        .with_output(output) \
+        .argv()
+
+
+def benchmark(input, output_dir, modes=MODES, crf=None, repeat=1):
+    """Measures of each muxing mode, the output of each run being removed before the next one"""
+    from utils import triage
+    from utils.settings import get_settings
+
+    settings = get_settings()
+    probe = triage.probe(input, settings.ffprobe)
+    info = triage.video_info(probe)
+    audio = any(s.get('codec_type') == 'audio' for s in probe.get('streams', []))
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    measures = []
+    for i in range(repeat):
+        for mode in modes:
+            output = output_dir / f"{Path(input).stem}.{mode}.mp4"
+            measure = run_measured(benchmark_command(settings.ffmpeg, input, output, mode, info, audio, crf))
+            measure.update({'mode': mode, 'run': i, 'output_bytes': output.stat().st_size})
+            logger.info(f"{mode} : {measure}")
+            measures.append(measure)
+            output.unlink()
+    return measures
+
+
+def main(argv=None):
+    from utils.settings import get_settings
+
+    parser = argparse.ArgumentParser(prog='python -m utils mux-bench', description="Compare the I/O and the tail latency of the muxing modes of the MP4 outputs")
+    parser.add_argument('input', help="Video file muxed (or encoded) with each mode")
+    parser.add_argument('--modes', default=','.join(MODES), help=f"Comma separated muxing modes (default : {','.join(MODES)})")
+    parser.add_argument('--crf', type=int, help="Encode the video at this CRF instead of copying its streams")
+    parser.add_argument('--repeat', type=int, default=3, help="Runs of each mode (default : 3)")
+    parser.add_argument('--output-dir', help="Directory of the outputs, on the disk to measure (default : tmp directory of the settings)")
+    parser.add_argument('--log-level', default='warning', help="Level of logging : debug, info, warning (default), error or critical")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=getattr(logging, args.log_level.upper(), 'WARNING'))
+
+    measures = benchmark(args.input, args.output_dir or get_settings().tmp_dir, args.modes.split(','), args.crf, args.repeat)
+    print(f"{'mode':<12}{'seconds':>10}{'tail s':>10}{'written MB':>12}{'read MB':>10}{'output MB':>11}{'written / output':>18}")
+    for mode in args.modes.split(','):
+        runs = [m for m in measures if m['mode'] == mode]
+        mean = lambda key: sum(m[key] or 0 for m in runs) / len(runs)
+        print(f"{mode:<12}{mean('seconds'):>10.2f}{mean('tail_seconds'):>10.2f}{mean('written_bytes') / 1e6:>12.1f}"
+              f"{mean('read_bytes') / 1e6:>10.1f}{mean('output_bytes') / 1e6:>11.1f}{mean('written_bytes') / mean('output_bytes'):>18.2f}")
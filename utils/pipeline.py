@@ -0,0 +1,214 @@
+"""Memoized DAG of stages : probe -> scene scores -> extracts -> encodes -> VMAF.
+
+Each stage is a function with its inputs : constants, files, or the outputs of other stages. Its
+fingerprint hashes the function, its version, its constant inputs, the identity of its input files
+and the fingerprints of its upstream stages, so changing one parameter only changes the
+fingerprints of the stages that depend on it. The value of each stage (JSON) and the file it
+produces, if any, are stored in the cache of the workspaces and reused by the next runs. The quota
+of the workspaces is enforced each time a stage is stored, the stages of the run being kept.
+
+    pipeline = Pipeline(jobs=4)
+    keyframes = pipeline.stage('keyframes', stages.keyframes, input=path)
+    extract = pipeline.stage('extract', stages.extract, suffix='.mp4', input=path, keyframes=keyframes, start=60, duration=30)
+    encode = pipeline.stage('encode', encode, suffix='.mp4', input=extract, crf=27)
+    values = pipeline.run([encode])
+
+A stage that produces a file (`suffix`) is called with an `output` path to write it to, and its
+downstream stages receive that path instead of its value. The stages whose inputs are ready run
+concurrently on a thread pool (they mostly wait for ffmpeg), and a stage starts as soon as its
+last input is ready and the cores it declares (`cores`, see utils/jobpool.py) fit in the budget
+left by the running ones.
+
+A stage only reads its inputs : the module globals a function depends on (binaries, models,
+ranges) are given as inputs so that they are part of its key. The `runtime` inputs, such as a
+thread count, change how a stage runs but not its value : they are given to the function but left
+out of its key.
+"""
+
+import os
+import json
+import shutil
+import hashlib
+import logging
+from time import time
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from utils.jobpool import available_cores, CoreBudget
+from utils.workspace import workspace_root, atomic_output, atomic_write, enforce_quota, identity
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+def _upstream(value):
+    if isinstance(value, Stage):
+        return [value]
+    if isinstance(value, (list, tuple)):
+        return [stage for v in value for stage in _upstream(v)]
+    if isinstance(value, dict):
+        return [stage for v in value.values() for stage in _upstream(v)]
+    return []
+
+
+def _fingerprint(value):
+    if isinstance(value, Stage):
+        return f"stage:{value.key}"
+    if isinstance(value, Path):
+        return f"file:{identity(value)}" if value.exists() else f"path:{value}"
+    if isinstance(value, (list, tuple)):
+        return [_fingerprint(v) for v in value]
+    if isinstance(value, dict):
+        return {str(k): _fingerprint(v) for k, v in value.items()}
+    return value
+
+
+def binary(name):
+    """Path of the executable `name` (looked up in the PATH if needed), as a stage input : its
+    identity is then part of the key, and the stages rerun when the binary is upgraded
+    """
+    return Path(shutil.which(str(name)) or name)
+
+
+class Stage():
+    """A function applied to its inputs ; `version` is to be bumped when the function changes.
+    `cores` is the number of cores it keeps busy while it runs, `runtime` the inputs left out of its key.
+    """
+
+    def __init__(self, name, func, inputs, suffix=None, version=1, cores=1, runtime=None):
+        self.name = name
+        self.func = func
+        self.inputs = inputs
+        self.runtime = runtime if runtime else {}
+        self.suffix = suffix
+        self.version = version
+        self.cores = cores
+        self.upstream = _upstream(list(inputs.values()))
+        payload = {
+            'function': f"{func.__module__}.{func.__qualname__}",
+            'version': version,
+            'suffix': suffix,
+            'inputs': _fingerprint(inputs),
+        }
+        self.key = hashlib.sha1(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+    def __repr__(self):
+        return f"<Stage {self.name} {self.key}>"
+
+
+class Pipeline():
+    """Stages of a run, memoized in `store` (the cache of the workspaces by default) and run by
+    `jobs` threads at most, within `cores` (the cores of the host by default).
+    A store named `cache`, as the one of the workspaces, is kept under `quota` bytes (`workspace_quota` by default).
+    """
+
+    def __init__(self, store=None, jobs=None, cores=None, quota=None):
+        self.store = Path(store) if store else workspace_root() / 'cache'
+        self.quota = quota
+        self.store.mkdir(parents=True, exist_ok=True)
+        self.jobs = jobs if jobs else available_cores()
+        self.budget = CoreBudget(cores)
+        self.stages = {}
+        self._values = {}
+
+    def stage(self, name, func, suffix=None, version=1, cores=1, runtime=None, **inputs):
+        """Declare a stage ; the same function with the same inputs is only declared (and run) once"""
+        stage = Stage(name, func, inputs, suffix, version, min(cores, self.budget.cores), runtime)
+        return self.stages.setdefault(stage.key, stage)
+
+    def _record_path(self, stage):
+        # distinct from the file of a stage producing JSON (`suffix='.json'`)
+        return self.store / f"{stage.name}.{stage.key}.stage.json"
+
+    def path(self, stage):
+        """File produced by `stage`"""
+        return self.store / f"{stage.name}.{stage.key}{stage.suffix}"
+
+    def _files(self, stage):
+        return [self._record_path(stage), self.path(stage)] if stage.suffix else [self._record_path(stage)]
+
+    def _load(self, stage):
+        record = self._record_path(stage)
+        if not record.exists() or (stage.suffix and not self.path(stage).exists()):
+            return _MISSING
+        with open(record, 'r') as fd:
+            value = json.load(fd)['value']
+        # a hit refreshes the entries in the LRU order of the quota
+        for path in self._files(stage):
+            os.utime(path)
+        return value
+
+    def _resolve(self, value):
+        if isinstance(value, Stage):
+            return self.path(value) if value.suffix else self._values[value.key]
+        if isinstance(value, (list, tuple)):
+            return type(value)(self._resolve(v) for v in value)
+        if isinstance(value, dict):
+            return {k: self._resolve(v) for k, v in value.items()}
+        return value
+
+    def _execute(self, stage):
+        kwargs = {**{name: self._resolve(value) for name, value in stage.inputs.items()}, **stage.runtime}
+        start = time()
+        if stage.suffix:
+            with atomic_output(self.path(stage)) as part:
+                value = stage.func(**kwargs, output=part)
+        else:
+            value = stage.func(**kwargs)
+        seconds = time() - start
+        with atomic_write(self._record_path(stage)) as fd:
+            fd.write(json.dumps({'stage': stage.name, 'value': value, 'seconds': seconds}, default=str))
+        logger.info(f"{stage.name} {stage.key} done in {seconds:.1f}s")
+        # the value is given as it will be read back from the store by the next runs
+        return json.loads(json.dumps(value, default=str))
+
+    def _plan(self, targets):
+        """Stages to run : the targets and their upstream stages, down to the ones already stored"""
+        todo = {}
+        stack = list(targets)
+        while stack:
+            stage = stack.pop()
+            if stage.key in todo or stage.key in self._values:
+                continue
+            value = self._load(stage)
+            if value is not _MISSING:
+                self._values[stage.key] = value
+                continue
+            todo[stage.key] = stage
+            stack.extend(stage.upstream)
+        return todo
+
+    def run(self, targets):
+        """Compute the values of `targets`, running only the stages missing from the store"""
+        todo = self._plan(targets)
+        logger.info(f"{len(todo)} stages to run, {len(self._values)} reused")
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            running = {}
+            while todo or running:
+                for key, stage in list(todo.items()):
+                    if len(running) < self.jobs and all(up.key in self._values for up in stage.upstream) and self.budget.fits(stage.cores):
+                        self.budget.acquire(stage.cores)
+                        running[executor.submit(self._execute, stage)] = stage
+                        del todo[key]
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage = running.pop(future)
+                    self.budget.release(stage.cores)
+                    self._values[stage.key] = future.result()
+                    self._enforce_quota()
+        return [self._values[stage.key] for stage in targets]
+
+    def _enforce_quota(self):
+        """Evict the least recently used entries of the cache, except the ones of the stages of this pipeline"""
+        if self.store.name == 'cache':
+            enforce_quota(self.store.parent, self.quota, keep=[path for stage in self.stages.values() for path in self._files(stage)])
+
+    def discard(self, stages):
+        """Remove the files and values of `stages` from the store : they will be computed again by the next runs"""
+        for stage in stages:
+            for path in self._files(stage):
+                if path.exists():
+                    path.unlink()
+
+    def value(self, stage):
+        return self._values[stage.key]
@@ -0,0 +1,122 @@
+"""Cost model and ETA of the encoding backlog.
+
+The time of an encode (or of a VMAF computation) is learnt from the jobs already done as a
+function of the amount of pixels to process (resolution x frame rate x duration), of the CRF and
+of the x264 preset : `log(seconds) = a + b log(pixels) + c crf + d preset`, fitted by least
+squares. Each pending job is then costed from its triage probe alone (see utils/triage.py), the
+jobs are given to N workers in the order of the queue (longest first, LPT, by default), and the
+makespan gives the ETA of the backlog.
+"""
+
+import heapq
+import logging
+from math import log, exp
+from statistics import median
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+PRESETS = ['ultrafast', 'superfast', 'veryfast', 'faster', 'fast', 'medium', 'slow', 'slower', 'veryslow', 'placebo']
+# pixels processed per second by one job before any timing is recorded
+DEFAULT_SPEED = {'encode': 20e6, 'vmaf': 60e6}
+# fewer samples than this are only used to scale the default model, not to fit its coefficients
+MIN_SAMPLES = 8
+
+
+def pixels(info):
+    """Pixels to process for a source : width x height x frame rate x duration"""
+    if not info or not all(info.get(k) for k in ['width', 'height', 'frame_rate', 'duration']):
+        return None
+    return info['width'] * info['height'] * info['frame_rate'] * info['duration']
+
+
+def features(info, crf, preset='medium'):
+    return [1.0, log(pixels(info)), float(crf), float(PRESETS.index(preset) if preset in PRESETS else PRESETS.index('medium'))]
+
+
+class CostModel():
+    """Seconds a job of `kind` (`encode` or `vmaf`) takes, learnt from `(info, crf, preset, seconds)` samples.
+    The features that don't vary among the samples (e.g. a single CRF) are left out of the fit.
+    """
+
+    def __init__(self, kind='encode'):
+        self.kind = kind
+        self.coefficients = None
+        self.seconds_per_pixel = 1 / DEFAULT_SPEED[kind]
+        self.samples = 0
+
+    def fit(self, samples):
+        import numpy as np
+
+        samples = [s for s in samples if pixels(s[0]) and s[3] and s[3] > 0]
+        self.samples = len(samples)
+        if not samples:
+            return self
+        self.seconds_per_pixel = median(s[3] / pixels(s[0]) for s in samples)
+        if len(samples) < MIN_SAMPLES:
+            return self
+
+        X = np.array([features(*s[:3]) for s in samples])
+        y = np.log([s[3] for s in samples])
+        columns = [0] + [i for i in range(1, X.shape[1]) if np.ptp(X[:, i]) > 0]
+        solution, _, rank, _ = np.linalg.lstsq(X[:, columns], y, rcond=None)
+        if rank == len(columns):
+            self.coefficients = np.zeros(X.shape[1])
+            self.coefficients[columns] = solution
+        logger.debug(f"{self.kind} cost model : {self.coefficients} ({len(samples)} samples)")
+        return self
+
+    def predict(self, info, crf=27, preset='medium'):
+        if not pixels(info):
+            return None
+        if self.coefficients is not None:
+            return exp(float(sum(c * f for c, f in zip(self.coefficients, features(info, crf, preset)))))
+        return pixels(info) * self.seconds_per_pixel
+
+
+def list_schedule(order, costs, workers=1):
+    """The jobs of `order` taken in turn by the first free worker, as from a shared queue.
+    Returns the worker of each job and the makespan in seconds.
+    """
+    loads = [(0.0, worker) for worker in range(max(1, workers))]
+    assignment = {}
+    for name in order:
+        load, worker = heapq.heappop(loads)
+        assignment[name] = worker
+        heapq.heappush(loads, (load + costs[name], worker))
+    return assignment, max(load for load, _ in loads)
+
+
+def lpt(costs, workers=1):
+    """Longest processing time first : the jobs sorted from the longest, each one given to the least
+    loaded worker. Returns the order of the jobs, the worker of each job and the makespan in seconds.
+    """
+    order = sorted(costs, key=lambda name: costs[name], reverse=True)
+    return (order, *list_schedule(order, costs, workers))
+
+
+def plan(jobs, cost, workers=1, start=None, order=None):
+    """ETA of the backlog : `jobs` maps each name to its size and expected ratio (None if unknown),
+    `cost(name)` gives the seconds of its job (None if it can't be estimated). `order` is the order in
+    which the workers take the jobs, longest first (LPT) by default.
+    """
+    start = start if start else datetime.now()
+    costs = {name: cost(name) for name in jobs}
+    known = {name: seconds for name, seconds in costs.items() if seconds is not None}
+    if order is None:
+        order, assignment, makespan = lpt(known, workers)
+    else:
+        order = [name for name in order if name in known]
+        assignment, makespan = list_schedule(order, known, workers)
+    savings = sum(size * (1 - ratio) for size, ratio in jobs.values() if ratio is not None)
+    return {
+        'jobs': len(jobs),
+        'costed': len(known),
+        'workers': workers,
+        'cpu_seconds': sum(known.values()),
+        'makespan': makespan,
+        'eta': start + timedelta(seconds=makespan),
+        'savings': savings,
+        'order': order,
+        'assignment': assignment,
+    }
@@ -0,0 +1,237 @@
+"""Rate-distortion curves of CRF sweeps : Bjøntegaard deltas between encoder configurations,
+size at a target score and adaptive placement of the CRF points of a sweep.
+
+The curves are monotone piecewise cubic interpolations (PCHIP) of the measured points, in the
+log-rate domain, like the current BD-rate recommendations (the historical cubic fit oscillates
+with the few and noisy points of VMAF sweeps).
+"""
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+MAX_POINTS = 8
+TOLERANCE = 0.5
+
+
+class Pchip():
+    """Monotone piecewise cubic Hermite interpolation of (x, y), with x strictly increasing"""
+
+    def __init__(self, x, y):
+        import numpy as np
+
+        self.x = np.asarray(x, dtype=np.float64)
+        self.y = np.asarray(y, dtype=np.float64)
+        if len(self.x) < 2:
+            raise ValueError("at least 2 points are needed")
+        h = np.diff(self.x)
+        delta = np.diff(self.y) / h
+        d = np.zeros_like(self.y)
+        if len(self.x) == 2:
+            d[:] = delta[0]
+        else:
+            # Fritsch-Carlson slopes : weighted harmonic mean of the secants, 0 at the extrema
+            w1 = 2 * h[1:] + h[:-1]
+            w2 = h[1:] + 2 * h[:-1]
+            same_sign = delta[:-1] * delta[1:] > 0
+            with np.errstate(divide='ignore', invalid='ignore'):
+                d[1:-1] = np.where(same_sign, (w1 + w2) / (w1 / delta[:-1] + w2 / delta[1:]), 0.0)
+            d[0] = self._edge_slope(h[0], h[1], delta[0], delta[1])
+            d[-1] = self._edge_slope(h[-1], h[-2], delta[-1], delta[-2])
+        self.c1 = d[:-1]
+        self.c2 = (3 * delta - 2 * d[:-1] - d[1:]) / h
+        self.c3 = (d[:-1] + d[1:] - 2 * delta) / h ** 2
+
+    @staticmethod
+    def _edge_slope(h0, h1, delta0, delta1):
+        d = ((2 * h0 + h1) * delta0 - h0 * delta1) / (h0 + h1)
+        if d * delta0 <= 0:
+            return 0.0
+        if delta0 * delta1 <= 0 and abs(d) > abs(3 * delta0):
+            return 3 * delta0
+        return d
+
+    def __call__(self, xs):
+        import numpy as np
+
+        xs = np.asarray(xs, dtype=np.float64)
+        i = np.clip(np.searchsorted(self.x, xs, side='right') - 1, 0, len(self.x) - 2)
+        t = xs - self.x[i]
+        return self.y[i] + t * (self.c1[i] + t * (self.c2[i] + t * self.c3[i]))
+
+    def integral(self, low, high):
+        """Exact integral of the interpolation over [low, high], within the range of x"""
+        import numpy as np
+
+        lo = np.clip(low, self.x[:-1], self.x[1:]) - self.x[:-1]
+        hi = np.clip(high, self.x[:-1], self.x[1:]) - self.x[:-1]
+        primitive = lambda t: t * (self.y[:-1] + t * (self.c1 / 2 + t * (self.c2 / 3 + t * self.c3 / 4)))
+        return float(np.sum(primitive(hi) - primitive(lo)))
+
+
+class RDCurve():
+    """Rate-distortion curve of one encoder configuration, from the (CRF, rate, score) points of a sweep.
+    The rate can be a bitrate or a file size, as long as the compared curves use the same unit.
+    """
+
+    def __init__(self, crfs, rates, scores):
+        import numpy as np
+
+        order = np.argsort(crfs)
+        self.crfs = np.asarray(crfs, dtype=np.float64)[order]
+        self.rates = np.asarray(rates, dtype=np.float64)[order]
+        self.scores = np.asarray(scores, dtype=np.float64)[order]
+
+    def __len__(self):
+        return len(self.crfs)
+
+    def _monotone(self, x, y):
+        """Interpolation of y by x, on the points sorted by x (points with the same x are averaged)"""
+        import numpy as np
+
+        unique, inverse = np.unique(x, return_inverse=True)
+        means = np.bincount(inverse, weights=y) / np.bincount(inverse)
+        return Pchip(unique, means)
+
+    @property
+    def log_rate_by_score(self):
+        import numpy as np
+        return self._monotone(self.scores, np.log(self.rates))
+
+    @property
+    def score_by_log_rate(self):
+        import numpy as np
+        return self._monotone(np.log(self.rates), self.scores)
+
+    @property
+    def score_by_crf(self):
+        return self._monotone(self.crfs, self.scores)
+
+    def rate_at(self, score):
+        """Interpolated rate giving `score`, None outside of the measured scores"""
+        import numpy as np
+
+        if not self.scores.min() <= score <= self.scores.max():
+            return None
+        return float(np.exp(self.log_rate_by_score(score)))
+
+    def crf_at(self, score):
+        """Interpolated (fractional) CRF giving `score`, None outside of the measured scores"""
+        if not self.scores.min() <= score <= self.scores.max():
+            return None
+        # the score decreases with the CRF : interpolate the CRF by score
+        return float(self._monotone(self.scores, self.crfs)(score))
+
+
+def bd_rate(reference, test):
+    """Bjøntegaard delta rate : mean rate difference (in %) of `test` against `reference` at equal
+    score, over their common range of scores. None if the ranges don't overlap.
+    """
+    import numpy as np
+
+    if len(reference) < 2 or len(test) < 2:
+        return None
+    low = max(reference.scores.min(), test.scores.min())
+    high = min(reference.scores.max(), test.scores.max())
+    if high <= low:
+        return None
+    difference = test.log_rate_by_score.integral(low, high) - reference.log_rate_by_score.integral(low, high)
+    return float((np.exp(difference / (high - low)) - 1) * 100)
+
+
+def bd_score(reference, test):
+    """Bjøntegaard delta score (BD-VMAF) : mean score difference of `test` against `reference` at
+    equal rate, over their common range of rates. None if the ranges don't overlap.
+    """
+    import numpy as np
+
+    if len(reference) < 2 or len(test) < 2:
+        return None
+    low = max(np.log(reference.rates).min(), np.log(test.rates).min())
+    high = min(np.log(reference.rates).max(), np.log(test.rates).max())
+    if high <= low:
+        return None
+    difference = test.score_by_log_rate.integral(low, high) - reference.score_by_log_rate.integral(low, high)
+    return float(difference / (high - low))
+
+
+def next_crf(crfs, scores, low, high, target=None, tolerance=TOLERANCE):
+    """CRF of the next trial encode of a sweep over [low, high], or None when the curve is known well enough.
+
+    Without `target`, the next point is placed in the middle of the interval where the curve is
+    the least constrained : where the interpolation through all the points departs the most from
+    the straight line between the two neighbours (or, with only two points, where the score varies
+    the most), if this error is above `tolerance` (in score points).
+    With a `target` score, only the interval containing the target matters : the next point is the
+    CRF interpolated for the target, until the interval is 1 CRF wide or the linear and cubic
+    estimations of the CRF agree within `tolerance` (in CRF).
+    """
+    import numpy as np
+
+    curve = RDCurve(crfs, np.ones(len(crfs)), scores)
+    measured = set(int(c) for c in curve.crfs)
+
+    if target is not None:
+        if target > curve.scores.max():
+            return low if low not in measured else None
+        if target < curve.scores.min():
+            return high if high not in measured else None
+        above = curve.crfs[curve.scores >= target].max()
+        below = curve.crfs[(curve.scores < target) & (curve.crfs > above)]
+        if not len(below):
+            return None
+        below = below.min()
+        if below - above <= 1:
+            return None
+        s_above = curve.scores[curve.crfs == above].mean()
+        s_below = curve.scores[curve.crfs == below].mean()
+        linear = above + (s_above - target) / (s_above - s_below) * (below - above)
+        estimate = curve.crf_at(target) if len(measured) >= 3 else linear
+        if len(measured) >= 3 and abs(estimate - linear) < tolerance:
+            return None
+        return int(min(max(round(estimate), above + 1), below - 1))
+
+    if len(measured) < 2:
+        return high if low in measured else low
+    errors = []
+    interpolation = curve.score_by_crf if len(measured) >= 3 else None
+    for c0, c1 in zip(sorted(measured), sorted(measured)[1:]):
+        if c1 - c0 < 2:
+            continue
+        middle = (c0 + c1) // 2
+        s0 = curve.scores[curve.crfs == c0].mean()
+        s1 = curve.scores[curve.crfs == c1].mean()
+        if interpolation:
+            error = abs(float(interpolation(middle)) - (s0 + (s1 - s0) * (middle - c0) / (c1 - c0)))
+        else:
+            error = abs(s0 - s1) / 2
+        errors.append((error, middle))
+    if not errors:
+        return None
+    error, middle = max(errors)
+    return middle if error > tolerance else None
+
+
+def sweep(measure, low, high, target=None, tolerance=TOLERANCE, max_points=MAX_POINTS):
+    """Adaptive CRF sweep : `measure(crf)` encodes and returns a `(rate, score)` couple, it is called
+    for the CRFs chosen by `next_crf()` until the curve is known well enough or `max_points` encodes.
+    """
+    points = {}
+    crf = low if target is None else (low + high) // 2
+    while crf is not None and len(points) < max_points:
+        points[crf] = measure(crf)
+        logger.info(f"CRF {crf} : rate {points[crf][0]}, score {points[crf][1]:.2f}")
+        crfs = sorted(points)
+        crf = next_crf(crfs, [points[c][1] for c in crfs], low, high, target, tolerance)
+
+    crfs = sorted(points)
+    return RDCurve(crfs, [points[c][0] for c in crfs], [points[c][1] for c in crfs])
+
+
+def target_crf(curve, target, low, high):
+    """Integer CRF of [low, high] nearest to the one interpolated for `target` (see `RDCurve.crf_at()`)"""
+    crf = curve.crf_at(target)
+    if crf is None:
+        # the target is reached by every measured CRF, or by none of them
+        return high if curve.scores.min() >= target else low
+    return min(max(round(crf), low), high)
@@ -0,0 +1,170 @@
+import sys
+import argparse
+from utils.results_store import results_dir
+
+KEYS = ['video', 'scene_time', 'extract_duration', 'crf']
+VARIANT = ['video', 'mode', 'option_removed']
+
+
+def load(directory=None, columns=None, filter=None):
+    """Results of every study run stored in `directory`, read as one Arrow table.
+    `columns` and `filter` (a `pyarrow.compute` expression) are pushed down to the Parquet files.
+    """
+    import pyarrow.dataset as ds
+
+    directory = directory if directory else results_dir()
+    return ds.dataset(str(directory), format='parquet').to_table(columns=columns, filter=filter)
+
+
+def summary(table, by=VARIANT, metric='vmaf_harmonic_mean'):
+    """Per-variant aggregates : number of encodings, mean and minimum score, mean compression and encoding time"""
+    return table.group_by(list(by)).aggregate([
+        ('crf', 'count'),
+        (metric, 'mean'),
+        (metric, 'min'),
+        ('size_percentage', 'mean'),
+        ('encoding_seconds', 'sum'),
+    ]).sort_by([(column, 'ascending') for column in by])
+
+
+def _baseline(table, mode='ffshort'):
+    import pyarrow.compute as pc
+
+    mask = pc.and_(pc.equal(table['mode'], mode), pc.is_null(table['option_removed']))
+    return table.filter(mask)
+
+
+def option_deltas(table, metric='vmaf_harmonic_mean', mode='ffshort'):
+    """Effect of removing each option of the complete `mode` encoding : median score and size
+    differences with the complete encoding of the same extract at the same CRF
+    """
+    import pyarrow.compute as pc
+
+    columns = KEYS + [metric, 'encoded_filesize']
+    baseline = _baseline(table, mode).select(columns) \
+        .rename_columns(KEYS + ['baseline_score', 'baseline_filesize'])
+    variants = table.filter(pc.and_(pc.equal(table['mode'], mode), pc.is_valid(table['option_removed']))) \
+        .select(columns + ['option_removed'])
+
+    joined = variants.join(baseline, keys=KEYS, join_type='inner')
+    joined = joined.append_column('score_delta', pc.subtract(joined[metric], joined['baseline_score']))
+    joined = joined.append_column('size_delta_percentage', pc.multiply(
+        pc.subtract(pc.divide(pc.cast(joined['encoded_filesize'], 'float64'), joined['baseline_filesize']), 1.0), 100.0))
+
+    return joined.group_by('option_removed').aggregate([
+        ('score_delta', 'approximate_median'),
+        ('score_delta', 'mean'),
+        ('size_delta_percentage', 'approximate_median'),
+        ('crf', 'count'),
+    ]).sort_by('option_removed')
+
+
+def _groups(table, by):
+    """Sorted table and the boundaries of its groups of identical `by` values"""
+    import numpy as np
+
+    table = table.sort_by([(column, 'ascending') for column in by] + [('crf', 'ascending')])
+    if not len(table):
+        return table, []
+    changes = np.zeros(len(table), dtype=bool)
+    changes[0] = True
+    for column in by:
+        values = np.array(table[column].to_pylist(), dtype=object)
+        changes[1:] |= values[1:] != values[:-1]
+    starts = np.flatnonzero(changes)
+    return table, list(zip(starts, np.append(starts[1:], len(table))))
+
+
+def rd_points(table, by=VARIANT, metric='vmaf_harmonic_mean'):
+    """Rate-distortion points of each variant : one point per CRF, with the bitrate (bits per second
+    of extract) and the mean score of all the extracts encoded at this CRF
+    """
+    import pyarrow.compute as pc
+
+    points = table.group_by(list(by) + ['crf']).aggregate([
+        ('encoded_filesize', 'sum'),
+        ('extract_duration', 'sum'),
+        (metric, 'mean'),
+    ])
+    bitrate = pc.divide(pc.multiply(pc.cast(points['encoded_filesize_sum'], 'float64'), 8.0), points['extract_duration_sum'])
+    return points.append_column('bitrate', bitrate).rename_columns(
+        [name if name != f"{metric}_mean" else 'score' for name in points.column_names] + ['bitrate'])
+
+
+def curves(table, by=VARIANT, metric='vmaf_harmonic_mean'):
+    """Rate-distortion curve (`utils.rd.RDCurve`) of each variant, by tuple of `by` values"""
+    from utils.rd import RDCurve
+
+    points, groups = _groups(rd_points(table, by, metric), by)
+    crfs = points['crf'].to_numpy()
+    rates = points['bitrate'].to_numpy()
+    scores = points['score'].to_numpy(zero_copy_only=False)
+    return {
+        tuple(points[column][start].as_py() for column in by): RDCurve(crfs[start:end], rates[start:end], scores[start:end])
+        for start, end in groups
+    }
+
+
+def crf_for_target(table, target, by=VARIANT, metric='vmaf_harmonic_mean'):
+    """CRF and bitrate giving the `target` score for each variant, interpolated on its RD curve
+    (`RDCurve.crf_at()` and `RDCurve.rate_at()`, the ones of the CRF choices too).
+    They are null when the target is not reached within the measured range.
+    """
+    import pyarrow as pa
+
+    rows = {column: [] for column in by}
+    rows['crf'] = []
+    rows['bitrate'] = []
+    for key, curve in curves(table, by, metric).items():
+        for column, value in zip(by, key):
+            rows[column].append(value)
+        rows['crf'].append(curve.crf_at(target))
+        rows['bitrate'].append(curve.rate_at(target))
+    return pa.table(rows)
+
+
+def bd_rates(table, metric='vmaf_harmonic_mean', mode='ffshort'):
+    """BD-rate and BD-score of every variant of each video against the complete `mode` encoding of the same video"""
+    import pyarrow as pa
+    from utils.rd import bd_rate, bd_score
+
+    video_curves = curves(table, VARIANT, metric)
+    rows = {'video': [], 'mode': [], 'option_removed': [], 'bd_rate': [], 'bd_score': []}
+    for (video, variant_mode, option), curve in video_curves.items():
+        reference = video_curves.get((video, mode, None))
+        if reference is None or (variant_mode, option) == (mode, None):
+            continue
+        rows['video'].append(video)
+        rows['mode'].append(variant_mode)
+        rows['option_removed'].append(option)
+        rows['bd_rate'].append(bd_rate(reference, curve))
+        rows['bd_score'].append(bd_score(reference, curve))
+    return pa.table(rows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Aggregate the results stored by the studies")
+    parser.add_argument('query', choices=['summary', 'options', 'crf', 'bd-rate'])
+    parser.add_argument('--results-dir', help="Directory of the results dataset (default : output/results)")
+    parser.add_argument('--video', action='append', help="Only use the results of this video")
+    parser.add_argument('--metric', default='vmaf_harmonic_mean', choices=['vmaf_harmonic_mean', 'vmaf_mean', 'vmaf_psnr'])
+    parser.add_argument('--target', type=float, default=93, help="Target score of the `crf` query")
+    args = parser.parse_args(argv)
+
+    import pyarrow.csv as csv
+    import pyarrow.dataset as ds
+
+    table = load(args.results_dir, filter=ds.field('video').isin(args.video) if args.video else None)
+    if args.query == 'summary':
+        result = summary(table, metric=args.metric)
+    elif args.query == 'options':
+        result = option_deltas(table, args.metric)
+    elif args.query == 'crf':
+        result = crf_for_target(table, args.target, metric=args.metric)
+    else:
+        result = bd_rates(table, args.metric)
+    csv.write_csv(result, sys.stdout.buffer, csv.WriteOptions(delimiter=';'))
+
+
+if __name__ == '__main__':
+    main()
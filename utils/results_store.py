@@ -0,0 +1,125 @@
+import os
+import shlex
+from pathlib import Path
+from datetime import datetime
+from utils.settings import get_settings
+
+BATCH_SIZE = 1000
+
+
+def schema():
+    import pyarrow as pa
+
+    return pa.schema([
+        ('study', pa.string()),
+        ('run', pa.timestamp('s')),
+        ('video', pa.string()),
+        ('scene_score', pa.float64()),
+        ('scene_time', pa.float64()),
+        ('extract_duration', pa.float64()),
+        ('start', pa.float64()),
+        ('end', pa.float64()),
+        ('crf', pa.int16()),
+        ('mode', pa.string()),
+        ('option_removed', pa.string()),
+        ('encoding_seconds', pa.float64()),
+        ('vmaf_offset', pa.float64()),
+        ('vmaf_psnr', pa.float64()),
+        ('vmaf_mean', pa.float64()),
+        ('vmaf_harmonic_mean', pa.float64()),
+        ('vmaf_seconds', pa.float64()),
+        ('encoded_filesize', pa.int64()),
+        ('size_percentage', pa.float64()),
+        ('encoding_command', pa.list_(pa.string())),
+    ])
+
+
+def results_dir():
+    return get_settings().output_dir / 'results'
+
+
+def _number(value):
+    """Numeric value of a study field (`timedelta`, 'N/A'...), None if there is none"""
+    if value is None:
+        return None
+    if hasattr(value, 'total_seconds'):
+        return value.total_seconds()
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class ResultsWriter():
+    """Writer of study results to a Parquet file of the results dataset (one file per run).
+    The records are buffered and written by row groups of `batch_size` rows.
+    """
+
+    def __init__(self, study, directory=None, batch_size=BATCH_SIZE):
+        directory = Path(directory) if directory else results_dir()
+        directory.mkdir(parents=True, exist_ok=True)
+        self.study = study
+        self.run = datetime.now().replace(microsecond=0)
+        self.path = directory / f"{study}.{self.run.strftime('%Y%m%d-%H%M%S')}.{os.getpid()}.parquet"
+        # written under a hidden name (ignored by the dataset) and renamed when closed
+        self._part = self.path.with_name(f".{self.path.name}.part")
+        self.batch_size = batch_size
+        self._buffer = []
+        self._writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write(self, video, details, command=None, mode=None, option=None):
+        """Add the results of one encoding.
+        `details` is the merged dictionary of a CSV line of the studies (scene, extract and encoding
+        details) ; `command`, `mode` and `option` override the stringified values it may contain.
+        """
+        if command is None and details.get('Encoding command'):
+            command = shlex.split(details['Encoding command'])
+        self._buffer.append({
+            'study': self.study,
+            'run': self.run,
+            'video': video,
+            'scene_score': _number(details.get('Scene score')),
+            'scene_time': _number(details.get('Scene time')),
+            'extract_duration': _number(details.get('Duration')),
+            'start': _number(details.get('Start time')),
+            'end': _number(details.get('End time')),
+            'crf': int(details['CRF value']),
+            'mode': mode if mode else details.get('Encoding method'),
+            'option_removed': option,
+            'encoding_seconds': _number(details.get('Encoding duration')),
+            'vmaf_offset': _number(details.get('VMAF offset')),
+            'vmaf_psnr': _number(details.get('VMAF PSNR')),
+            'vmaf_mean': _number(details.get('VMAF arithmetic mean score')),
+            'vmaf_harmonic_mean': _number(details.get('VMAF harmonic mean score')),
+            'vmaf_seconds': _number(details.get('VMAF computing duration')),
+            'encoded_filesize': details.get('Encoded filesize'),
+            'size_percentage': _number(details.get('Filesize percentage')),
+            'encoding_command': [str(c) for c in command] if command else None,
+        })
+        if len(self._buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        if not self._buffer:
+            return
+        table = pa.Table.from_pylist(self._buffer, schema=schema())
+        if not self._writer:
+            self._writer = pq.ParquetWriter(str(self._part), schema(), compression='zstd')
+        self._writer.write_table(table)
+        self._buffer = []
+
+    def close(self):
+        self.flush()
+        if self._writer:
+            self._writer.close()
+            self._writer = None
+            os.replace(self._part, self.path)
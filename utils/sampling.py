@@ -0,0 +1,140 @@
+"""Stratified multi-window sampling of a video.
+
+Instead of a few long extracts, many short windows are drawn across the whole timeline, one per
+quantile of the scene scores (from the calmest to the busiest scenes), each as far as possible
+from the windows already drawn. The windows are concatenated into one composite clip that is
+encoded and scored like an extract. Windows are added by rounds until the standard error of the
+mean VMAF score of the windows is below a tolerance, so the CRF decisions represent the whole
+video while only a small part of its frames is encoded. Each round only encodes and scores its new
+windows : the clips of the rounds are concatenated into the composite at the end.
+"""
+
+import logging
+from math import sqrt
+from pathlib import Path
+from statistics import stdev
+from fractions import Fraction
+from utils.command import ffmpeg as ffmpeg_command
+from utils.executor import get_executor
+
+logger = logging.getLogger(__name__)
+
+WINDOW_DURATION = 3
+WINDOWS_PER_ROUND = 8
+MAX_WINDOWS = 48
+# windows cut by one ffmpeg command : each window is an input, with its own decoder
+BATCH_WINDOWS = 8
+# standard error of the mean VMAF score of the windows under which no window is added
+VMAF_TOLERANCE = 0.5
+
+
+def _overlaps(start, windows, duration):
+    return any(start < other + duration and other < start + duration for other in windows)
+
+
+def draw_windows(scenescores, video_duration, count, windows=(), duration=WINDOW_DURATION):
+    """Starts of `count` new windows, one per quantile of the scene scores.
+    In each quantile, the scene chosen is the one farthest from the windows already drawn, so the
+    windows also spread over the timeline. `windows` are the starts already drawn.
+    """
+    chosen = list(windows)
+    scenes = sorted(scenescores, key=lambda s: s['score'])
+    latest = max(0, video_duration - duration)
+    new = []
+    for i in range(count):
+        stratum = scenes[round(i * len(scenes) / count):round((i + 1) * len(scenes) / count)]
+        starts = [min(max(0, s['pts_time'] - duration / 2), latest) for s in stratum]
+        starts = [start for start in starts if not _overlaps(start, chosen, duration)]
+        if not starts:
+            continue
+        start = max(starts, key=lambda t: min((abs(t - other) for other in chosen), default=t))
+        chosen.append(start)
+        new.append(start)
+    return new
+
+
+def composite_command(ffmpeg, input, output, windows, frame_count, loglevel='quiet'):
+    """Lossless concatenation of the windows of `frame_count` frames starting at `windows`"""
+    command = ffmpeg_command(ffmpeg, loglevel, stats=False)
+    for start in windows:
+        command = command.with_input(input, {'-ss': start})
+    graph = ''.join(f"[{i}:v:0]trim=end_frame={frame_count},setpts=PTS-STARTPTS[w{i}];" for i in range(len(windows)))
+    graph += ''.join(f"[w{i}]" for i in range(len(windows))) + f"concat=n={len(windows)}:v=1:a=0[out]"
+    return command.with_filtergraph(graph) \
+        .with_options({'-map': '[out]', '-c:v': 'libx264', '-qp': 0, '-preset': 'ultrafast', '-an': True}) \
+        .with_output(output)
+
+
+def concat_command(ffmpeg, concat_list, output, loglevel='quiet'):
+    """Concatenation without re-encoding of the clips listed in `concat_list`"""
+    return ffmpeg_command(ffmpeg, loglevel, stats=False) \
+        .with_input(concat_list, {'-f': 'concat', '-safe': 0}) \
+        .with_options({'-c': 'copy'}) \
+        .with_output(output)
+
+
+def concat_clips(ffmpeg, clips, output, loglevel='quiet'):
+    """Concatenate the lossless clips (encoded with the same options) into `output` and remove them"""
+    output = Path(output)
+    if len(clips) == 1:
+        Path(clips[0]).replace(output)
+        return output
+    concat_list = output.with_suffix('.txt')
+    with open(concat_list, 'w') as fd:
+        fd.write(''.join(f"file '{Path(clip).resolve()}'\n" for clip in clips))
+    get_executor().run(concat_command(ffmpeg, concat_list, output, loglevel).argv(), check=True)
+    for path in [*clips, concat_list]:
+        Path(path).unlink(missing_ok=True)
+    return output
+
+
+def build_composite(ffmpeg, input, output, windows, frame_count, loglevel='quiet', batch=BATCH_WINDOWS):
+    """Composite clip of the windows, in the given order, cut by batches of `batch` windows at most"""
+    output = Path(output)
+    clips = []
+    for i in range(0, len(windows), batch):
+        clips.append(output.with_name(f"{output.stem}.batch{i // batch:03d}{output.suffix}"))
+        get_executor().run(composite_command(ffmpeg, input, clips[-1], windows[i:i + batch], frame_count, loglevel).argv(), check=True)
+    return concat_clips(ffmpeg, clips, output, loglevel)
+
+
+def window_scores(frame_scores, window_count, frame_count):
+    """Pooled score of each window of the composite from its per-frame scores"""
+    from utils.vmaf_features import pool
+
+    return [pool(frame_scores[i * frame_count:(i + 1) * frame_count])['harmonic_mean']
+            for i in range(window_count) if len(frame_scores[i * frame_count:(i + 1) * frame_count])]
+
+
+def standard_error(scores):
+    return stdev(scores) / sqrt(len(scores)) if len(scores) > 1 else float('inf')
+
+
+def sample(ffmpeg, input, output, scenescores, video_duration, frame_rate, measure,
+           tolerance=VMAF_TOLERANCE, duration=WINDOW_DURATION, per_round=WINDOWS_PER_ROUND, max_windows=MAX_WINDOWS):
+    """Composite clip of stratified windows representing `input`, written to `output`.
+
+    `measure(path)` encodes a clip at a probe CRF and returns its per-frame VMAF scores ; windows are
+    added by rounds of `per_round` until the standard error of the window scores is below `tolerance`.
+    Only the clip of the new windows of a round is measured, the scores of the previous windows are kept.
+    Returns the window starts, in the order of the composite, and the score of each window.
+    """
+    output = Path(output)
+    frame_count = round(duration * Fraction(str(frame_rate)))
+    windows, scores, clips = [], [], []
+    while True:
+        new = sorted(draw_windows(scenescores, video_duration, min(per_round, max_windows - len(windows)), windows, duration))
+        if new:
+            clips.append(build_composite(ffmpeg, input, output.with_name(f"{output.stem}.round{len(clips):02d}{output.suffix}"), new, frame_count))
+            round_scores = window_scores(measure(clips[-1]), len(new), frame_count)
+            if len(round_scores) != len(new):
+                raise ValueError(f"{len(round_scores)} scores for the {len(new)} windows of the round {len(clips)}")
+            windows += new
+            scores += round_scores
+        if not windows:
+            raise ValueError(f"No window of {duration}s can be drawn in {input}")
+        error = standard_error(scores)
+        logger.info(f"{len(windows)} windows of {duration}s : vmaf {sum(scores) / len(scores):.2f} +/- {error:.2f}")
+        if error <= tolerance or not new or len(windows) >= max_windows:
+            concat_clips(ffmpeg, clips, output)
+            return windows, scores
@@ -0,0 +1,145 @@
+"""Per-scene CRF : the video is split at its scene cuts, a CRF is chosen for each segment on a short
+sample, and the video is encoded in one pass with x264 zones (or segment by segment, in parallel).
+"""
+
+import logging
+from pathlib import Path
+from fractions import Fraction
+from utils.command import ffmpeg as ffmpeg_command
+from utils.jobpool import run_jobs, in_order
+from utils.rd import sweep, target_crf
+from utils.executor import get_executor
+from utils.muxing import muxing_options
+from utils.workspace import atomic_output
+
+logger = logging.getLogger(__name__)
+
+SCENE_THRESHOLD = 0.3
+MIN_SEGMENT_DURATION = 20
+SAMPLE_DURATION = 5
+# the quality of a zone can't be adjusted beyond this bitrate multiplier
+MAX_ZONE_FACTOR = 4
+# threads per segment encode when no thread plan is available : short segments scale poorly,
+# running several of them side by side uses the cores better
+SEGMENT_THREADS = 2
+
+
+def scene_segments(scenescores, duration, threshold=SCENE_THRESHOLD, min_duration=MIN_SEGMENT_DURATION):
+    """Split [0, duration] at the scene cuts whose score is above `threshold`.
+    Segments shorter than `min_duration` are merged with the next one (the last one with the previous one).
+    """
+    cuts = sorted(s['pts_time'] for s in scenescores if s['score'] >= threshold and 0 < s['pts_time'] < duration)
+    segments = []
+    start = 0
+    for cut in cuts:
+        if cut - start >= min_duration:
+            segments.append((start, cut))
+            start = cut
+    if segments and duration - start < min_duration:
+        segments[-1] = (segments[-1][0], duration)
+    else:
+        segments.append((start, duration))
+    return segments
+
+
+def sample_start(segment, sample_duration=SAMPLE_DURATION):
+    """Start of the sample of a segment : its middle `sample_duration` seconds"""
+    start, end = segment
+    return max(start, (start + end - sample_duration) / 2)
+
+
+def choose_crfs(segments, measure, low, high, target):
+    """CRF of each segment : the highest one reaching `target`, found with an adaptive sweep of
+    `measure(segment_index, crf)`, which encodes the sample of the segment and returns `(size, score)`
+    """
+    crfs = []
+    for i, segment in enumerate(segments):
+        curve = sweep(lambda crf: measure(i, crf), low, high, target=target)
+        crfs.append(target_crf(curve, target, low, high))
+        logger.info(f"Segment {segment[0]:.1f}-{segment[1]:.1f}s : crf {crfs[-1]} ({len(curve)} encodes)")
+    return crfs
+
+
+def zone_factor(crf, base_crf):
+    """x264 bitrate multiplier of a zone : 6 CRF steps double (or halve) the size"""
+    factor = 2 ** ((base_crf - crf) / 6)
+    return min(max(factor, 1 / MAX_ZONE_FACTOR), MAX_ZONE_FACTOR)
+
+
+def x264_zones(segments, crfs, base_crf, frame_rate):
+    """Value of the `zones` x264 parameter applying the CRF of each segment to an encode at `base_crf`"""
+    fps = Fraction(str(frame_rate))
+    zones = []
+    for (start, end), crf in zip(segments, crfs):
+        if crf == base_crf:
+            continue
+        first, last = round(start * fps), round(end * fps) - 1
+        zones.append(f"{first},{last},b={zone_factor(crf, base_crf):.3f}")
+    return '/'.join(zones)
+
+
+def _encode_segment(ffmpeg, input, output, start, duration, crf, options, loglevel='quiet'):
+    command = ffmpeg_command(ffmpeg, loglevel, stats=False) \
+        .with_input(input, {'-ss': start}) \
+        .with_options({'-t': duration, '-crf': crf, '-an': True, **dict(options)}) \
+        .with_output(output)
+    get_executor().run(command.argv(), check=True)
+
+
+def encode_segments(ffmpeg, input, output, segments, crfs, tmp_dir, options={}, threads=SEGMENT_THREADS, jobs=None, loglevel='quiet', muxing=None):
+    """Encode each segment with its own CRF on the process pool, then concatenate them (video only).
+    `muxing` are the muxer options of the concatenation (see utils/muxing.py), `muxing_options()` by default.
+    """
+    tmp_dir = Path(tmp_dir)
+    parts = [tmp_dir / f"{Path(output).stem}.segment{i:04d}.mp4" for i in range(len(segments))]
+    segment_jobs = [{
+        'ffmpeg': ffmpeg,
+        'input': str(input),
+        'output': part,
+        'start': start,
+        'duration': end - start,
+        'crf': crf,
+        'options': {'-threads': threads, **options},
+        'loglevel': loglevel,
+    } for part, (start, end), crf in zip(parts, segments, crfs)]
+    for _ in in_order(run_jobs(_encode_segment, segment_jobs, threads=threads, max_workers=jobs)):
+        pass
+
+    concat_list = tmp_dir / f"{Path(output).stem}.segments.txt"
+    with open(concat_list, 'w') as fd:
+        fd.write(''.join(f"file '{part}'\n" for part in parts))
+    with atomic_output(output) as part:
+        concat = ffmpeg_command(ffmpeg, loglevel, stats=False) \
+            .with_input(concat_list, {'-f': 'concat', '-safe': 0}) \
+            .with_options({'-c': 'copy', **(muxing if muxing is not None else muxing_options())}) \
+            .with_output(part)
+        get_executor().run(concat.argv(), check=True)
+    for path in [*parts, concat_list]:
+        path.unlink(missing_ok=True)
+
+
+def segment_scores(frame_scores, segments, frame_rate):
+    """Pooled VMAF scores of each segment from the per-frame scores of the whole encode"""
+    from utils.vmaf_features import pool
+
+    fps = Fraction(str(frame_rate))
+    stats = []
+    for start, end in segments:
+        scores = frame_scores[round(start * fps):round(end * fps)]
+        if len(scores):
+            stats.append({'start': start, 'end': end, **pool(scores)})
+    return stats
+
+
+def distribution(stats, key='harmonic_mean'):
+    """Distribution of a pooled score over the segments : worst, 10th percentile, median and best"""
+    import numpy as np
+
+    values = np.array([s[key] for s in stats])
+    return {
+        'segments': len(values),
+        'worst': float(values.min()),
+        'p10': float(np.percentile(values, 10)),
+        'median': float(np.median(values)),
+        'best': float(values.max()),
+    }
@@ -0,0 +1,28 @@
+import os
+from pathlib import Path
+from functools import lru_cache
+from collections import namedtuple
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+
+Settings = namedtuple('Settings', ['ffmpeg', 'ffprobe', 'vmaf_models', 'output_dir', 'tmp_dir', 'config'])
+
+
+@lru_cache(maxsize=None)
+def get_settings():
+    """Configuration of the project, read once from the `.env` file.
+    The environment variables of the same name take precedence over the file.
+    """
+    from dotenv import find_dotenv, dotenv_values
+
+    config = dotenv_values(find_dotenv())
+    config.update({k: v for k, v in os.environ.items() if k in config})
+
+    return Settings(
+        ffmpeg=config.get('ffmpeg') or 'ffmpeg',
+        ffprobe=config.get('ffprobe') or 'ffprobe',
+        vmaf_models={k[len('vmaf_'):]: v for k, v in config.items() if k.startswith('vmaf_') and v},
+        output_dir=ROOT_DIR / 'output',
+        tmp_dir=ROOT_DIR / 'tmp',
+        config=config,
+    )
@@ -0,0 +1,265 @@
+"""Scale benchmarks of the orchestration on the simulated executor (see utils/executor.py).
+
+- `pipeline` : the DAG of a study (probe, keyframes, extract, encodes and VMAF at several CRFs)
+  over many videos, run on the memoized pipeline. Measures the makespan for each concurrency
+  limit, the cache hit rates of a second run and of a run with one CRF changed, and the recovery
+  from injected failures and crashes : the work redone and the cache entries left corrupted.
+- `schedule` : a backlog of full encodes processed by N workers in the order of each queue
+  policy (`fifo`, `savings` of utils/triage.py, `makespan` of utils/planner.py), simulated event
+  by event on a virtual clock. Measures the makespan against the ETA the planner gives for the
+  same order, and the bytes saved at each quarter of the makespan.
+
+    python -m utils simulate pipeline --videos 1000 --workers 4,8,16
+    python -m utils simulate schedule --videos 10000 --workers 8
+"""
+
+import json
+import heapq
+import logging
+import argparse
+import tempfile
+from time import time
+from pathlib import Path
+from subprocess import CalledProcessError
+from utils.command import ffmpeg
+from utils.executor import SimulatedExecutor, SimulatedCrash, Clock, VirtualClock, load_profiles, recorded_profiles, set_executor, \
+    get_executor, write_media, media_size
+
+logger = logging.getLogger(__name__)
+
+FFMPEG = 'ffmpeg'
+FFPROBE = 'ffprobe'
+CRF_VALUES = [25, 27, 30]
+EXTRACT_DURATION = 30
+POLICIES = ['fifo', 'savings', 'makespan']
+
+
+def create_sources(directory, count, executor):
+    """`count` simulated sources in `directory`, as `{path: (size, info)}`"""
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    sources = {}
+    for i in range(count):
+        path = directory / f"video-{i:05d}.mp4"
+        media = executor.source_media(path.name)
+        write_media(path, media, media_size(media))
+        sources[path] = path.stat().st_size
+    return sources
+
+
+# stages of the `pipeline` scenario
+
+def probe(input):
+    from utils import triage
+    return triage.video_info(triage.probe(input, FFPROBE))
+
+
+def keyframes(input):
+    from utils.keyframes import probe_keyframes
+    return probe_keyframes(input, FFPROBE)
+
+
+def extract(input, info, keyframes, output):
+    from utils.keyframes import extract_gop_aligned
+    start = max(0, info['duration'] / 2 - EXTRACT_DURATION / 2)
+    return extract_gop_aligned(FFMPEG, input, output, start, EXTRACT_DURATION, keyframes)
+
+
+def encode(input, crf, output):
+    get_executor().run(ffmpeg(FFMPEG).with_input(input).with_options({'-crf': crf, '-an': True}).with_output(output).argv(), check=True)
+    return Path(output).stat().st_size
+
+
+def vmaf(reference, distorted):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        log_path = Path(tmp_dir) / 'vmaf.json'
+        command = ffmpeg(FFMPEG).with_input(distorted).with_input(reference) \
+            .with_filtergraph(f"[0:v][1:v]libvmaf=log_fmt=json:log_path={log_path}") \
+            .with_options({'-f': 'null'}).with_output('-')
+        get_executor().run(command.argv(), check=True)
+        with open(log_path, 'r') as fd:
+            return json.load(fd)['pooled_metrics']['vmaf']['mean']
+
+
+def build_pipeline(pipeline, sources, crfs):
+    targets = []
+    for path in sources:
+        info = pipeline.stage('probe', probe, input=path)
+        keys = pipeline.stage('keyframes', keyframes, input=path)
+        sample = pipeline.stage('extract', extract, suffix='.mp4', input=path, info=info, keyframes=keys)
+        for crf in crfs:
+            encoded = pipeline.stage('encode', encode, suffix='.mp4', input=sample, crf=crf)
+            targets.append(pipeline.stage('vmaf', vmaf, reference=sample, distorted=encoded))
+    return targets
+
+
+def _records(store):
+    return {path for path in Path(store).glob('*.json')}
+
+
+def run_pipeline(store, sources, crfs, workers, executor, retries=1000):
+    """One run of the DAG on `workers` threads, restarted after each injected failure or crash.
+    Returns the measures of the run.
+    """
+    from utils.pipeline import Pipeline
+
+    before = _records(store)
+    start, real_start = executor.clock.time(), time()
+    failures, crashes = 0, 0
+    while True:
+        pipeline = Pipeline(store=store, jobs=workers)
+        targets = build_pipeline(pipeline, sources, crfs)
+        try:
+            pipeline.run(targets)
+            break
+        except (CalledProcessError, SimulatedCrash) as e:
+            failures += isinstance(e, CalledProcessError)
+            crashes += isinstance(e, SimulatedCrash)
+            logger.info(f"restart {failures + crashes} after {e}")
+            if failures + crashes > retries:
+                raise
+    computed = len(_records(store) - before)
+    return {
+        'workers': workers,
+        'stages': len(pipeline.stages),
+        'computed': computed,
+        'hit_rate': 1 - computed / len(pipeline.stages),
+        'failures': failures,
+        'crashes': crashes,
+        'makespan': executor.clock.time() - start,
+        'real_seconds': time() - real_start,
+    }
+
+
+def check_store(store):
+    """Cache entries that can't be read back, and partial files left in the store"""
+    corrupted = 0
+    for record in _records(store):
+        try:
+            with open(record, 'r') as fd:
+                json.load(fd)
+        except ValueError:
+            corrupted += 1
+    partial = len(list(Path(store).glob('.*.part*')))
+    return corrupted, partial
+
+
+def pipeline_scenario(args, profiles, root):
+    executor = set_executor(SimulatedExecutor(profiles, Clock(args.speed), args.seed))
+    sources = create_sources(root / 'sources', args.videos, executor)
+
+    # the cores kept busy are the CPU seconds of the simulated jobs over the makespan
+    print(f"{args.videos} videos, CRF {', '.join(map(str, args.crfs))}")
+    print(f"{'workers':>8}{'stages':>8}{'commands':>10}{'makespan h':>12}{'real s':>8}{'cores busy':>12}{'in flight':>11}")
+    for workers in args.workers:
+        executor.stats, executor.max_in_flight = {}, 0
+        measure = run_pipeline(root / f"store-{workers}", sources, args.crfs, workers, executor)
+        cpu = sum(stats['cpu_seconds'] for stats in executor.stats.values())
+        commands = sum(stats['jobs'] for stats in executor.stats.values())
+        print(f"{workers:>8}{measure['stages']:>8}{commands:>10}{measure['makespan'] / 3600:>12.1f}{measure['real_seconds']:>8.1f}"
+              f"{cpu / measure['makespan']:>12.1f}{executor.max_in_flight:>11}")
+
+    store = root / f"store-{args.workers[-1]}"
+    warm = run_pipeline(store, sources, args.crfs, args.workers[-1], executor)
+    changed = run_pipeline(store, sources, [*args.crfs[:-1], args.crfs[-1] + 1], args.workers[-1], executor)
+    print(f"cache : {warm['hit_rate']:.1%} hits on a second run, {changed['hit_rate']:.1%} with CRF {args.crfs[-1]} -> {args.crfs[-1] + 1}")
+
+    failing = {**profiles, 'crash_rate': args.crash_rate,
+               **{kind: {**profiles[kind], 'failure_rate': args.failure_rate} for kind in ['encode', 'vmaf', 'copy', 'probe']}}
+    executor = set_executor(SimulatedExecutor(failing, Clock(args.speed), args.seed))
+    store = root / 'store-recovery'
+    recovery = run_pipeline(store, sources, args.crfs, args.workers[-1], executor)
+    redone = sum(stats['jobs'] for stats in executor.stats.values()) - commands
+    corrupted, partial = check_store(store)
+    print(f"recovery : {recovery['failures']} failures and {recovery['crashes']} crashes restarted "
+          f"({args.failure_rate:.1%} and {args.crash_rate:.2%} of the commands), {redone} commands redone, "
+          f"makespan {recovery['makespan'] / 3600:.1f} h, {corrupted} corrupted entries, {partial} partial files")
+
+
+# `schedule` scenario
+
+def policy_order(policy, sources, infos, workers, cost):
+    from utils import triage, planner
+
+    if policy == 'fifo':
+        return list(sources)
+    if policy == 'savings':
+        queue, below = triage.triage({path: (sources[path], infos[path]) for path in sources})
+        return queue + below
+    order, _, _ = planner.lpt({path: cost(path) for path in sources}, workers)
+    return order
+
+
+def process_queue(order, workers, executor, output_dir):
+    """Full encodes of the queue `order` by `workers` workers, each job taken by the first free
+    worker, simulated event by event on the virtual clock of `executor`. Returns the finish time and
+    the bytes saved of each job, relative to the start of the clock
+    """
+    start = executor.clock.time()
+    free = [(start, worker) for worker in range(workers)]
+    output = Path(output_dir) / "encode.mp4"
+    done = []
+    for path in order:
+        now, worker = heapq.heappop(free)
+        executor.clock.set(now)
+        executor.run(ffmpeg(FFMPEG).with_input(path).with_options({'-crf': 27}).with_output(output).argv(), check=True)
+        saved = path.stat().st_size - output.stat().st_size
+        output.unlink()
+        heapq.heappush(free, (executor.clock.time(), worker))
+        done.append((executor.clock.time() - start, max(0, saved)))
+    return sorted(done)
+
+
+def schedule_scenario(args, profiles, root):
+    from utils import triage, planner
+
+    executor = set_executor(SimulatedExecutor(profiles, VirtualClock(), args.seed))
+    sources = create_sources(root / 'sources', args.videos, executor)
+    infos = {path: triage.video_info(triage.probe(path, FFPROBE)) for path in sources}
+    model = planner.CostModel('encode')
+    cost = lambda path: model.predict(infos[path], 27)
+    workers = args.workers[-1]
+
+    print(f"{args.videos} videos, {workers} workers")
+    print(f"{'policy':<10}{'makespan h':>12}{'ETA h':>8}{'real s':>8}" + ''.join(f"{f'saved {q}%':>12}" for q in [25, 50, 75]))
+    for policy in args.policies:
+        order = policy_order(policy, sources, infos, workers, cost)
+        eta = planner.plan({path: (sources[path], None) for path in order}, cost, workers, order=order)['makespan']
+        real_start = time()
+        done = process_queue(order, workers, executor, root)
+        makespan = done[-1][0]
+        total = sum(saved for _, saved in done)
+        quarters = [sum(saved for t, saved in done if t <= makespan * q / 100) / total for q in [25, 50, 75]]
+        print(f"{policy:<10}{makespan / 3600:>12.1f}{eta / 3600:>8.1f}{time() - real_start:>8.1f}" + ''.join(f"{q:>12.0%}" for q in quarters))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m utils simulate', description="Benchmark the orchestration at scale on the simulated executor")
+    parser.add_argument('scenario', choices=['pipeline', 'schedule'])
+    parser.add_argument('--videos', type=int, help="Number of simulated sources (default : 1000 for pipeline, 10000 for schedule)")
+    parser.add_argument('--workers', default='8', help="Comma separated concurrency limits (default : 8)")
+    parser.add_argument('--crfs', default=','.join(map(str, CRF_VALUES)), help="CRFs of the pipeline scenario")
+    parser.add_argument('--policies', default=','.join(POLICIES), help=f"Queue policies of the schedule scenario (default : {','.join(POLICIES)})")
+    parser.add_argument('--speed', type=float, default=1e4, help="Acceleration of the clock of the pipeline scenario (default : 1e4) ; the schedule scenario runs on a virtual clock")
+    parser.add_argument('--failure-rate', type=float, default=0.01, help="Failures injected in the commands of the recovery run (default : 0.01)")
+    parser.add_argument('--crash-rate', type=float, default=0.001, help="Crashes injected after the commands of the recovery run (default : 0.001)")
+    parser.add_argument('--profiles', help="JSON file overriding the default job profiles")
+    parser.add_argument('--catalogue', help="Catalogue whose encodes give the profiles of the sources and encodes")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--log-level', default='warning', help="Level of logging : debug, info, warning (default), error or critical")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=getattr(logging, args.log_level.upper(), 'WARNING'))
+
+    args.workers = [int(w) for w in args.workers.split(',')]
+    args.crfs = [int(c) for c in args.crfs.split(',')]
+    args.policies = args.policies.split(',')
+    args.videos = args.videos if args.videos else (1000 if args.scenario == 'pipeline' else 10000)
+    profiles = load_profiles(args.profiles)
+    if args.catalogue:
+        profiles = recorded_profiles(args.catalogue, profiles)
+
+    with tempfile.TemporaryDirectory(prefix='simulation-') as root:
+        if args.scenario == 'pipeline':
+            pipeline_scenario(args, profiles, Path(root))
+        else:
+            schedule_scenario(args, profiles, Path(root))
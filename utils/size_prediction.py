@@ -0,0 +1,103 @@
+import logging
+from pathlib import Path
+from datetime import datetime
+from statistics import mean, stdev
+from utils.executor import get_executor
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_COUNT = 5
+SAMPLE_DURATION = 20
+
+# Student's t quantiles (97.5 %) for a 95 % confidence interval, by degrees of freedom
+T_975 = {1: 12.706, 2: 4.303, 3: 3.182, 4: 2.776, 5: 2.571, 6: 2.447, 7: 2.365, 8: 2.306, 9: 2.262, 10: 2.228}
+
+CSV_HEADERS = ['Date', 'Video', 'CRF', 'Samples', 'Predicted ratio', 'CI low', 'CI high', 'Threshold', 'Decision', 'Actual ratio', 'Prediction error']
+
+
+def select_sample_times(scenescores, count=SAMPLE_COUNT):
+    """Times of `count` scenes spread over the quantiles of the scene scores, from the calmest to the busiest.
+    `scenescores` is the list of scene scores sorted by score ; a single sample is the median scene.
+    """
+    if len(scenescores) <= count:
+        return [score['pts_time'] for score in scenescores]
+    if count == 1:
+        return [scenescores[len(scenescores) // 2]['pts_time']]
+    step = (len(scenescores) - 1) / (count - 1)
+    return [scenescores[round(i * step)]['pts_time'] for i in range(count)]
+
+
+def _extract(ffmpeg, input, output, start, duration):
+    get_executor().run([
+        str(ffmpeg), '-hide_banner', '-loglevel', 'quiet',
+        '-ss', str(start), '-i', str(input), '-t', str(duration),
+        '-c', 'copy', '-y', str(output)
+    ], check=True)
+
+
+def predict_ratio(input, encode_command, sample_times, duration, tmp_dir, ffmpeg, sample_duration=SAMPLE_DURATION, on_sample=None):
+    """Encode short extracts around `sample_times` and extrapolate the size ratio of the whole video.
+
+    `encode_command(input, output)` must return the same command as the full encode.
+    `on_sample(extract_path, encoded_path)` is called for each sample before its files are removed.
+    Returns the predicted ratio and its 95 % confidence interval as `(ratio, low, high)`, or
+    `(None, None, None)` when there is no sample time (no scene score).
+    """
+    input = Path(input)
+    tmp_dir = Path(tmp_dir)
+    ratios = []
+    for time in sample_times:
+        start = min(max(0, time - sample_duration / 2), max(0, duration - sample_duration))
+        extract_path = tmp_dir / f"{input.stem}.sample.t{start:.2f}{input.suffix}"
+        encoded_path = tmp_dir / f"{input.stem}.sample.t{start:.2f}.encoded.mp4"
+        try:
+            _extract(ffmpeg, input, extract_path, start, sample_duration)
+            get_executor().run(encode_command(extract_path, encoded_path), check=True)
+            ratios.append(encoded_path.stat().st_size / extract_path.stat().st_size)
+            if on_sample:
+                on_sample(extract_path, encoded_path)
+        finally:
+            extract_path.unlink(missing_ok=True)
+            encoded_path.unlink(missing_ok=True)
+        logger.debug(f"sample at {start:.2f}s : ratio {ratios[-1]:.3f}")
+
+    if not ratios:
+        logger.warning(f"no sample of {input.name} to predict its size ratio")
+        return None, None, None
+    predicted = mean(ratios)
+    if len(ratios) < 2:
+        return predicted, 0.0, float('inf')
+    t = T_975.get(len(ratios) - 1, 1.96)
+    margin = t * stdev(ratios) / len(ratios) ** 0.5
+    return predicted, predicted - margin, predicted + margin
+
+
+def should_skip(low, threshold):
+    """A video is skipped when even the low end of the confidence interval doesn't go below the threshold.
+    Without a prediction, it is encoded.
+    """
+    return low is not None and low >= threshold
+
+
+def log_prediction(csv_path, video, crf, samples, prediction, threshold, skipped, actual=None):
+    """Append a prediction (and the actual ratio when the video was encoded) to the calibration csv"""
+    csv_path = Path(csv_path)
+    predicted, low, high = prediction
+    values = [
+        datetime.now().strftime("%Y-%m-%d %H-%M-%S"),
+        video,
+        crf,
+        samples,
+        predicted,
+        low,
+        high,
+        threshold,
+        'skipped' if skipped else 'encoded',
+        actual if actual is not None else '',
+        actual - predicted if actual is not None and predicted is not None else '',
+    ]
+    write_headers = not csv_path.exists()
+    with open(csv_path, 'a') as fd:
+        if write_headers:
+            fd.write(';'.join(CSV_HEADERS) + '\n')
+        fd.write(';'.join(str(v) for v in values) + '\n')
@@ -0,0 +1,42 @@
+"""Stages shared by the pipelines of the studies and of `choose-crf.py` (see utils/pipeline.py).
+
+The stages return JSON values ; the ones writing a file receive its path as `output`.
+"""
+
+from utils.settings import get_settings
+from utils.executor import get_executor
+
+
+def duration(input):
+    """Duration of the video in seconds"""
+    command = [get_settings().ffprobe, '-v', 'error', '-show_entries', 'format=duration', '-of', 'default=noprint_wrappers=1:nokey=1', str(input)]
+    return float(get_executor().check_output(command))
+
+
+def scenescores(input, log_level='warning'):
+    """Scene scores of every frame, sorted from the calmest to the busiest"""
+    from utils.ffmpeg_scenescores import get_sorted_scenescores
+    return get_sorted_scenescores(str(input), log_level=log_level)
+
+
+def keyframes(input):
+    from utils.keyframes import probe_keyframes
+    return probe_keyframes(input)
+
+
+def extract(input, keyframes, start, duration, output, ffmpeg=None, loglevel='quiet'):
+    """Extract of the GOPs covering [start, start + duration] ; returns the start and duration extracted"""
+    from utils.keyframes import extract_gop_aligned
+    ffmpeg = ffmpeg if ffmpeg else get_settings().ffmpeg
+    return extract_gop_aligned(ffmpeg, input, output, start, duration, keyframes, loglevel=loglevel)
+
+
+def vmaf_features(reference, distorted, output, model=None):
+    """Elementary VMAF features of `distorted` (numpy file) ; returns the pooled score of `model`"""
+    from time import time
+    from utils.vmaf_features import extract_features, score
+
+    model = str(model) if model else get_settings().vmaf_models['HD']
+    start = time()
+    features = extract_features(reference, distorted, output, models=[model])
+    return {**score(features, model)[1], 'seconds': time() - start}
@@ -0,0 +1,185 @@
+"""Thread plan of this host : how many encodes (and VMAF computations) to run at the same time and
+with how many threads each, measured once and saved per host in the output directory.
+
+The plan is read lazily, the first time it is needed. Being part of the `utils` package, the
+planner runs as a module from the root of the project :
+
+    python -m utils plan-threads SAMPLE
+    python -m utils.thread_planner SAMPLE
+"""
+
+import json
+import socket
+import logging
+import argparse
+import subprocess
+from time import time
+from functools import lru_cache
+from datetime import datetime
+from utils.jobpool import available_cores
+from utils.settings import get_settings
+from utils.workspace import atomic_write
+from utils.executor import real_executor
+
+logger = logging.getLogger(__name__)
+
+BENCHMARK_DURATION = 10
+
+
+def candidate_threads(cores):
+    """Thread counts worth measuring : powers of 2 up to the number of cores, and the number of cores"""
+    threads = []
+    t = 1
+    while t < cores:
+        threads.append(t)
+        t *= 2
+    threads.append(cores)
+    return threads
+
+
+def encode_command(sample, threads, duration=BENCHMARK_DURATION):
+    return [
+        get_settings().ffmpeg, '-hide_banner', '-loglevel', 'error', '-nostats', '-progress', 'pipe:1',
+        '-t', str(duration), '-i', str(sample),
+        '-an', '-c:v', 'libx264', '-preset', 'medium', '-crf', '27', '-threads', str(threads),
+        '-f', 'null', '-'
+    ]
+
+
+def vmaf_command(sample, threads, duration=BENCHMARK_DURATION):
+    return [
+        get_settings().ffmpeg, '-hide_banner', '-loglevel', 'error', '-nostats', '-progress', 'pipe:1',
+        '-t', str(duration), '-i', str(sample),
+        '-t', str(duration), '-i', str(sample),
+        '-lavfi', f"[0:v]setpts=PTS-STARTPTS[dist];[1:v]setpts=PTS-STARTPTS[ref];[dist][ref]libvmaf=n_threads={threads}",
+        '-threads', str(threads),
+        '-f', 'null', '-'
+    ]
+
+
+def _last_frame(progress):
+    """Last `frame=` value of the output of `-progress`"""
+    frames = 0
+    for line in progress.splitlines():
+        if line.startswith('frame='):
+            frames = int(line.split('=')[1])
+    return frames
+
+
+def measure_fps(commands):
+    """Run the commands together and return the total number of frames processed per second.
+    It is a benchmark of the real commands, it refuses to run under the simulated executor.
+    """
+    executor = real_executor('The thread planner')
+    start = time()
+    processes = [executor.popen(command, stdout=subprocess.PIPE, text=True) for command in commands]
+    frames = sum(_last_frame(process.communicate()[0]) for process in processes)
+    return frames / (time() - start)
+
+
+def plan_stage(build_command, sample, cores, duration=BENCHMARK_DURATION):
+    """Measure the scaling of one kind of job and choose the (jobs, threads) couple with the best
+    total throughput.
+
+    The single job speed is measured for each candidate thread count, then the best candidates
+    (estimated as `jobs x single job fps`) are measured again with all their jobs running at the
+    same time, as memory bandwidth and caches are shared between concurrent jobs.
+    """
+    measures = []
+    for threads in candidate_threads(cores):
+        fps = measure_fps([build_command(sample, threads, duration)])
+        jobs = max(1, cores // threads)
+        logger.info(f"{threads} threads : {fps:.1f} fps, {jobs} jobs estimated at {fps * jobs:.1f} fps")
+        measures.append({'threads': threads, 'jobs': jobs, 'fps': fps, 'estimated_total_fps': fps * jobs})
+
+    candidates = sorted(measures, key=lambda m: m['estimated_total_fps'], reverse=True)[:2]
+    for candidate in candidates:
+        commands = [build_command(sample, candidate['threads'], duration)] * candidate['jobs']
+        candidate['total_fps'] = measure_fps(commands)
+        logger.info(f"{candidate['jobs']} jobs x {candidate['threads']} threads : {candidate['total_fps']:.1f} fps")
+
+    best = max(candidates, key=lambda m: m['total_fps'])
+    return {'jobs': best['jobs'], 'threads': best['threads'], 'total_fps': best['total_fps'], 'measures': measures}
+
+
+def ffmpeg_version():
+    output = real_executor('The thread planner').check_output([get_settings().ffmpeg, '-version'], text=True)
+    return output.splitlines()[0]
+
+
+def plan_path(host=None):
+    host = host if host else socket.gethostname()
+    return get_settings().output_dir / f"thread-plan.{host}.json"
+
+
+def make_plan(sample, duration=BENCHMARK_DURATION, cores=None):
+    """Measure this host and save the resulting plan next to the other outputs"""
+    cores = cores if cores else available_cores()
+    plan = {
+        'host': socket.gethostname(),
+        'cores': cores,
+        'ffmpeg': ffmpeg_version(),
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'sample': str(sample),
+        'encode': plan_stage(encode_command, sample, cores, duration),
+        'vmaf': plan_stage(vmaf_command, sample, cores, duration),
+    }
+
+    path = plan_path()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with atomic_write(path) as fd:
+        fd.write(json.dumps(plan, indent=4))
+    logger.info(f"Thread plan written to {path}")
+    load_plan.cache_clear()
+    return plan
+
+
+@lru_cache(maxsize=None)
+def load_plan():
+    """Plan saved for this host, read once ; None if there is none, if it can't be read or if it was
+    measured with another number of cores
+    """
+    path = plan_path()
+    if not path.exists():
+        return None
+    try:
+        with open(path, 'r') as fd:
+            plan = json.loads(fd.read())
+        if not all({'jobs', 'threads'} <= set(plan[stage]) for stage in ['encode', 'vmaf']):
+            raise ValueError("a stage misses its jobs or threads")
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        logger.warning(f"The thread plan {path} can't be read ({e}), it is ignored")
+        return None
+    if plan.get('cores') != available_cores():
+        logger.warning(f"The thread plan {path} was made for {plan['cores']} cores, it is ignored")
+        return None
+    return plan
+
+
+def get_threads(stage, default=0):
+    """Number of threads per job for `stage` ('encode' or 'vmaf') according to the plan of this host"""
+    plan = load_plan()
+    return plan[stage]['threads'] if plan else default
+
+
+def get_jobs(stage, default=1):
+    """Number of concurrent jobs for `stage` ('encode' or 'vmaf') according to the plan of this host"""
+    plan = load_plan()
+    return plan[stage]['jobs'] if plan else default
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure the encoding and VMAF scaling of this host and save the best thread plan")
+    parser.add_argument('sample', help="Video file used for the measures")
+    parser.add_argument('--duration', type=int, default=BENCHMARK_DURATION, help="Duration (in seconds) of the sample used for each measure")
+    parser.add_argument('--log-level', default='info')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=getattr(logging, args.log_level.upper(), 'INFO'))
+    plan = make_plan(args.sample, args.duration)
+    print(f"encode : {plan['encode']['jobs']} jobs x {plan['encode']['threads']} threads")
+    print(f"vmaf   : {plan['vmaf']['jobs']} jobs x {plan['vmaf']['threads']} threads")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,248 @@
+import os
+import json
+import shlex
+import shutil
+import logging
+import tempfile
+import subprocess
+from time import time
+from pathlib import Path
+from datetime import datetime
+from utils.executor import get_executor
+
+logger = logging.getLogger(__name__)
+
+# Already compressed payloads : asking rsync/ssh to compress them only costs CPU
+MEDIA_SUFFIXES = ['mp4', 'm4v', 'm4a', 'mov', 'mkv', 'webm', 'avi', 'mpg', 'mpeg', 'ts', 'mp3', 'aac', 'jpg', 'png', 'gz', 'zip']
+CONTROL_PERSIST = 600
+# directory (relative to the destination) of the partial files of the uploads
+PARTIAL_DIR = '.rsync-partial'
+
+
+class TransferStats():
+    """Bytes and time spent by the transfers of a session"""
+
+    def __init__(self):
+        self.files = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        self.batches = 0
+
+    def add(self, files, nbytes, seconds):
+        self.files += files
+        self.bytes += nbytes
+        self.seconds += seconds
+        self.batches += 1
+
+    def throughput(self):
+        """Average throughput in bytes per second"""
+        return self.bytes / self.seconds if self.seconds else 0.0
+
+    def asdict(self):
+        return {
+            'files': self.files,
+            'bytes': self.bytes,
+            'seconds': self.seconds,
+            'batches': self.batches,
+            'throughput': self.throughput(),
+        }
+
+
+def _size(paths):
+    return sum(Path(p).stat().st_size for p in paths if Path(p).exists())
+
+
+class LocalTransfer():
+    """Transfers from and to a plain directory (a mounted share or a test folder)"""
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+        self.stats = TransferStats()
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def open(self):
+        return self
+
+    def close(self):
+        pass
+
+    def download(self, names, local_dir):
+        """Copy the files `names` of the directory into `local_dir` and return their local paths"""
+        local_dir = Path(local_dir)
+        start = time()
+        paths = []
+        for name in names:
+            path = local_dir / name
+            shutil.copy2(self.directory / name, path)
+            paths.append(path)
+        self.stats.add(len(paths), _size(paths), time() - start)
+        return paths
+
+    def upload(self, paths):
+        """Copy the local files `paths` into the directory, under the same names"""
+        start = time()
+        for path in paths:
+            destination = self.directory / Path(path).name
+            tmp = destination.with_name(f".{destination.name}.part")
+            shutil.copy2(path, tmp)
+            os.replace(tmp, destination)
+        self.stats.add(len(paths), _size(paths), time() - start)
+
+    def list(self, names):
+        """Size and modification time of the files `names` that exist in the directory"""
+        entries = {}
+        for name in names:
+            path = self.directory / name
+            if path.exists():
+                stat = path.stat()
+                entries[name] = {'size': stat.st_size, 'mtime': int(stat.st_mtime)}
+        return entries
+
+    def probe(self, name, ffprobe='ffprobe'):
+        """Triage probe (see utils/triage.py) of the file `name`, without copying it"""
+        from utils.triage import probe
+        try:
+            return probe(self.directory / name, ffprobe)
+        except (subprocess.CalledProcessError, ValueError):
+            return None
+
+
+class RsyncTransfer():
+    """Transfers with rsync, batched with `--files-from`.
+
+    `remote` is either `[user@]host:/directory`, in which case every rsync call of the session
+    goes through the same multiplexed ssh connection (ControlMaster) so that the handshake and
+    the authentication are only paid once, or `rsync://host/module` for an rsync daemon.
+    The media files are never compressed.
+    """
+
+    def __init__(self, remote, control_dir=None, persist=CONTROL_PERSIST):
+        self.remote = remote.rstrip('/')
+        self.daemon = remote.startswith('rsync://')
+        self.host = None if self.daemon else self.remote.split(':', 1)[0]
+        self.persist = persist
+        self._control_dir = control_dir
+        self._tmp_dir = None
+        self.stats = TransferStats()
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _control_path(self):
+        # sockets paths are limited to ~100 characters, hence the short name
+        return str(Path(self._control_dir) / "%C")
+
+    def _ssh_options(self):
+        return [
+            '-o', 'ControlMaster=auto',
+            '-o', f"ControlPath={self._control_path()}",
+            '-o', f"ControlPersist={self.persist}",
+            '-o', 'Compression=no',
+        ]
+
+    def open(self):
+        """Start the master ssh connection shared by the transfers of the session"""
+        if self.daemon:
+            return self
+        if not self._control_dir:
+            self._tmp_dir = tempfile.mkdtemp(prefix='rsync-')
+            self._control_dir = self._tmp_dir
+        command = ['ssh', '-f', '-N', *self._ssh_options(), self.host]
+        logger.debug(f"open : {command}")
+        try:
+            get_executor().run(command, check=True)
+        except BaseException:
+            self.close()
+            raise
+        return self
+
+    def close(self):
+        """Stop the master ssh connection"""
+        if self.daemon or not self._control_dir:
+            return
+        command = ['ssh', '-O', 'exit', *self._ssh_options(), self.host]
+        get_executor().run(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        if self._tmp_dir:
+            shutil.rmtree(self._tmp_dir, ignore_errors=True)
+            self._tmp_dir = None
+            self._control_dir = None
+
+    def _rsync(self, args, files=None, options=()):
+        command = ['rsync', '-a', '-z', f"--skip-compress={'/'.join(MEDIA_SUFFIXES)}", *options]
+        if not self.daemon:
+            command.extend(['-e', ' '.join(['ssh', *self._ssh_options()])])
+        with tempfile.NamedTemporaryFile('w', suffix='.files') as list_file:
+            if files is not None:
+                list_file.write('\n'.join(files) + '\n')
+                list_file.flush()
+                command.append(f"--files-from={list_file.name}")
+            command.extend(args)
+            logger.debug(f"rsync : {command}")
+            return get_executor().run(command, check=True, stdout=subprocess.PIPE, text=True).stdout
+
+    def download(self, names, local_dir):
+        """Download the files `names` of the remote directory into `local_dir` in one rsync call"""
+        local_dir = Path(local_dir)
+        start = time()
+        # an interrupted download resumes from its partial file
+        self._rsync([f"{self.remote}/", f"{local_dir}/"], files=names, options=['--partial'])
+        paths = [local_dir / name for name in names]
+        self.stats.add(len(paths), _size(paths), time() - start)
+        return paths
+
+    def upload(self, paths):
+        """Upload the local files `paths` into the remote directory, one rsync call per local folder"""
+        start = time()
+        folders = {}
+        for path in paths:
+            path = Path(path)
+            folders.setdefault(path.parent, []).append(path.name)
+        for folder, names in folders.items():
+            # an upload replaces the source on the server : its partial file is kept aside and the
+            # files are only moved into place once all of them are complete
+            self._rsync([f"{folder}/", f"{self.remote}/"], files=names, options=[f"--partial-dir={PARTIAL_DIR}", '--delay-updates'])
+        self.stats.add(len(paths), _size(paths), time() - start)
+
+    def list(self, names):
+        """Size and modification time of the files `names` that exist in the remote directory"""
+        output = self._rsync(['--list-only', f"{self.remote}/"], files=names)
+        entries = {}
+        for line in output.splitlines():
+            # -rw-r--r--    123,456,789 2014/09/29 14:05:43 2014-09-29_14-05-43_v54294b1810a2c.mp4
+            parts = line.split(None, 4)
+            if len(parts) < 5 or parts[0].startswith('d'):
+                continue
+            size = int(parts[1].replace(',', '').replace('.', ''))
+            mtime = datetime.strptime(f"{parts[2]} {parts[3]}", '%Y/%m/%d %H:%M:%S').timestamp()
+            entries[parts[4]] = {'size': size, 'mtime': int(mtime)}
+        return entries
+
+    def probe(self, name, ffprobe='ffprobe'):
+        """Triage probe (see utils/triage.py) of the remote file `name`, run on the remote host through
+        the shared ssh connection with its own `ffprobe`. None for an rsync daemon, or if the probe fails.
+        """
+        from utils.triage import probe_command
+        if self.daemon:
+            return None
+        path = f"{self.remote.split(':', 1)[1]}/{name}"
+        command = ['ssh', *self._ssh_options(), self.host, shlex.join(probe_command(path, ffprobe))]
+        logger.debug(f"probe : {command}")
+        try:
+            return json.loads(get_executor().run(command, check=True, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True).stdout)
+        except (subprocess.CalledProcessError, ValueError):
+            return None
+
+
+def open_transfer(remote, **kwargs):
+    """Transfer session for `remote` : an rsync one for remote locations, a local one for a plain directory"""
+    if remote.startswith('rsync://') or (':' in remote and not Path(remote).exists()):
+        return RsyncTransfer(remote, **kwargs)
+    return LocalTransfer(remote)
@@ -0,0 +1,126 @@
+"""Triage of the sources on a single probe, before anything is downloaded or encoded.
+
+The bits per pixel per frame of a source (bitrate / (width x height x frame rate)), corrected by
+the efficiency of its codec, tells how far it is from what the encoding profile produces : a
+phone video at 20 Mbps shrinks a lot, an H.264 file already at a modest bitrate doesn't. The
+queue is sorted by expected savings and the sources below the efficiency threshold are deferred
+to the end of the queue (or skipped).
+"""
+
+import json
+import logging
+from statistics import median
+from fractions import Fraction
+from utils.executor import get_executor
+
+logger = logging.getLogger(__name__)
+
+# bits per pixel per frame of the x264 encodes of the profile (CRF 27, medium), for H.264 sources
+TARGET_BPP = 0.04
+# bits an H.264 encode needs for the same quality as one bit of each codec
+CODEC_EFFICIENCY = {
+    'h264': 1.0,
+    'hevc': 1.4,
+    'vp9': 1.3,
+    'av1': 1.6,
+    'mpeg4': 0.75,
+    'msmpeg4v3': 0.7,
+    'mpeg2video': 0.5,
+    'mjpeg': 0.2,
+    'prores': 0.1,
+}
+# below this H.264 equivalent bits per pixel, a source is not worth an encode
+MIN_BPP = 0.05
+ACTIONS = ['defer', 'skip']
+PROBE_ENTRIES = 'stream=codec_type,codec_name,profile,width,height,avg_frame_rate,r_frame_rate,bit_rate:format=duration,size,bit_rate'
+
+
+def probe_command(path, ffprobe='ffprobe'):
+    return [str(ffprobe), '-v', 'error', '-print_format', 'json', '-show_entries', PROBE_ENTRIES, str(path)]
+
+
+def probe(path, ffprobe='ffprobe'):
+    """Output of the one ffprobe call the triage needs"""
+    return json.loads(get_executor().check_output(probe_command(path, ffprobe)))
+
+
+def _frame_rate(stream):
+    for key in ['avg_frame_rate', 'r_frame_rate']:
+        num, _, den = stream.get(key, '0/0').partition('/')
+        if int(den or 1) and int(num):
+            return float(Fraction(int(num), int(den or 1)))
+    return None
+
+
+def video_info(probe):
+    """Codec, profile, resolution, frame rate, bitrate and bits per pixel per frame of a probed source"""
+    streams = probe.get('streams', [])
+    video = next((s for s in streams if s.get('codec_type') == 'video'), None)
+    if not video:
+        return None
+    format = probe.get('format', {})
+    duration = float(format['duration']) if format.get('duration') else None
+
+    bitrate = int(video['bit_rate']) if video.get('bit_rate') else None
+    if not bitrate and format.get('bit_rate'):
+        # the other streams are removed from the bitrate of the container
+        others = sum(int(s['bit_rate']) for s in streams if s is not video and s.get('bit_rate'))
+        bitrate = int(format['bit_rate']) - others
+    elif not bitrate and format.get('size') and duration:
+        bitrate = int(format['size']) * 8 / duration
+
+    width, height, frame_rate = int(video.get('width', 0)), int(video.get('height', 0)), _frame_rate(video)
+    bpp = bitrate / (width * height * frame_rate) if bitrate and width and height and frame_rate else None
+    return {
+        'codec': video.get('codec_name'),
+        'profile': video.get('profile'),
+        'width': width,
+        'height': height,
+        'frame_rate': frame_rate,
+        'duration': duration,
+        'bitrate': bitrate,
+        'bpp': bpp,
+    }
+
+
+def equivalent_bpp(info):
+    """Bits per pixel per frame an H.264 encode would need to match the source"""
+    if not info or info['bpp'] is None:
+        return None
+    return info['bpp'] * CODEC_EFFICIENCY.get(info['codec'], 1.0)
+
+
+def expected_ratio(info, target_bpp=TARGET_BPP):
+    """Expected size ratio of the encode of the source, None if it can't be estimated"""
+    bpp = equivalent_bpp(info)
+    return min(1.0, target_bpp / bpp) if bpp else None
+
+
+def calibrate(points, default=TARGET_BPP):
+    """Target bits per pixel learnt from the encodes already done : the median of `bpp x ratio`
+    over the `(equivalent bpp, actual ratio)` points (at least 5, the default otherwise)
+    """
+    values = [bpp * ratio for bpp, ratio in points if bpp and ratio]
+    return median(values) if len(values) >= 5 else default
+
+
+def triage(sources, min_bpp=MIN_BPP, target_bpp=TARGET_BPP):
+    """Sort the sources by expected savings and split off the already efficient ones.
+
+    `sources` maps each name to its size in bytes and its `video_info` (None when the probe failed).
+    Returns `(queue, below)` : the names sorted from the biggest expected savings to the smallest
+    (the sources that couldn't be probed last), and the names whose H.264 equivalent bits per
+    pixel is below `min_bpp`.
+    """
+    queue, unknown, below = [], [], []
+    for name, (size, info) in sources.items():
+        bpp = equivalent_bpp(info)
+        if bpp is None:
+            unknown.append(name)
+        elif bpp < min_bpp:
+            below.append(name)
+        else:
+            queue.append((size * (1 - expected_ratio(info, target_bpp)), name))
+    queue.sort(key=lambda entry: entry[0], reverse=True)
+    logger.info(f"triage : {len(queue)} sources sorted by expected savings, {len(below)} below {min_bpp} bpp, {len(unknown)} not probed")
+    return [name for _, name in queue] + unknown, below
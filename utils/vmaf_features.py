@@ -0,0 +1,198 @@
+import json
+import logging
+import argparse
+import tempfile
+from pathlib import Path
+from functools import lru_cache
+from utils.settings import get_settings
+from utils.command import ffmpeg
+from utils.executor import get_executor
+
+logger = logging.getLogger(__name__)
+
+
+def _escape(value):
+    """Escape a value for an option of a filter in a filtergraph"""
+    return str(value).replace('\\', '\\\\').replace(':', '\\:').replace("'", "\\'")
+
+
+def extract_features(reference, distorted, output, models=None, n_threads=0, loglevel='quiet'):
+    """Run libvmaf once and store the per-frame elementary features (VIF scales, ADM, motion...)
+    of every model in `models` in the compressed numpy file `output`.
+    The features are then enough to compute the score of any of these models with `score()`.
+    """
+    import numpy as np
+
+    settings = get_settings()
+    models = models if models else list(settings.vmaf_models.values())
+    model_option = '|'.join(f"path={_escape(model)}" for model in models)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        log_path = Path(tmp_dir) / 'vmaf.json'
+        command = ffmpeg(settings.ffmpeg, loglevel=loglevel) \
+            .with_input(distorted) \
+            .with_input(reference) \
+            .with_filtergraph(
+                "[0:v]setpts=PTS-STARTPTS[dist];[1:v]setpts=PTS-STARTPTS[ref];"
+                f"[dist][ref]libvmaf=model='{model_option}':log_fmt=json:log_path={_escape(log_path)}:n_threads={n_threads}") \
+            .with_options({'-f': 'null'}) \
+            .with_output('-')
+        logger.debug(f'extract_features : {command}')
+        get_executor().run(command.argv(), check=True)
+
+        with open(log_path, 'r') as fd:
+            frames = json.load(fd)['frames']
+
+    names = sorted({name for frame in frames for name in frame['metrics']})
+    features = {name: np.array([frame['metrics'].get(name, np.nan) for frame in frames], dtype=np.float32) for name in names}
+    np.savez_compressed(output, **features)
+    return features
+
+
+def load_features(path):
+    import numpy as np
+
+    with np.load(path) as data:
+        return {name: data[name] for name in data.files}
+
+
+def _feature_key(name, options=None):
+    """Name of the libvmaf log entry of a model feature :
+    `VMAF_integer_feature_adm2_score` with `{'adm_enhn_gain_limit': 1.0}` -> `integer_adm2_egl_1`
+    """
+    key = name[len('VMAF_'):] if name.startswith('VMAF_') else name
+    key = key[:-len('_score')] if key.endswith('_score') else key
+    key = key.replace('feature_', '')
+    if options:
+        for option, value in sorted(options.items()):
+            if option.endswith('enhn_gain_limit'):
+                key += f"_egl_{value:g}"
+    return key
+
+
+class VmafModel():
+    """A VMAF model (libsvm nu-SVR with an RBF kernel and a linear normalisation) applied with NumPy"""
+
+    def __init__(self, path):
+        import numpy as np
+
+        with open(path, 'r') as fd:
+            model_dict = json.load(fd)['model_dict']
+
+        options = model_dict.get('feature_opts_dicts') or [None] * len(model_dict['feature_names'])
+        self.path = str(path)
+        self.feature_keys = [_feature_key(name, opts) for name, opts in zip(model_dict['feature_names'], options)]
+        self.slopes = np.array(model_dict['slopes'], dtype=np.float64)
+        self.intercepts = np.array(model_dict['intercepts'], dtype=np.float64)
+        self.norm_type = model_dict.get('norm_type', 'none')
+        self.score_clip = model_dict.get('score_clip')
+        self.score_transform = model_dict.get('score_transform')
+
+        header, _, vectors = model_dict['model'].partition('\nSV\n')
+        params = dict(line.split(' ', 1) for line in header.splitlines() if ' ' in line)
+        self.gamma = float(params['gamma'])
+        self.rho = float(params['rho'])
+
+        coefs = []
+        support_vectors = []
+        for line in vectors.strip().splitlines():
+            parts = line.split()
+            coefs.append(float(parts[0]))
+            vector = [0.0] * len(self.feature_keys)
+            for part in parts[1:]:
+                index, value = part.split(':')
+                vector[int(index) - 1] = float(value)
+            support_vectors.append(vector)
+        self.coefs = np.array(coefs)
+        self.support_vectors = np.array(support_vectors)
+
+    def _feature(self, features, key):
+        if key in features:
+            return features[key]
+        # float feature extractors are logged without the `integer_` prefix and vice versa
+        alternative = key[len('integer_'):] if key.startswith('integer_') else f"integer_{key}"
+        if alternative in features:
+            return features[alternative]
+        raise KeyError(f"The feature {key} needed by {self.path} was not extracted")
+
+    def predict(self, features, transform=False, clip=True):
+        """Per-frame scores of the model computed from the elementary features.
+        The score transform is disabled by default, like in libvmaf.
+        """
+        import numpy as np
+
+        x = np.stack([np.asarray(self._feature(features, key), dtype=np.float64) for key in self.feature_keys], axis=1)
+        if self.norm_type == 'linear_rescale':
+            x = x * self.slopes[1:] + self.intercepts[1:]
+
+        sq_dist = (x ** 2).sum(axis=1)[:, None] + (self.support_vectors ** 2).sum(axis=1)[None, :] - 2 * x @ self.support_vectors.T
+        prediction = np.exp(-self.gamma * np.maximum(sq_dist, 0)) @ self.coefs - self.rho
+
+        if self.norm_type == 'linear_rescale':
+            prediction = (prediction - self.intercepts[0]) / self.slopes[0]
+
+        if transform and self.score_transform:
+            t = self.score_transform
+            transformed = float(t.get('p0', 0)) + float(t.get('p1', 0)) * prediction + float(t.get('p2', 0)) * prediction ** 2
+            if str(t.get('out_gte_in', 'false')).lower() == 'true':
+                transformed = np.maximum(transformed, prediction)
+            prediction = transformed
+
+        if clip and self.score_clip:
+            prediction = np.clip(prediction, *self.score_clip)
+        return prediction
+
+
+@lru_cache(maxsize=None)
+def load_model(path):
+    return VmafModel(path)
+
+
+def pool(scores):
+    """Pooled scores, computed like libvmaf"""
+    import numpy as np
+
+    return {
+        'mean': float(np.mean(scores)),
+        'harmonic_mean': float(len(scores) / np.sum(1.0 / (np.asarray(scores) + 1.0)) - 1.0),
+        'min': float(np.min(scores)),
+        'max': float(np.max(scores)),
+    }
+
+
+def score(features, model_path):
+    """Per-frame and pooled scores of the model `model_path` for already extracted features
+    (a dict or the path of the file written by `extract_features`)
+    """
+    if not isinstance(features, dict):
+        features = load_features(features)
+    scores = load_model(str(model_path)).predict(features)
+    return scores, pool(scores)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Extract the VMAF elementary features once, then score them with any model")
+    subparsers = parser.add_subparsers(dest='action', required=True)
+    extract = subparsers.add_parser('extract', help="run libvmaf and store the per-frame features")
+    extract.add_argument('reference')
+    extract.add_argument('distorted')
+    extract.add_argument('output', help="features file (.npz)")
+    extract.add_argument('--model', action='append', help="model whose features are needed (default : all the models of the .env file)")
+    extract.add_argument('--n-threads', type=int, default=0)
+    apply = subparsers.add_parser('score', help="compute the scores of models from stored features")
+    apply.add_argument('features', help="features file (.npz)")
+    apply.add_argument('models', nargs='*', help="model files (default : all the models of the .env file)")
+    parser.add_argument('--log-level', default='info')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=getattr(logging, args.log_level.upper(), 'INFO'))
+    if args.action == 'extract':
+        extract_features(args.reference, args.distorted, args.output, args.model, args.n_threads)
+    else:
+        features = load_features(args.features)
+        for model in args.models or get_settings().vmaf_models.values():
+            print(model, json.dumps(score(features, model)[1]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,221 @@
+"""Scratch space of the jobs and crash-safe writes.
+
+Each job works in its own directory (`Workspace`), on a tmpfs when its expected size fits, so that
+concurrent runs don't clobber each other's extracts and logs. The workspaces and the shared cache
+(scene scores, keyframe indexes...) live under one root that is kept under a disk quota, the least
+recently used cache entries being removed first. The workspaces left by dead processes are removed
+when a new workspace is created.
+
+Outputs are written next to their final path and renamed once complete (`atomic_write()`,
+`atomic_output()`), so a crash never leaves a partial file that would be taken as a cache hit.
+"""
+
+import os
+import json
+import shutil
+import socket
+import hashlib
+import logging
+import tempfile
+from time import time
+from pathlib import Path
+from contextlib import contextmanager
+from utils.settings import get_settings
+
+logger = logging.getLogger(__name__)
+
+FAST_VOLUMES = ['/dev/shm']
+# part of the free space of a tmpfs a workspace may use : the rest is the RAM of the jobs
+FAST_VOLUME_SHARE = 0.5
+DEFAULT_QUOTA = 20 * 1024 ** 3
+OWNER_FILE = '.owner.json'
+
+_collected = set()
+
+
+def _parse_size(value):
+    """Size in bytes of a value such as `20G`, `500M` or `1048576`"""
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+    value = str(value).strip().upper().rstrip('B')
+    if value and value[-1] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+    return int(value)
+
+
+def workspace_root():
+    """Directory of the workspaces and of the cache (`workspace_root` of the .env file, `tmp/` by default)"""
+    settings = get_settings()
+    return Path(settings.config.get('workspace_root') or settings.tmp_dir)
+
+
+def workspace_quota():
+    value = get_settings().config.get('workspace_quota')
+    return _parse_size(value) if value else DEFAULT_QUOTA
+
+
+def fast_volume(size_hint):
+    """A tmpfs volume where `size_hint` bytes fit, or None"""
+    if not size_hint:
+        return None
+    for volume in FAST_VOLUMES:
+        if os.path.isdir(volume) and os.access(volume, os.W_OK):
+            if shutil.disk_usage(volume).free * FAST_VOLUME_SHARE > size_hint:
+                return Path(volume) / 'video-encoding'
+    return None
+
+
+@contextmanager
+def atomic_output(path):
+    """Path where to write `path` (a `.part` file with the same extension, for the ffmpeg muxers),
+    renamed to `path` if the block succeeds and removed otherwise
+    """
+    path = Path(path)
+    part = path.with_name(f".{path.stem}.{os.getpid()}.part{path.suffix}")
+    try:
+        yield part
+        os.replace(part, path)
+    finally:
+        if part.exists():
+            part.unlink()
+
+
+@contextmanager
+def atomic_write(path, mode='w'):
+    """Open `path` for writing through a temporary file renamed once the content is complete"""
+    with atomic_output(path) as part:
+        with open(part, mode) as fd:
+            yield fd
+            fd.flush()
+            os.fsync(fd.fileno())
+
+
+def _size(path):
+    if path.is_file():
+        return path.stat().st_size
+    return sum(f.stat().st_size for f in path.rglob('*') if f.is_file())
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _owner(directory):
+    try:
+        with open(directory / OWNER_FILE, 'r') as fd:
+            return json.load(fd)
+    except (OSError, ValueError):
+        return None
+
+
+def _is_abandoned(directory):
+    """A workspace of this host whose process is dead (or whose owner file was never written)"""
+    owner = _owner(directory)
+    if owner is None:
+        return directory.stat().st_mtime < time() - 3600
+    return owner['host'] == socket.gethostname() and not _pid_alive(owner['pid'])
+
+
+def collect_garbage(root=None):
+    """Remove the workspaces left by the processes of this host that are dead, under the root and on the tmpfs volumes"""
+    root = Path(root) if root else workspace_root()
+    bases = [root, *[Path(volume) / 'video-encoding' for volume in FAST_VOLUMES]]
+    removed = 0
+    for directory in [d for base in bases for d in (base / 'workspaces').glob('*')]:
+        if directory.is_dir() and _is_abandoned(directory):
+            logger.info(f"Removing the abandoned workspace {directory}")
+            shutil.rmtree(directory, ignore_errors=True)
+            removed += 1
+    return removed
+
+
+def enforce_quota(root=None, quota=None, keep=()):
+    """Remove the least recently used cache entries until the workspaces and the cache fit in `quota` bytes.
+    The workspaces of running jobs, the entries being written (`.part` files) and the `keep` paths are never removed.
+    """
+    root = Path(root) if root else workspace_root()
+    quota = quota if quota else workspace_quota()
+    keep = {Path(path) for path in keep}
+    entries = [p for p in (root / 'cache').glob('*')]
+    used = sum(_size(p) for p in entries) + sum(_size(p) for p in (root / 'workspaces').glob('*'))
+    for entry in sorted(entries, key=lambda p: p.stat().st_mtime):
+        if entry in keep or entry.name.startswith('.'):
+            continue
+        if used <= quota:
+            break
+        size = _size(entry)
+        logger.info(f"Quota of {quota} bytes exceeded : removing the cache entry {entry.name}")
+        shutil.rmtree(entry) if entry.is_dir() else entry.unlink()
+        used -= size
+    if used > quota:
+        logger.warning(f"The workspaces of {root} use {used} bytes, more than the quota of {quota} bytes")
+    return used
+
+
+def identity(input):
+    """Identity of an input file : its path, size and modification time"""
+    input = Path(input).resolve()
+    stat = input.stat()
+    return hashlib.sha1(f"{input}\0{stat.st_size}\0{stat.st_mtime_ns}".encode()).hexdigest()[:16]
+
+
+def cache_path(input, kind, root=None):
+    """Path of the cached `kind` (e.g. `scenescores.json`) of the file `input`.
+    The path depends on the identity of the file, not only on its name, and a hit refreshes its
+    position in the LRU order of the quota.
+    """
+    root = Path(root) if root else workspace_root()
+    directory = root / 'cache'
+    directory.mkdir(parents=True, exist_ok=True)
+    path = directory / f"{Path(input).stem}.{identity(input)}.{kind}"
+    if path.exists():
+        os.utime(path)
+    return path
+
+
+class Workspace():
+    """Scratch directory of one job, removed when the job ends (unless `keep`).
+
+    `size_hint` is the number of bytes the job is expected to write : the workspace is created on
+    a tmpfs if it fits there, under the workspace root otherwise.
+    """
+
+    def __init__(self, name, size_hint=0, keep=False, root=None, quota=None):
+        root = Path(root) if root else workspace_root()
+        if root not in _collected:
+            collect_garbage(root)
+            enforce_quota(root, quota)
+            _collected.add(root)
+
+        base = fast_volume(size_hint) or root
+        (base / 'workspaces').mkdir(parents=True, exist_ok=True)
+        self.path = Path(tempfile.mkdtemp(prefix=f"{name}.{os.getpid()}.", dir=base / 'workspaces'))
+        self.keep = keep
+        with atomic_write(self.path / OWNER_FILE) as fd:
+            fd.write(json.dumps({'host': socket.gethostname(), 'pid': os.getpid(), 'name': name, 'started': time()}))
+        logger.debug(f"Workspace {self.path}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __truediv__(self, name):
+        return self.path / name
+
+    def subdir(self, name):
+        directory = self.path / name
+        directory.mkdir(parents=True, exist_ok=True)
+        return directory
+
+    def close(self):
+        if self.keep:
+            logger.info(f"Temporary files kept in {self.path}")
+        else:
+            shutil.rmtree(self.path, ignore_errors=True)